@@ -1,13 +1,18 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 import os
 import base64
-import pandas as pd  # For handling CSV files
 from flask_cors import CORS  # Import CORS
 from werkzeug.utils import secure_filename  # Import secure_filename
+from qr_tokens import qr_token_service, verified_upload_name
+from metrics import metrics
+from audit_log import get_audit_log, migrate_log
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
+# Reject uploads that do not carry a valid upload grant from a scanned QR token
+REQUIRE_QR_TOKEN = os.environ.get("REQUIRE_QR_TOKEN", "0") == "1"
+
 # Ensure the "uploads" folder exists
 UPLOAD_FOLDER = 'uploads'
 if not os.path.exists(UPLOAD_FOLDER):
@@ -17,11 +22,28 @@ if not os.path.exists(UPLOAD_FOLDER):
 @app.route('/get_attendance', methods=['GET'])
 def get_attendance():
     try:
-        df = pd.read_csv('attendance.csv')  # Modify filename if needed
-        return jsonify(df.to_dict(orient='records'))
+        return jsonify(get_audit_log().read_rows())
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Route for issuing rotating QR tokens to the teacher page
+@app.route('/qr_token', methods=['GET'])
+def issue_qr_token():
+    subject = request.args.get('subject', '').strip()
+    if not subject:
+        return jsonify({'error': 'Missing subject'}), 400
+    return jsonify(qr_token_service.issue(subject))
+
+# Route for exchanging a just-scanned QR token for an upload grant
+@app.route('/qr_grant', methods=['POST'])
+def issue_qr_grant():
+    data = request.get_json(silent=True) or {}
+    grant = qr_token_service.issue_grant(data.get('token') or '', subject=data.get('subject') or None)
+    metrics.count("qr_verifications", valid=grant['valid'])
+    if not grant['valid']:
+        return jsonify({'error': grant['message']}), 403
+    return jsonify(grant)
+
 # Route for handling image uploads
 @app.route('/upload', methods=['POST'])
 def upload_file():
@@ -37,6 +59,18 @@ def upload_file():
         # Make sure filename is safe
         filename = secure_filename(filename)
         
+        # Verify the grant the student's QR scan was exchanged for before accepting the upload
+        upload_grant = data.get('upload_grant')
+        if upload_grant or REQUIRE_QR_TOKEN:
+            roll_number = os.path.splitext(filename)[0].split('_')[0]
+            verification = qr_token_service.verify_grant_and_consume(upload_grant or '', roll_number,
+                                                                     subject=data.get('subject') or None)
+            metrics.count("upload_grants", valid=verification['valid'])
+            if not verification['valid']:
+                app.logger.warning(f"Rejected upload {filename}: {verification['message']}")
+                return jsonify({'error': verification['message']}), 403
+            filename = verified_upload_name(filename, verification['subject'])
+        
         # Ensure we're using the correct uploads directory path
         # Use an absolute path to the backend/uploads directory
         upload_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads")
@@ -51,8 +85,10 @@ def upload_file():
             image_data = image_data.split(',')[1]
         
         # Decode and save the image
-        with open(file_path, 'wb') as f:
-            f.write(base64.b64decode(image_data))
+        with metrics.stage("upload_write"):
+            with open(file_path, 'wb') as f:
+                f.write(base64.b64decode(image_data))
+        metrics.count("uploads")
         
         # Log the upload
         app.logger.info(f"File saved to {file_path}")
@@ -63,5 +99,11 @@ def upload_file():
         app.logger.error(f"Upload error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+# Route for Prometheus scraping of upload timings and counters
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.prometheus(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
+    migrate_log()
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
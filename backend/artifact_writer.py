@@ -0,0 +1,202 @@
+import os
+import cv2
+import time
+import queue
+import atexit
+import random
+import shutil
+import logging
+import threading
+from metrics import metrics
+
+logger = logging.getLogger('artifact_writer')
+
+# Define constants directly in the module (no config import)
+ARTIFACT_QUEUE_SIZE = 256       # Jobs waiting for the writer thread before the drop policy kicks in
+ARTIFACT_JPEG_QUALITY = 90      # JPEG quality for debug/template images
+FLUSH_TIMEOUT = 10              # Seconds to wait for pending jobs at shutdown
+
+# Fraction of artifacts of each kind that are actually written. Kinds that are
+# not listed are always written.
+SAMPLE_RATES = {
+    "debug": 0.25,          # Face crops of recognition requests
+    "liveness_debug": 0.1   # Annotated liveness frames
+}
+
+# Kinds that may be dropped when the queue is full. Everything else (template
+# images, processed/failed moves) is required and runs inline instead.
+DROPPABLE_KINDS = {"debug", "liveness_debug"}
+
+
+class ArtifactWriter:
+    """Background thread for JPEG encoding, debug writes and file moves
+
+    Keeps disk IO off the recognition path. The queue is bounded: when it is
+    full, droppable artifacts (debug images) are discarded and required jobs
+    (template images, moves) fall back to running in the caller's thread.
+    """
+
+    def __init__(self, max_queue=ARTIFACT_QUEUE_SIZE, sample_rates=None, jpeg_quality=ARTIFACT_JPEG_QUALITY):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.sample_rates = dict(SAMPLE_RATES if sample_rates is None else sample_rates)
+        self.jpeg_quality = jpeg_quality
+
+        # Source paths of queued moves, so directory scanners can skip them
+        self.pending_paths = set()
+        self.lock = threading.Lock()
+        self.metrics = {
+            "queued": 0,
+            "written": 0,
+            "moved": 0,
+            "sampled_out": 0,
+            "dropped": 0,
+            "inline": 0,
+            "errors": 0,
+            "write_time": 0.0
+        }
+
+        self.thread = threading.Thread(target=self._run, name="artifact-writer", daemon=True)
+        self.thread.start()
+        atexit.register(self.flush, FLUSH_TIMEOUT)
+
+    def _count(self, name, amount=1):
+        with self.lock:
+            self.metrics[name] += amount
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                self._execute(job)
+            finally:
+                self.queue.task_done()
+
+    def _execute(self, job):
+        kind, fn, args, pending_path = job
+        start = time.perf_counter()
+        try:
+            fn(*args)
+        except Exception as e:
+            self._count("errors")
+            logger.error(f"Artifact job {kind} failed: {e}")
+        finally:
+            if pending_path is not None:
+                with self.lock:
+                    self.pending_paths.discard(pending_path)
+            elapsed = time.perf_counter() - start
+            self._count("write_time", elapsed)
+            metrics.observe(f"artifact_{kind}", elapsed)
+
+    def sampled(self, kind):
+        """Whether an artifact of this kind should be written at all"""
+        rate = self.sample_rates.get(kind, 1.0)
+        if rate >= 1.0 or random.random() < rate:
+            return True
+        self._count("sampled_out")
+        return False
+
+    def submit(self, kind, fn, *args, pending_path=None):
+        """Run fn(*args) on the writer thread
+
+        Returns:
+            True if the job was queued or ran inline, False if it was dropped
+        """
+        job = (kind, fn, args, pending_path)
+        if pending_path is not None:
+            with self.lock:
+                self.pending_paths.add(pending_path)
+
+        try:
+            self.queue.put_nowait(job)
+            self._count("queued")
+            return True
+        except queue.Full:
+            pass
+
+        if kind in DROPPABLE_KINDS:
+            self._count("dropped")
+            metrics.count("artifacts_dropped", kind=kind)
+            return False
+
+        # Required work is never lost: do it here rather than wait for the queue
+        self._count("inline")
+        self._execute(job)
+        return True
+
+    def _write_image(self, path, image):
+        extension = os.path.splitext(path)[1] or ".jpg"
+        ok, buffer = cv2.imencode(extension, image, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        if not ok:
+            raise ValueError(f"Could not encode {path}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(buffer.tobytes())
+        self._count("written")
+
+    def write_image(self, path, image, kind="debug"):
+        """Queue an image write (encoded by extension); the caller must not modify image afterwards
+
+        Returns:
+            True if the image will be written, False if it was sampled out or dropped
+        """
+        if not self.sampled(kind):
+            return False
+        return self.submit(kind, self._write_image, path, image)
+
+    def _move(self, src, dst):
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        shutil.move(src, dst)
+        self._count("moved")
+        logger.info(f"Moved {src} to {dst}")
+
+    def move(self, src, dst):
+        """Queue a file move; src is reported by is_pending until it is done"""
+        return self.submit("move", self._move, src, dst, pending_path=os.path.abspath(src))
+
+    def _remove(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+            logger.info(f"Removed {path}")
+
+    def remove(self, path):
+        """Queue a file deletion behind the jobs already queued, such as the write of the same file
+
+        Unlike other required jobs it never runs inline when the queue is
+        full, since that could delete the file before its queued write.
+        """
+        self.queue.put(("remove", self._remove, (path,), None))
+        self._count("queued")
+
+    def is_pending(self, path):
+        """Whether path is waiting to be moved away by the writer"""
+        with self.lock:
+            return os.path.abspath(path) in self.pending_paths
+
+    def flush(self, timeout=None):
+        """Wait until every queued job has run (or timeout seconds have passed)"""
+        deadline = None if timeout is None else time.time() + timeout
+        while self.queue.unfinished_tasks:
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def stats(self):
+        with self.lock:
+            return dict(self.metrics, queue_depth=self.queue.qsize(), pending_moves=len(self.pending_paths))
+
+    def after_fork(self):
+        """Give a forked child its own queue and writer thread (threads do not survive fork)"""
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self.lock = threading.Lock()
+        self.pending_paths = set()
+        self.thread = threading.Thread(target=self._run, name="artifact-writer", daemon=True)
+        self.thread.start()
+
+
+# Create singleton instance
+artifact_writer = ArtifactWriter()
+
+# Forked workers (prefork_server.py) must not share the writer queue and thread with the master
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=artifact_writer.after_fork)
@@ -0,0 +1,318 @@
+import os
+import json
+import time
+import uuid
+import base64
+import asyncio
+import logging
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from aiohttp import web, ClientSession, ClientTimeout, ClientError, ClientPayloadError
+from werkzeug.utils import secure_filename
+from qr_tokens import qr_token_service, verified_upload_name
+from metrics import metrics
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('async_frontend')
+
+# Define constants directly in the module (no config import)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+UPLOAD_FOLDER = os.path.join(BASE_DIR, "uploads")
+BACKEND_URL = os.environ.get("ATTENDANCE_BACKEND", "http://localhost:3000")   # attendance_app.py
+REQUIRE_QR_TOKEN = os.environ.get("REQUIRE_QR_TOKEN", "0") == "1"
+MAX_UPLOAD_BYTES = 20 * 1024**2      # Largest accepted request body
+POOL_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+STATS_TTL = 1.0                      # Seconds a backend /stats answer is reused for every poller
+STATS_PUSH_INTERVAL = 1.0            # Seconds between /stats checks while someone listens on /events
+HEARTBEAT_INTERVAL = 15.0            # Seconds between keep-alive comments on idle event streams
+SUBSCRIBER_QUEUE = 64                # Events buffered per slow listener before the oldest are dropped
+PARTIAL_SUFFIX = ".part"             # Upload folder scanners only pick up image extensions
+
+
+def save_upload(body, upload_dir):
+    """Parse an upload body and write the image under a temporary name (runs in the process pool)
+
+    JSON parsing and base64 decoding of multi-megabyte selfies are the CPU
+    work of an upload, so they happen here rather than on the event loop.
+
+    Returns:
+        (safe filename, upload grant or None, claimed subject or None, temporary path)
+    """
+    data = json.loads(body)
+    if not isinstance(data, dict) or 'image' not in data or 'filename' not in data:
+        raise ValueError("Missing required data")
+
+    filename = secure_filename(data['filename'])
+    if not filename:
+        raise ValueError("Invalid filename")
+
+    image_data = data['image']
+    if image_data.startswith('data:image'):
+        image_data = image_data.split(',')[1]
+
+    os.makedirs(upload_dir, exist_ok=True)
+    temp_path = os.path.join(upload_dir, f".{uuid.uuid4().hex}{PARTIAL_SUFFIX}")
+    with open(temp_path, 'wb') as f:
+        f.write(base64.b64decode(image_data))
+    return filename, data.get('upload_grant'), data.get('subject'), temp_path
+
+
+def recognize_upload(image_path):
+    """Run the attendance pipeline on one saved upload (runs in the process pool)"""
+    from attendance_app import process_image
+    return process_image(image_path)
+
+
+class EventHub:
+    """Server-sent event fan-out to every open /events stream
+
+    Each listener has a bounded queue; a listener too slow to keep up loses
+    its oldest events instead of growing memory or stalling the others.
+    """
+
+    def __init__(self):
+        self.subscribers = set()
+        self.last = {}     # event name -> last payload, replayed to new listeners
+
+    def publish(self, event, data):
+        self.last[event] = data
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait((event, data))
+
+    async def stream(self, request):
+        response = web.StreamResponse(headers={
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        })
+        await response.prepare(request)
+
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE)
+        for event, data in self.last.items():
+            queue.put_nowait((event, data))
+        self.subscribers.add(queue)
+        try:
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), HEARTBEAT_INTERVAL)
+                    await response.write(f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n".encode())
+                except asyncio.TimeoutError:
+                    await response.write(b": keep-alive\n\n")
+        except (ConnectionResetError, asyncio.CancelledError):
+            pass
+        finally:
+            self.subscribers.discard(queue)
+        return response
+
+
+class BackendStats:
+    """Cached, single-flight proxy of the recognition server's /stats
+
+    However many dashboards poll, the backend sees at most one request per
+    STATS_TTL; concurrent pollers wait on the same in-flight fetch.
+    """
+
+    def __init__(self, url, ttl=STATS_TTL):
+        self.url = url.rstrip("/") + "/stats"
+        self.ttl = ttl
+        self.session = None
+        self.value = None
+        self.fetched_at = 0.0
+        self.pending = None
+
+    async def _fetch(self):
+        if self.session is None:
+            self.session = ClientSession(timeout=ClientTimeout(total=5))
+        try:
+            async with self.session.get(self.url) as response:
+                self.value = await response.json()
+        except (ClientError, asyncio.TimeoutError, ValueError) as e:
+            self.value = {"error": f"Recognition server unavailable: {e}"}
+        self.fetched_at = time.time()
+        return self.value
+
+    async def get(self):
+        if self.value is not None and time.time() - self.fetched_at < self.ttl:
+            return self.value
+        if self.pending is None:
+            self.pending = asyncio.ensure_future(self._fetch())
+            self.pending.add_done_callback(lambda _: setattr(self, "pending", None))
+        return await asyncio.shield(self.pending)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+
+@web.middleware
+async def cors_middleware(request, handler):
+    """Allow the selfie and teacher pages to call us from another origin (as flask_cors does for app.py)"""
+    if request.method == "OPTIONS":
+        response = web.Response()
+    else:
+        response = await handler(request)
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    response.headers["Access-Control-Allow-Headers"] = "Content-Type"
+    response.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
+    return response
+
+
+async def upload(request):
+    app = request.app
+    if request.content_length and request.content_length > MAX_UPLOAD_BYTES:
+        return web.json_response({'error': 'Upload too large'}, status=413)
+
+    # Slow clients only cost a suspended coroutine while the body arrives
+    try:
+        body = await request.read()
+    except (ConnectionResetError, ClientPayloadError):
+        # The client gave up mid-upload; nothing was written
+        return web.Response(status=400)
+
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    try:
+        filename, upload_grant, subject, temp_path = await loop.run_in_executor(app["pool"], save_upload, body, app["upload_dir"])
+    except (ValueError, TypeError) as e:
+        return web.json_response({'error': str(e)}, status=400)
+    metrics.observe("upload_write", time.perf_counter() - start)
+
+    # Verify the grant the student's QR scan was exchanged for before accepting the upload
+    if upload_grant or REQUIRE_QR_TOKEN:
+        roll_number = os.path.splitext(filename)[0].split('_')[0]
+        verification = qr_token_service.verify_grant_and_consume(upload_grant or '', roll_number,
+                                                                 subject=subject or None)
+        metrics.count("upload_grants", valid=verification['valid'])
+        if not verification['valid']:
+            os.remove(temp_path)
+            logger.warning(f"Rejected upload {filename}: {verification['message']}")
+            return web.json_response({'error': verification['message']}, status=403)
+        filename = verified_upload_name(filename, verification['subject'])
+
+    # The rename makes the upload visible to the folder watchers in one step
+    file_path = os.path.join(app["upload_dir"], filename)
+    os.replace(temp_path, file_path)
+    metrics.count("uploads")
+    app["events"].publish("upload", {"filename": filename, "received_at": time.time()})
+    logger.info(f"File saved to {file_path}")
+
+    if app["recognize"]:
+        task = asyncio.ensure_future(recognize(app, file_path))
+        app["tasks"].add(task)
+        task.add_done_callback(app["tasks"].discard)
+
+    return web.json_response({'success': True, 'message': 'File uploaded successfully'})
+
+
+async def recognize(app, file_path):
+    """Recognize an upload in the pool and push the outcome to /events listeners"""
+    loop = asyncio.get_running_loop()
+    try:
+        result = await loop.run_in_executor(app["pool"], recognize_upload, file_path)
+    except Exception as e:
+        logger.error(f"Recognition of {file_path} failed: {e}")
+        result = {"success": False, "message": str(e)}
+    app["events"].publish("result", {"filename": os.path.basename(file_path), **result})
+
+
+async def stats(request):
+    return web.json_response(await request.app["backend_stats"].get())
+
+
+async def events(request):
+    return await request.app["events"].stream(request)
+
+
+async def qr_token(request):
+    subject = request.query.get('subject', '').strip()
+    if not subject:
+        return web.json_response({'error': 'Missing subject'}, status=400)
+    return web.json_response(qr_token_service.issue(subject))
+
+
+async def qr_grant(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        data = {}
+    grant = qr_token_service.issue_grant(data.get('token') or '', subject=data.get('subject') or None)
+    metrics.count("qr_verifications", valid=grant['valid'])
+    if not grant['valid']:
+        return web.json_response({'error': grant['message']}, status=403)
+    return web.json_response(grant)
+
+
+async def get_metrics(request):
+    return web.Response(text=metrics.prometheus(), content_type="text/plain")
+
+
+async def push_stats(app):
+    """Publish backend stats to /events listeners whenever they change"""
+    last = None
+    while True:
+        await asyncio.sleep(STATS_PUSH_INTERVAL)
+        if not app["events"].subscribers:
+            continue
+        value = await app["backend_stats"].get()
+        encoded = json.dumps(value, sort_keys=True, default=str)
+        if encoded != last:
+            last = encoded
+            app["events"].publish("stats", value)
+
+
+async def on_startup(app):
+    app["push_task"] = asyncio.ensure_future(push_stats(app))
+
+
+async def on_cleanup(app):
+    app["push_task"].cancel()
+    await app["backend_stats"].close()
+    app["pool"].shutdown(wait=False, cancel_futures=True)
+
+
+def create_app(upload_dir=UPLOAD_FOLDER, backend_url=BACKEND_URL, workers=POOL_WORKERS, recognize=False):
+    app = web.Application(client_max_size=MAX_UPLOAD_BYTES, middlewares=[cors_middleware])
+    app["upload_dir"] = upload_dir
+    # spawn: pool workers must not inherit the running event loop or its sockets
+    app["pool"] = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    app["events"] = EventHub()
+    app["backend_stats"] = BackendStats(backend_url)
+    app["recognize"] = recognize
+    app["tasks"] = set()
+
+    metrics.gauge("event_listeners", lambda: len(app["events"].subscribers))
+    app.router.add_post("/upload", upload)
+    app.router.add_get("/stats", stats)
+    app.router.add_get("/events", events)
+    app.router.add_get("/qr_token", qr_token)
+    app.router.add_post("/qr_grant", qr_grant)
+    app.router.add_get("/metrics", get_metrics)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="asyncio front end for uploads, stats and the event stream")
+    parser.add_argument("--host", default="0.0.0.0", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=5000, help="Port to listen on (app.py's port)")
+    parser.add_argument("--backend", default=BACKEND_URL, help="Recognition server whose /stats is proxied")
+    parser.add_argument("--upload-dir", default=UPLOAD_FOLDER, help="Folder uploads are written to")
+    parser.add_argument("--workers", type=int, default=POOL_WORKERS, help="Processes for decoding and recognition")
+    parser.add_argument("--recognize", action="store_true",
+                        help="Recognize uploads in the pool and push results on /events "
+                             "(only when no other process watches the upload folder)")
+    args = parser.parse_args()
+
+    web.run_app(
+        create_app(args.upload_dir, args.backend, args.workers, args.recognize),
+        host=args.host, port=args.port, access_log=None
+    )
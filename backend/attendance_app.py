@@ -4,15 +4,20 @@ import time
 import json
 import pandas as pd
 import threading
-import shutil
 import logging
 from datetime import datetime
-from flask import Flask, render_template, jsonify, request, send_file
+from flask import Flask, render_template, jsonify, request, send_file, Response
 
 # Import your existing components
 from face_detector import face_detector
 from liveness_detection import liveness_detector
 from database import attendance_db
+from audit_log import migrate_log
+from qr_decoder import process_kiosk_frame, process_kiosk_batch
+from artifact_writer import artifact_writer
+from image_archive import image_archive, parse_upload_name
+from job_scheduler import job_scheduler
+from metrics import metrics
 
 # Configure logging
 logging.basicConfig(
@@ -32,6 +37,23 @@ PROCESSED_FOLDER = os.path.join(BASE_DIR, "processed")
 REJECTED_FOLDER = os.path.join(BASE_DIR, "rejected")
 TEMPLATES_FOLDER = os.path.join(BASE_DIR, "templates")
 STATIC_FOLDER = os.path.join(BASE_DIR, "static")
+RETENTION_INTERVAL = 3600  # Seconds between archive retention passes
+
+# Metric labels of rejected uploads, by a fragment of the failure message; the
+# messages carry student IDs and exception text, the labels must stay a fixed set
+REJECTION_REASONS = [
+    ("Failed liveness check", "liveness"),
+    ("please retake the photo", "quality"),
+    ("No faces detected", "no_face"),
+    ("Multiple faces detected", "multiple_faces"),
+    ("Could not read image", "unreadable"),
+    ("Could not extract face features", "no_features"),
+    ("is not enrolled in", "not_enrolled"),
+    ("No students recognized", "no_match"),
+    ("No matching face", "no_match"),
+    ("registration failed", "registration_failed"),
+    ("Registration is paused", "registration_paused"),
+]
 
 # Create necessary directories
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -45,6 +67,13 @@ app = Flask(__name__,
             template_folder=TEMPLATES_FOLDER,
             static_folder=STATIC_FOLDER)
 
+# Queue depths and cache sizes are read only when /metrics is scraped
+metrics.gauge("artifact_queue_depth", lambda: artifact_writer.queue.qsize())
+metrics.gauge("embedding_cache_entries", lambda: len(face_detector.embedding_cache.entries))
+metrics.gauge("embedding_cache_hit_rate", lambda: face_detector.embedding_cache.stats()["hit_rate"])
+metrics.gauge("gallery_generation", lambda: face_detector.gallery.generation)
+metrics.gauge("scheduler_queued", lambda: sum(job_scheduler.stats()["queued"].values()))
+
 # Global statistics - defined as a dictionary (not a class)
 stats = {
     "processed_count": 0,
@@ -83,9 +112,110 @@ def save_settings():
         logger.error(f"Error saving settings: {e}")
         return False
 
+# Group photos are uploaded as GROUP_<subject>[_anything].jpg
+GROUP_PREFIX = "GROUP_"
+
+def is_group_image(filename):
+    """Check whether an uploaded file is a classroom group photo"""
+    return filename.upper().startswith(GROUP_PREFIX)
+
+# Process a classroom group photo
+def process_group_image(image_path):
+    """Recognize every student in a group photo and mark them all in one write"""
+    filename = os.path.basename(image_path)
+    name_part = os.path.splitext(filename)[0][len(GROUP_PREFIX):]
+    subject = name_part.split("_")[0] if name_part else None
+    logger.info(f"Processing group photo: {filename} (subject={subject})")
+    
+    global stats
+    stats["processed_count"] += 1
+    stats["last_processed"] = filename
+    
+    try:
+        result = face_detector.recognize_group(image_path, subject=subject)
+        
+        if result.get("retry"):
+            # A gallery shard is down: leave the photo for the next pass
+            logger.warning(f"Deferring group photo {filename}: {result.get('message')}")
+            return {"success": False, "retry": True, "message": result.get("message"), "filename": filename}
+        
+        if not result.get("success", False) or not result["matches"]:
+            logger.warning(f"No students recognized in group photo {filename}")
+            image_archive.archive_async(image_path, "rejected")
+            stats["rejected_count"] += 1
+            return {
+                "success": False,
+                "message": result.get("message", "No students recognized"),
+                "filename": filename
+            }
+        
+        student_ids = [m["student_id"] for m in result["matches"]]
+        attendance_db.mark_attendance_bulk(student_ids, status="Present", method="Group Photo", subject=subject)
+        
+        # Update stats
+        now = datetime.now().strftime("%H:%M:%S")
+        stats["successful_count"] += len(student_ids)
+        stats["last_recognized"] = student_ids[0]
+        for match in result["matches"]:
+            stats["recent_entries"].insert(0, {
+                "roll_number": match["student_id"],
+                "time": now,
+                "confidence": f"{match['confidence']:.2f}",
+                "method": "Group Photo",
+                "file": filename
+            })
+        del stats["recent_entries"][10:]
+        
+        image_archive.archive_async(image_path, "processed")
+        
+        return {
+            "success": True,
+            "message": "Group photo processed",
+            "subject": subject,
+            "faces_detected": result["faces_detected"],
+            "recognized_students": student_ids,
+            "unmatched_faces": len(result["unmatched_faces"]),
+            "filename": filename
+        }
+        
+    except Exception as e:
+        logger.error(f"Error processing group photo {filename}: {e}", exc_info=True)
+        try:
+            image_archive.archive_async(image_path, "rejected")
+        except:
+            pass
+        stats["rejected_count"] += 1
+        return {
+            "success": False,
+            "message": f"Error: {str(e)}",
+            "filename": filename
+        }
+
 # Process a single image
 def process_image(image_path, skip_liveness=None):
     """Process a single image for face recognition and attendance marking"""
+    group = is_group_image(os.path.basename(image_path))
+    with metrics.stage("process_group_image" if group else "process_image"):
+        result = process_group_image(image_path) if group else process_single_image(image_path, skip_liveness)
+    
+    if result.get("success"):
+        outcome, reason = "success", "ok"
+    elif result.get("retry"):
+        outcome, reason = "deferred", "shard_unavailable"
+    else:
+        outcome, reason = "rejected", rejection_reason(result.get("message") or "")
+    metrics.count("images", outcome=outcome, reason=reason)
+    return result
+
+def rejection_reason(message):
+    """Fixed metric label for a failure message (see REJECTION_REASONS)"""
+    for fragment, reason in REJECTION_REASONS:
+        if fragment in message:
+            return reason
+    return "error" if message.startswith("Error") else "other"
+
+def process_single_image(image_path, skip_liveness=None):
+    """Liveness check, recognition (or registration) and attendance for one upload"""
     if skip_liveness is None:
         skip_liveness = not system_settings.get("enableLiveness", False)
         
@@ -101,13 +231,13 @@ def process_image(image_path, skip_liveness=None):
         # Step 1: Check liveness if required
         if not skip_liveness:
             logger.info(f"Performing liveness check on {filename}")
-            liveness_result = liveness_detector.verify_liveness(image_path)
+            with metrics.stage("liveness"):
+                liveness_result = liveness_detector.verify_liveness(image_path)
             
             if not liveness_result.get("is_live", False):
                 logger.warning(f"Liveness check failed for {filename}")
-                # Move to rejected folder
-                rejected_path = os.path.join(REJECTED_FOLDER, filename)
-                shutil.move(image_path, rejected_path)
+                # Archive as rejected
+                image_archive.archive_async(image_path, "rejected")
                 stats["rejected_count"] += 1
                 return {
                     "success": False,
@@ -117,17 +247,41 @@ def process_image(image_path, skip_liveness=None):
         
         # Step 2: Recognize face
         logger.info(f"Performing face recognition on {filename}")
-        recognition_result = face_detector.recognize_face(image_path)
+        with metrics.stage("recognize"):
+            recognition_result = face_detector.recognize_face(image_path)
+        
+        student_id, subject = parse_upload_name(filename)
+        if recognition_result.get("retry"):
+            # A gallery shard is down: leave the upload for the next pass
+            logger.warning(f"Deferring {filename}: {recognition_result.get('message')}")
+            return {"success": False, "retry": True, "message": recognition_result.get("message"), "filename": filename}
+        if not recognition_result.get("success", False) and not recognition_result.get("no_match"):
+            # Not enrolled, failed quality gate, photo reused, ...: never registered
+            logger.warning(f"Face recognition failed for {filename}: {recognition_result.get('message')}")
+            image_archive.archive_async(image_path, "rejected")
+            stats["rejected_count"] += 1
+            return {
+                "success": False,
+                "message": recognition_result.get("message", "Face recognition failed"),
+                "filename": filename
+            }
         
-        if not recognition_result.get("success", False):
-            logger.warning(f"Face recognition failed for {filename}")
-            # Extract student ID from filename as fallback
-            filename_without_ext = os.path.splitext(filename)[0]
-            student_id = filename_without_ext.upper()
+        # Register only a first upload that matched nobody (empty gallery, or a
+        # student with no templates yet whose face matches no one else)
+        no_match = not recognition_result.get("success", False) or (
+            not any(s.get("passes_threshold") for s in recognition_result.get("student_ids", []))
+            and student_id and not face_detector.is_registered(student_id)
+        )
+        if no_match:
+            if not student_id:
+                image_archive.archive_async(image_path, "rejected")
+                stats["rejected_count"] += 1
+                return {"success": False, "message": "No matching face and no student ID in the filename",
+                        "filename": filename}
             
-            # Register this face
+            # Register this face (and enrol the student in the subject's roster)
             logger.info(f"Registering new face from {filename} as {student_id}")
-            register_result = face_detector.register_face(image_path, student_id)
+            register_result = face_detector.register_face(image_path, student_id, subject=subject)
             
             if register_result.get("success", False):
                 # Mark attendance
@@ -149,9 +303,8 @@ def process_image(image_path, skip_liveness=None):
                 if len(stats["recent_entries"]) > 10:
                     stats["recent_entries"].pop()
                 
-                # Move to processed folder
-                processed_path = os.path.join(PROCESSED_FOLDER, filename)
-                shutil.move(image_path, processed_path)
+                # Archive as processed
+                image_archive.archive_async(image_path, "processed")
                 
                 return {
                     "success": True,
@@ -160,9 +313,8 @@ def process_image(image_path, skip_liveness=None):
                     "filename": filename
                 }
             else:
-                # Move to rejected folder
-                rejected_path = os.path.join(REJECTED_FOLDER, filename)
-                shutil.move(image_path, rejected_path)
+                # Archive as rejected
+                image_archive.archive_async(image_path, "rejected")
                 stats["rejected_count"] += 1
                 return {
                     "success": False,
@@ -181,7 +333,8 @@ def process_image(image_path, skip_liveness=None):
                 attendance_db.mark_attendance(
                     student_id,
                     status="Present",
-                    method="Face Recognition"
+                    method="Face Recognition",
+                    confidence=confidence
                 )
                 
                 # Update stats
@@ -197,9 +350,8 @@ def process_image(image_path, skip_liveness=None):
                 if len(stats["recent_entries"]) > 10:
                     stats["recent_entries"].pop()
         
-        # Move to processed folder
-        processed_path = os.path.join(PROCESSED_FOLDER, filename)
-        shutil.move(image_path, processed_path)
+        # Archive as processed
+        image_archive.archive_async(image_path, "processed")
         
         return {
             "success": True,
@@ -211,9 +363,8 @@ def process_image(image_path, skip_liveness=None):
     except Exception as e:
         logger.error(f"Error processing {filename}: {e}", exc_info=True)
         try:
-            # Move to rejected folder
-            rejected_path = os.path.join(REJECTED_FOLDER, filename)
-            shutil.move(image_path, rejected_path)
+            # Archive as rejected
+            image_archive.archive_async(image_path, "rejected")
         except:
             pass
         stats["rejected_count"] += 1
@@ -223,21 +374,59 @@ def process_image(image_path, skip_liveness=None):
             "filename": filename
         }
 
+# Uploads handed to the scheduler and not finished yet, by the background
+# processor or /process_now, so neither queues a file the other already did
+queued_uploads = set()
+queued_lock = threading.Lock()
+
+def queue_upload(image_file, skip_liveness, priority):
+    """Submit an upload for processing unless it is already queued
+
+    Returns:
+        The job's Future, or None if the upload was already queued
+    """
+    with queued_lock:
+        if image_file in queued_uploads:
+            return None
+        queued_uploads.add(image_file)
+    
+    def unqueue(_future):
+        with queued_lock:
+            queued_uploads.discard(image_file)
+    
+    _, subject = parse_upload_name(image_file)
+    try:
+        future = job_scheduler.submit(process_image, os.path.join(UPLOAD_FOLDER, image_file),
+                                      skip_liveness=skip_liveness, priority=priority, subject=subject)
+    except Exception:
+        unqueue(None)
+        raise
+    future.add_done_callback(unqueue)
+    return future
+
 # Background worker function
 def background_processor():
     """Process images in the background"""
     logger.info("Starting background processor")
+    last_retention = 0
     
     while True:
         try:
+            # Apply archive retention policies once an hour
+            if time.time() - last_retention > RETENTION_INTERVAL:
+                image_archive.enforce_retention(debug_dir=os.path.join(BASE_DIR, "debug"))
+                last_retention = time.time()
+            
             # Get all image files in upload folder
             image_files = [f for f in os.listdir(UPLOAD_FOLDER) 
-                         if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+                         if f.lower().endswith(('.jpg', '.jpeg', '.png'))
+                         and not artifact_writer.is_pending(os.path.join(UPLOAD_FOLDER, f))
+                         and f not in queued_uploads]
             
             if image_files:
                 logger.info(f"Found {len(image_files)} images to process")
                 
-                # Process each image
+                # Queue each image as ingestion work, fairly per subject
                 for image_file in image_files:
                     image_path = os.path.join(UPLOAD_FOLDER, image_file)
                     
@@ -245,13 +434,9 @@ def background_processor():
                     try:
                         if os.path.getsize(image_path) == 0:
                             continue
-                            
-                        # Wait a moment to ensure the file is fully written
-                        time.sleep(0.5)
                         
-                        # Process the image
                         skip_liveness = not system_settings.get("enableLiveness", False)
-                        process_image(image_path, skip_liveness=skip_liveness)
+                        queue_upload(image_file, skip_liveness, priority="ingestion")
                     except Exception as e:
                         logger.error(f"Error processing {image_file}: {e}")
             
@@ -302,7 +487,13 @@ def get_stats():
             "last_processed": stats["last_processed"],
             "last_recognized": stats["last_recognized"],
             "recent_entries": stats["recent_entries"],
-            "settings": system_settings
+            "settings": system_settings,
+            "embedding_cache": face_detector.embedding_cache.stats(),
+            "artifact_writer": artifact_writer.stats(),
+            "archive": image_archive.stats(),
+            "scheduler": job_scheduler.stats(),
+            "embedding_model": {"version": face_detector.model_version, "database": os.path.basename(face_detector.db_path)},
+            "shared_gallery": face_detector.gallery.stats() if hasattr(face_detector.gallery, "stats") else None
         }
         
         return jsonify(response_data)
@@ -321,6 +512,13 @@ def get_stats():
             "error": str(e)
         })
 
+@app.route('/metrics')
+def get_metrics():
+    """Stage latency histograms and outcome counters (Prometheus text, or JSON with ?format=json)"""
+    if request.args.get('format') == 'json':
+        return jsonify(metrics.snapshot())
+    return Response(metrics.prometheus(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/update_settings', methods=['POST'])
 def update_settings():
     """Update system settings"""
@@ -348,23 +546,98 @@ def process_now():
         
         # Get all image files
         image_files = [f for f in os.listdir(UPLOAD_FOLDER) 
-                     if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+                     if f.lower().endswith(('.jpg', '.jpeg', '.png'))
+                     and not artifact_writer.is_pending(os.path.join(UPLOAD_FOLDER, f))]
         
-        results = []
+        # A teacher's backlog runs behind kiosk checks and fresh uploads; files
+        # the background processor already queued are left to it
+        futures = []
+        already_queued = []
         for image_file in image_files:
-            image_path = os.path.join(UPLOAD_FOLDER, image_file)
-            result = process_image(image_path, skip_liveness=not check_liveness)
-            results.append(result)
+            future = queue_upload(image_file, not check_liveness, priority="reprocessing")
+            if future is None:
+                already_queued.append(image_file)
+            else:
+                futures.append(future)
+        results = [future.result() for future in futures]
         
         return jsonify({
             "success": True,
             "processed_count": len(results),
+            "already_queued": already_queued,
             "results": results
         })
     except Exception as e:
         logger.error(f"Error in process_now: {e}")
         return jsonify({"success": False, "error": str(e)})
 
+@app.route('/import_roster', methods=['POST'])
+def import_roster():
+    """Import subject rosters from an uploaded CSV (Subject, Student ID columns)"""
+    try:
+        uploaded = request.files.get('file')
+        if uploaded is None:
+            return jsonify({"success": False, "error": "No roster file uploaded"}), 400
+        
+        roster_path = os.path.join(BASE_DIR, "known_faces", "roster_upload.csv")
+        uploaded.save(roster_path)
+        result = face_detector.roster.import_csv(roster_path, replace=request.form.get('replace') == 'true')
+        os.remove(roster_path)
+        return jsonify(result)
+    except Exception as e:
+        logger.error(f"Error importing roster: {e}", exc_info=True)
+        return jsonify({"success": False, "error": str(e)})
+
+@app.route('/kiosk_frame', methods=['POST'])
+def kiosk_frame():
+    """Verify a kiosk camera frame containing both the QR code and the student's face"""
+    try:
+        data = request.get_json() or {}
+        if 'image' not in data or 'roll_number' not in data:
+            return jsonify({"success": False, "error": "Missing image or roll_number"}), 400
+        
+        result = process_kiosk_frame(data['image'], data['roll_number'], subject=data.get('subject'))
+        return jsonify(result)
+    except Exception as e:
+        logger.error(f"Error in kiosk_frame: {e}", exc_info=True)
+        return jsonify({"success": False, "error": str(e)})
+
+@app.route('/kiosk_frames', methods=['POST'])
+def kiosk_frames():
+    """Verify a batch of kiosk frames, decoding QR codes in parallel"""
+    try:
+        data = request.get_json() or {}
+        frames = data.get('frames', [])
+        results = process_kiosk_batch(frames, subject=data.get('subject'))
+        return jsonify({"success": True, "processed_count": len(results), "results": results})
+    except Exception as e:
+        logger.error(f"Error in kiosk_frames: {e}", exc_info=True)
+        return jsonify({"success": False, "error": str(e)})
+
+@app.route('/archive/records')
+def archive_records():
+    """Look up archived uploads by student, subject, date and outcome"""
+    try:
+        records = image_archive.lookup(
+            student_id=request.args.get('student_id'),
+            subject=request.args.get('subject'),
+            date=request.args.get('date'),
+            outcome=request.args.get('outcome'),
+            limit=request.args.get('limit', 100, type=int)
+        )
+        return jsonify({"success": True, "count": len(records), "records": records})
+    except Exception as e:
+        logger.error(f"Error in archive_records: {e}")
+        return jsonify({"success": False, "error": str(e)})
+
+@app.route('/archive/thumbnail/<content_hash>')
+def archive_thumbnail(content_hash):
+    """Dashboard thumbnail of an archived upload"""
+    thumb_path = image_archive.thumbnail_path(content_hash)
+    if thumb_path is None:
+        return jsonify({"success": False, "error": "Thumbnail not found"}), 404
+    return send_file(thumb_path, mimetype='image/jpeg')
+
 @app.route('/download_attendance')
 def download_attendance():
     """Download attendance CSV file"""
@@ -732,6 +1005,9 @@ if __name__ == "__main__":
     print("Images placed in the uploads folder will be automatically processed")
     print("=" * 50)
     
+    # Bring an attendance.csv from the old layouts up to date before writing to it
+    migrate_log()
+    
     # Start background thread
     start_background_thread()
     
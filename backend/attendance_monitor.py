@@ -1,10 +1,14 @@
 import os
 import time
-import csv
-from datetime import datetime
+import threading
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 from face_detector import face_detector
+from image_archive import image_archive, parse_upload_name
+from job_scheduler import job_scheduler
+from artifact_writer import artifact_writer
+from cooldown_store import cooldown_store, CooldownStore
+from audit_log import get_audit_log, migrate_log
 import logging
 
 # Configure logging
@@ -16,11 +20,17 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 CONFIDENCE_THRESHOLD = 85  # Increase from default to require higher confidence
+STABILITY_INTERVAL = 0.2   # Seconds between size checks of files still being written
+STABLE_CHECKS = 2          # Consecutive unchanged, non-empty sizes that mean the write is complete
+DEDUPE_WINDOW = 60         # Seconds an already-processed (path, size, mtime) is ignored
+RETRY_DELAY = 5.0          # Seconds before an upload that could not be decided yet is processed again
+VERIFY_TIMEOUT = 120       # Seconds a verification blocks other uploads of the same student and subject
 
 class AttendanceTracker:
     def __init__(self):
         self.upload_dir = face_detector.upload_dir
-        self.csv_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "attendance.csv")
+        self.audit_log = get_audit_log()
+        self.csv_file = self.audit_log.path
         self.processed_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "processed")
         self.failed_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "failed")
         
@@ -28,61 +38,143 @@ class AttendanceTracker:
         os.makedirs(self.processed_dir, exist_ok=True)
         os.makedirs(self.failed_dir, exist_ok=True)
         
-        # Create CSV file if it doesn't exist
-        if not os.path.exists(self.csv_file):
-            with open(self.csv_file, 'w', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow(['Roll Number', 'Subject', 'Timestamp', 'Status', 'Confidence'])
-        
         logger.info(f"Attendance Tracker initialized. Monitoring folder: {self.upload_dir}")
         print(f"Attendance Tracker initialized. Monitoring folder: {self.upload_dir}")
         
         # Track recent submissions to prevent rapid duplicate attendance
-        self.recent_submissions = {}
-        self.cooldown_period = 300  # 5 minutes between submissions
+        # (shared with other monitor processes and kept across restarts)
+        self.recent_submissions = cooldown_store
+        self.cooldown_period = cooldown_store.ttl  # 5 minutes between submissions
+        # Submissions being verified right now, by any monitor process; expires
+        # after VERIFY_TIMEOUT in case the process verifying one died
+        self.verifying = CooldownStore(cooldown_store.path, ttl=VERIFY_TIMEOUT, table="verifying")
     
     def record_attendance(self, roll_number, subject, status, confidence=0):
-        """Record attendance in the CSV file"""
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        with open(self.csv_file, 'a', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow([roll_number, subject, timestamp, status, confidence])
+        """Record attendance in the shared audit log"""
+        self.audit_log.append({
+            "Student ID": roll_number,
+            "Subject": subject,
+            "Status": status,
+            "Method": "Face Verification",
+            "Confidence": confidence
+        })
         
         logger.info(f"Recorded attendance: {roll_number, subject, status, confidence}")
     
+    def record_attendance_bulk(self, records, subject, status):
+        """Record attendance for many students in a single write
+
+        Args:
+            records: List of (roll_number, confidence) tuples
+        """
+        self.audit_log.append([{
+            "Student ID": roll_number,
+            "Subject": subject,
+            "Status": status,
+            "Method": "Group Photo",
+            "Confidence": confidence
+        } for roll_number, confidence in records])
+        
+        logger.info(f"Recorded attendance for {len(records)} students in {subject}: {status}")
+    
+    def process_group_image(self, image_path, subject):
+        """Process a classroom group photo and mark every recognized student"""
+        result = face_detector.recognize_group(image_path, subject=subject)
+        
+        if result.get("retry"):
+            logger.warning(f"Retrying group photo {image_path} later: {result['message']}")
+            return None
+        
+        if not result["success"] or not result["matches"]:
+            logger.warning(f"No students recognized in group photo {image_path}: {result.get('message', '')}")
+            self._move_to_failed(image_path, "no students recognized")
+            return False
+        
+        records = []
+        for match in result["matches"]:
+            allowed, _ = self.recent_submissions.claim(f"{match['student_id']}_{subject}")
+            if allowed:
+                records.append((match["student_id"], match["confidence"]))
+        
+        if records:
+            self.record_attendance_bulk(records, subject, "Present (group)")
+        logger.info(f"Group photo for {subject}: {result['faces_detected']} faces, {len(records)} students marked")
+        self._move_to_processed(image_path)
+        return True
+    
     def process_image(self, image_path):
-        """Process an image to record attendance"""
+        """Process an image to record attendance
+
+        Returns:
+            True if attendance was marked, False if the upload was rejected,
+            None if it is left in the upload folder to be processed again
+        """
         try:
-            # Extract roll number and subject from filename
+            # Extract roll number and subject from filename (<roll>_<subject>_...)
             filename = os.path.basename(image_path)
-            name_part = os.path.splitext(filename)[0]
-            if "_" not in name_part:
+            roll_number, subject = parse_upload_name(filename)
+            
+            # Group photos are named GROUP_<subject>.jpg
+            if roll_number is None and subject:
+                return self.process_group_image(image_path, subject)
+            if not roll_number or not subject:
                 logger.error(f"Invalid filename format: {filename}")
-                self._move_to_failed(image_path)
+                self._move_to_failed(image_path, "invalid filename")
                 return False
-                
-            roll_number, subject = name_part.split("_", 1)
+            
             logger.info(f"Processing attendance for roll number: {roll_number}, subject: {subject}")
             
-            # Check for duplicate submission
+            # Another upload of this student and subject is being verified: it is
+            # only a duplicate if that one is accepted, so look again once it is done
             submission_key = f"{roll_number}_{subject}"
-            current_time = time.time()
+            if not self.verifying.claim(submission_key)[0]:
+                logger.info(f"Deferring {filename}: another submission for {submission_key} is being verified")
+                return None
             
-            if submission_key in self.recent_submissions:
-                last_submission = self.recent_submissions[submission_key]
-                time_since_last = current_time - last_submission
+            try:
+                # Check for duplicate submission; the claim is released on rejection
+                allowed, time_since_last = self.recent_submissions.claim(submission_key)
                 
-                if time_since_last < self.cooldown_period:
+                if not allowed:
                     logger.warning(f"Duplicate submission attempt for {submission_key} - {time_since_last:.1f} seconds since last attempt")
                     self.record_attendance(roll_number, subject, "Rejected (duplicate)", 0)
-                    self._move_to_failed(image_path)
+                    self._move_to_failed(image_path, "duplicate")
                     return False
-            
+                
+                present = False
+                try:
+                    present = self._verify_submission(image_path, roll_number, subject)
+                finally:
+                    if not present:
+                        self.recent_submissions.release(submission_key)
+                return present
+            finally:
+                self.verifying.release(submission_key)
+                
+        except Exception as e:
+            logger.error(f"Error processing image {image_path}: {str(e)}")
+            self._move_to_failed(image_path)
+            return False
+    
+    def _verify_submission(self, image_path, roll_number, subject):
+        """Verify the face against the claimed roll number and record the outcome"""
+        try:
             # Use face recognition to verify identity
             from face_detector import face_detector
             result = face_detector.recognize_face(image_path)
             
+            # The claimed student's gallery shard did not answer
+            if result.get("retry"):
+                logger.warning(f"Retrying {image_path} later: {result['message']}")
+                return None
+            
+            # The same photo was already submitted for another roll number
+            if result.get("shared_with"):
+                self.record_attendance(roll_number, subject, "Rejected (photo reused)", 0)
+                logger.warning(f"Photo for {roll_number} was also submitted for {result['shared_with']}")
+                self._move_to_failed(image_path, "photo reused")
+                return False
+            
             if result["success"]:
                 # Direct verification instead of searching for matches
                 if result["verified"]:
@@ -91,7 +183,6 @@ class AttendanceTracker:
                     self.record_attendance(roll_number, subject, "Present", confidence)
                     logger.info(f"Attendance marked PRESENT for {roll_number} in {subject} with confidence {confidence:.2f}%")
                     self._move_to_processed(image_path)
-                    self.recent_submissions[submission_key] = current_time
                     return True
                 else:
                     # Either not a match or didn't pass threshold
@@ -104,13 +195,13 @@ class AttendanceTracker:
                         
                     self.record_attendance(roll_number, subject, f"Rejected ({reason})", confidence)
                     logger.warning(f"Face verification failed: {reason}. Roll: {roll_number}, Best match: {result['best_match']}, Confidence: {confidence:.2f}%")
-                    self._move_to_failed(image_path)
+                    self._move_to_failed(image_path, reason)
                     return False
             else:
                 # Face detection/recognition failed
                 self.record_attendance(roll_number, subject, f"Rejected ({result['message']})", 0)
                 logger.error(f"Face recognition error: {result['message']}")
-                self._move_to_failed(image_path)
+                self._move_to_failed(image_path, result['message'])
                 return False
                 
         except Exception as e:
@@ -119,55 +210,161 @@ class AttendanceTracker:
             return False
     
     def _move_to_processed(self, image_path):
-        """Move processed image to processed directory"""
-        filename = os.path.basename(image_path)
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        new_filename = f"{timestamp}_{filename}"
-        new_path = os.path.join(self.processed_dir, new_filename)
-        
-        try:
-            os.rename(image_path, new_path)
-            logger.info(f"Moved {image_path} to {new_path}")
-        except Exception as e:
-            logger.error(f"Failed to move file {image_path}: {str(e)}")
-    
-    def _move_to_failed(self, image_path):
-        """Move failed image to failed directory"""
-        filename = os.path.basename(image_path)
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        new_filename = f"{timestamp}_{filename}"
-        new_path = os.path.join(self.failed_dir, new_filename)
-        
-        try:
-            os.rename(image_path, new_path)
-            logger.info(f"Moved {image_path} to {new_path}")
-        except Exception as e:
-            logger.error(f"Failed to move file {image_path}: {str(e)}")
+        """Archive a processed image (on the artifact writer thread)"""
+        image_archive.archive_async(image_path, "processed")
+    
+    def _move_to_failed(self, image_path, reason=None):
+        """Archive a failed image (on the artifact writer thread)"""
+        image_archive.archive_async(image_path, "failed", reason=reason)
 
 
 class ImageEventHandler(FileSystemEventHandler):
-    def __init__(self, attendance_tracker):
+    """Thin watchdog handler that hands finished uploads to the job scheduler
+
+    Events only record the path. A file is dispatched once it is known to be
+    complete: on a close-after-write event (inotify), when it is moved into the
+    folder, or when its size has stopped changing. Repeated events for a path
+    that is queued, being processed or was just processed are ignored.
+    """
+    
+    def __init__(self, attendance_tracker, scheduler=job_scheduler):
         self.attendance_tracker = attendance_tracker
         self.image_extensions = ['.jpg', '.jpeg', '.png']
+        
+        self.lock = threading.Lock()
+        self.pending = {}       # path -> (last size, unchanged checks)
+        self.in_progress = set()
+        self.recent = {}        # path -> ((size, mtime), processed at)
+        
+        # Uploads are ingestion work, queued fairly per subject behind kiosk checks
+        self.scheduler = scheduler
+        self.stopped = threading.Event()
+        self.stabilizer = threading.Thread(target=self._watch_pending, name="upload-stabilizer", daemon=True)
+        self.stabilizer.start()
     
-    def on_created(self, event):
-        if event.is_directory:
-            return
+    def _is_image(self, path):
+        return any(path.lower().endswith(ext) for ext in self.image_extensions)
+    
+    def _signature(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime
+    
+    def track(self, path):
+        """Remember a path that may still be being written"""
+        with self.lock:
+            if path not in self.in_progress:
+                self.pending.setdefault(path, (-1, 0))
+    
+    def enqueue(self, path):
+        """Queue a complete file for processing unless it is a duplicate event"""
+        signature = self._signature(path)
+        if signature is None or signature[0] == 0 or artifact_writer.is_pending(path):
+            return False
         
-        if any(event.src_path.lower().endswith(ext) for ext in self.image_extensions):
-            logger.info(f"New image detected: {event.src_path}")
+        with self.lock:
+            self.pending.pop(path, None)
+            if path in self.in_progress:
+                return False
             
-            # Wait a moment to ensure file is completely written
-            time.sleep(1)
+            recent = self.recent.get(path)
+            if recent is not None and recent[0] == signature and time.time() - recent[1] < DEDUPE_WINDOW:
+                return False
+            self.in_progress.add(path)
+        
+        logger.info(f"New image ready: {path}")
+        _, subject = parse_upload_name(path)
+        self.scheduler.submit(self._process, path, signature, priority="ingestion", subject=subject)
+        return True
+    
+    def _process(self, path, signature):
+        retry = False
+        try:
+            retry = self.attendance_tracker.process_image(path) is None
+        except Exception as e:
+            logger.error(f"Worker failed on {path}: {str(e)}")
+        finally:
+            with self.lock:
+                self.in_progress.discard(path)
+                now = time.time()
+                if not retry:
+                    self.recent[path] = (signature, now)
+                for old_path in [p for p, (_, t) in self.recent.items() if now - t > DEDUPE_WINDOW]:
+                    del self.recent[old_path]
+            if retry:
+                self._retry_later(path)
+    
+    def _retry_later(self, path):
+        """Track an upload that was left in place again after RETRY_DELAY"""
+        timer = threading.Timer(RETRY_DELAY, self.track, args=(path,))
+        timer.daemon = True
+        timer.start()
+    
+    def _watch_pending(self):
+        """Dispatch tracked files whose size has stopped changing"""
+        while not self.stopped.wait(STABILITY_INTERVAL):
+            with self.lock:
+                paths = list(self.pending.items())
             
-            # Process the image
-            self.attendance_tracker.process_image(event.src_path)
+            for path, (last_size, unchanged) in paths:
+                signature = self._signature(path)
+                if signature is None:
+                    with self.lock:
+                        self.pending.pop(path, None)
+                    continue
+                
+                size = signature[0]
+                unchanged = unchanged + 1 if size == last_size and size > 0 else 0
+                if unchanged >= STABLE_CHECKS:
+                    self.enqueue(path)
+                else:
+                    with self.lock:
+                        if path in self.pending:
+                            self.pending[path] = (size, unchanged)
+    
+    def scan_existing(self):
+        """Pick up files that arrived while the monitor was not running"""
+        upload_dir = self.attendance_tracker.upload_dir
+        for name in sorted(os.listdir(upload_dir)):
+            path = os.path.join(upload_dir, name)
+            if self._is_image(path):
+                self.track(path)
+    
+    def on_created(self, event):
+        if not event.is_directory and self._is_image(event.src_path):
+            self.track(event.src_path)
+    
+    def on_modified(self, event):
+        if not event.is_directory and self._is_image(event.src_path):
+            self.track(event.src_path)
+    
+    def on_closed(self, event):
+        # The writer closed the file: it is complete (Linux inotify only)
+        if not event.is_directory and self._is_image(event.src_path):
+            self.enqueue(event.src_path)
+    
+    def on_moved(self, event):
+        # Renamed into the folder (e.g. written to a temp name first): complete
+        if event.is_directory:
+            return
+        moved_into_folder = os.path.abspath(os.path.dirname(event.dest_path)) == os.path.abspath(self.attendance_tracker.upload_dir)
+        if moved_into_folder and self._is_image(event.dest_path):
+            self.enqueue(event.dest_path)
+        with self.lock:
+            self.pending.pop(event.src_path, None)
+    
+    def stop(self):
+        self.stopped.set()
+        self.scheduler.shutdown(wait=True)
 
 
 def start_monitoring():
     """Start monitoring the uploads folder"""
     attendance_tracker = AttendanceTracker()
     event_handler = ImageEventHandler(attendance_tracker)
+    event_handler.scan_existing()
     
     observer = Observer()
     observer.schedule(event_handler, path=attendance_tracker.upload_dir, recursive=False)
@@ -183,7 +380,9 @@ def start_monitoring():
         observer.stop()
     
     observer.join()
+    event_handler.stop()
 
 
 if __name__ == "__main__":
+    migrate_log()
     start_monitoring()
\ No newline at end of file
@@ -0,0 +1,308 @@
+import os
+import csv
+import io
+import sys
+import time
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+if sys.platform == "win32":
+    import msvcrt
+else:
+    import fcntl
+
+logger = logging.getLogger('audit_log')
+
+# Define constants directly in the module (no config import)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ATTENDANCE_LOG = os.path.join(BASE_DIR, "attendance.csv")
+AUDIT_COLUMNS = ["Student ID", "Subject", "Date", "Time", "Status", "Method", "Confidence", "QR Token"]
+FLUSH_INTERVAL = 1.0          # Seconds buffered rows may wait before they are written
+FLUSH_ROWS = 256              # Buffered rows that force an immediate write
+FSYNC_INTERVAL = 5.0          # Seconds between fsyncs of the log
+MAX_LOG_BYTES = 10 * 1024**2  # Rotate the log once it grows past this size
+LOG_BACKUPS = 5               # Rotated files kept (attendance.csv.1 ... .5)
+
+
+def lock_file(handle):
+    """Block until this process holds the exclusive lock on handle"""
+    if sys.platform == "win32":
+        handle.seek(0)
+        while True:
+            try:
+                msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                time.sleep(0.05)
+    else:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+
+
+def unlock_file(handle):
+    if sys.platform == "win32":
+        handle.seek(0)
+        msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+
+
+def legacy_row(row):
+    """Map a row from any of the older attendance.csv layouts to AUDIT_COLUMNS"""
+    row = {k.strip(): (v or "").strip() for k, v in row.items() if k}
+    date, clock = row.get("Date", ""), row.get("Time", "")
+    timestamp = row.get("Date and Time") or row.get("Timestamp")
+    if timestamp and not date:
+        date, _, clock = timestamp.partition(" ")
+    return {
+        "Student ID": row.get("Student ID") or row.get("Roll Number", ""),
+        "Subject": row.get("Subject", ""),
+        "Date": date,
+        "Time": clock,
+        "Status": row.get("Status", ""),
+        "Method": row.get("Method", ""),
+        "Confidence": row.get("Confidence", ""),
+        "QR Token": row.get("QR Token", "")
+    }
+
+
+class AuditLog:
+    """Single append-only writer for the attendance log
+
+    Rows are buffered in memory and written through one long-lived file
+    handle at most every FLUSH_INTERVAL seconds (or FLUSH_ROWS rows), with an
+    fsync every FSYNC_INTERVAL. Writes from several processes are serialized
+    by an exclusive lock on a sidecar .lock file, which also covers
+    size-based rotation; a process notices that another one rotated the log
+    by its inode and reopens it.
+    """
+
+    def __init__(self, path=ATTENDANCE_LOG, flush_interval=FLUSH_INTERVAL, fsync_interval=FSYNC_INTERVAL,
+                 max_bytes=MAX_LOG_BYTES, backups=LOG_BACKUPS):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+
+        self.lock = threading.Lock()          # Buffer and handle, within this process
+        self.buffer = []
+        self.handle = None
+        self.lock_handle = open(path + ".lock", "a+")
+        self.last_fsync = time.time()
+
+        with self._file_lock():
+            self._open()
+
+        self.stopped = threading.Event()
+        self.flusher = threading.Thread(target=self._flush_periodically, name="audit-log-flusher", daemon=True)
+        self.flusher.start()
+        atexit.register(self.close)
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive lock shared by every process writing this log"""
+        lock_file(self.lock_handle)
+        try:
+            yield
+        finally:
+            unlock_file(self.lock_handle)
+
+    def _open(self):
+        """Open (or reopen) the log; caller holds the file lock"""
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+
+        if needs_migration(self.path):
+            raise RuntimeError(f"{self.path} uses an old attendance layout; run `python audit_log.py` to migrate it")
+
+        self.handle = open(self.path, "a", newline="", buffering=64 * 1024)
+        if self.handle.tell() == 0:
+            csv.writer(self.handle).writerow(AUDIT_COLUMNS)
+            self.handle.flush()
+        self.inode = os.fstat(self.handle.fileno()).st_ino
+
+    def _rotate(self):
+        """Shift attendance.csv -> .1 -> .2 ...; caller holds the file lock"""
+        self.handle.close()
+        self.handle = None
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+        self._open()
+        logger.info(f"Rotated attendance log {self.path}")
+
+    def append(self, rows):
+        """Buffer one row (dict) or a list of rows; missing columns are left empty"""
+        if isinstance(rows, dict):
+            rows = [rows]
+        now = datetime.now()
+        lines = io.StringIO()
+        writer = csv.writer(lines)
+        for row in rows:
+            row = dict(row)
+            row.setdefault("Date", now.strftime("%Y-%m-%d"))
+            row.setdefault("Time", now.strftime("%H:%M:%S"))
+            writer.writerow(["" if row.get(c) is None else row.get(c) for c in AUDIT_COLUMNS])
+
+        with self.lock:
+            self.buffer.append(lines.getvalue())
+            flush_now = len(self.buffer) >= FLUSH_ROWS
+        if flush_now:
+            self.flush()
+
+    def flush(self, fsync=False):
+        """Write buffered rows under the file lock"""
+        with self.lock:
+            if not self.buffer:
+                if fsync and self.handle is not None:
+                    os.fsync(self.handle.fileno())
+                return
+            data, self.buffer = "".join(self.buffer), []
+
+            with self._file_lock():
+                # Another process may have rotated the log under us
+                try:
+                    reopen = self.handle is None or os.stat(self.path).st_ino != self.inode
+                except FileNotFoundError:
+                    reopen = True
+                if reopen:
+                    self._open()
+
+                self.handle.write(data)
+                self.handle.flush()
+                if fsync or time.time() - self.last_fsync >= self.fsync_interval:
+                    os.fsync(self.handle.fileno())
+                    self.last_fsync = time.time()
+                if self.handle.tell() >= self.max_bytes:
+                    self._rotate()
+
+    def _flush_periodically(self):
+        while not self.stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Audit log flush failed: {e}")
+
+    def read_rows(self, include_rotated=True):
+        """All rows (oldest first) as dicts, after flushing this process's buffer
+
+        Rotation is by size, not date, so a day's rows can span the current
+        file and its backups; the file lock keeps another process from
+        rotating while the segments are read.
+        """
+        self.flush()
+        paths = [self.path]
+        if include_rotated:
+            paths = [f"{self.path}.{i}" for i in range(self.backups, 0, -1)] + paths
+
+        rows = []
+        with self.lock, self._file_lock():
+            for path in paths:
+                if os.path.exists(path):
+                    with open(path, newline="") as f:
+                        rows.extend(csv.DictReader(f))
+        return rows
+
+    def after_fork(self):
+        """Reopen the handles in a forked child
+
+        flock() locks belong to the open file description, which a child
+        shares with its parent, so the lock file has to be reopened for the
+        lock to exclude the other processes again. Rows the parent had
+        buffered are the parent's to write.
+        """
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.lock_handle = open(self.path + ".lock", "a+")
+        self.handle = None
+        self.stopped = threading.Event()
+        self.flusher = threading.Thread(target=self._flush_periodically, name="audit-log-flusher", daemon=True)
+        self.flusher.start()
+
+    def close(self):
+        self.stopped.set()
+        try:
+            self.flush(fsync=True)
+        finally:
+            with self.lock:
+                if self.handle is not None:
+                    self.handle.close()
+                    self.handle = None
+
+
+def needs_migration(path=ATTENDANCE_LOG):
+    """True if the log at path has rows in one of the older layouts"""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return False
+    with open(path, newline="") as f:
+        header = [h.strip() for h in next(csv.reader(f), [])]
+    return header != AUDIT_COLUMNS
+
+
+def migrate_log(path=ATTENDANCE_LOG):
+    """Rewrite an attendance.csv written by the old per-module schemas
+
+    An explicit step (run by the servers at startup, or `python audit_log.py`)
+    so that importing this module never rewrites the log. Returns the number
+    of rows migrated, 0 if the log already had the unified layout.
+    """
+    with open(path + ".lock", "a+") as lock_handle:
+        lock_file(lock_handle)
+        try:
+            if not needs_migration(path):
+                return 0
+            with open(path, newline="") as f:
+                rows = [legacy_row(row) for row in csv.DictReader(f)]
+            temp_path = path + ".migrating"
+            with open(temp_path, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=AUDIT_COLUMNS)
+                writer.writeheader()
+                writer.writerows(rows)
+            os.replace(temp_path, path)
+        finally:
+            unlock_file(lock_handle)
+    logger.info(f"Migrated {len(rows)} attendance rows to the unified schema")
+    return len(rows)
+
+
+_audit_log = None
+_audit_log_lock = threading.Lock()
+
+
+def get_audit_log():
+    """The process-wide AuditLog for ATTENDANCE_LOG, created on first use"""
+    global _audit_log
+    if _audit_log is None:
+        with _audit_log_lock:
+            if _audit_log is None:
+                _audit_log = AuditLog()
+    return _audit_log
+
+
+def close_audit_log():
+    """Flush and close the shared log if this process ever opened it"""
+    if _audit_log is not None:
+        _audit_log.close()
+
+
+def _after_fork_in_child():
+    global _audit_log_lock
+    _audit_log_lock = threading.Lock()
+    if _audit_log is not None:
+        _audit_log.after_fork()
+
+
+# Forked workers (prefork_server.py) must not share the log handles, lock or flusher with the master
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    count = migrate_log()
+    print(f"Migrated {count} rows in {ATTENDANCE_LOG}" if count else f"{ATTENDANCE_LOG} already uses the unified layout")
@@ -0,0 +1,107 @@
+import json
+import time
+import argparse
+import numpy as np
+from face_gallery import FaceGallery, GALLERY_STORAGES
+
+def make_synthetic_gallery(num_students, templates_per_student, seed=0, template_noise=0.02):
+    """Build a face_db-shaped dict of synthetic 128-D encodings
+
+    Identities are random points with the spread of real face_recognition
+    encodings; each template is the identity plus a little noise.
+    """
+    rng = np.random.default_rng(seed)
+    identities = rng.normal(scale=0.09, size=(num_students, 128))
+    face_db = {}
+    for i, identity in enumerate(identities):
+        templates = identity + rng.normal(scale=template_noise, size=(templates_per_student, 128))
+        face_db[f"{23100000 + i}"] = {
+            "encodings": list(templates),
+            "image_paths": [],
+            "registered_on": "synthetic"
+        }
+    return face_db, identities
+
+def make_synthetic_probes(face_db, identities, num_probes, seed=1, probe_noise=0.006, impostor_rate=0.3):
+    """Genuine probes (identity + noise) mixed with impostors (unseen identities)
+
+    Returns:
+        list of (claimed_student_id, probe_encoding, is_genuine)
+    """
+    rng = np.random.default_rng(seed)
+    student_ids = list(face_db.keys())
+    probes = []
+    for _ in range(num_probes):
+        index = int(rng.integers(len(student_ids)))
+        if rng.random() < impostor_rate:
+            probe = rng.normal(scale=0.09, size=128)
+            probes.append((student_ids[index], probe, False))
+        else:
+            template = face_db[student_ids[index]]["encodings"][int(rng.integers(len(face_db[student_ids[index]]["encodings"])))]
+            probes.append((student_ids[index], template + rng.normal(scale=probe_noise, size=128), True))
+    return probes
+
+def decide(results, claimed_id, threshold):
+    """Same verification decision as FaceDetector.recognize_face"""
+    best_id, similarity = results[0]
+    return best_id, best_id == claimed_id and similarity * 100 >= threshold * 100
+
+def run_benchmark(num_students, templates_per_student, num_probes, threshold):
+    face_db, identities = make_synthetic_gallery(num_students, templates_per_student)
+    probes = make_synthetic_probes(face_db, identities, num_probes)
+
+    report = {
+        "students": num_students,
+        "templates": num_students * templates_per_student,
+        "probes": num_probes,
+        "threshold": threshold,
+        "storages": {}
+    }
+    reference = None
+
+    for storage in GALLERY_STORAGES:
+        gallery = FaceGallery(storage=storage)
+        gallery.invalidate(face_db)
+        view = gallery.view()
+
+        # Full-precision reference scans every template (no centroid pre-screen)
+        prescreen = None if storage == "float64" else 0
+        decisions = []
+        start = time.perf_counter()
+        for claimed_id, probe, _ in probes:
+            results = view.search(probe, top_k=3, prescreen=prescreen)
+            decisions.append(decide(results, claimed_id, threshold))
+        elapsed = time.perf_counter() - start
+
+        # Scanned per query, and held in memory overall (centroids, offsets and the
+        # coarse copy included; the spilled full-precision templates are mapped)
+        scanned = view.coarse.nbytes if view.coarse is not None else view.matrix.nbytes
+        entry = {
+            "search_bytes": int(scanned),
+            "resident_bytes": int(view.nbytes),
+            "bytes_per_template": view.nbytes / view.template_count,
+            "queries_per_second": num_probes / elapsed,
+            "mean_latency_ms": elapsed / num_probes * 1000
+        }
+
+        if reference is None:
+            reference = decisions
+        else:
+            entry["best_match_agreement"] = float(np.mean([a[0] == b[0] for a, b in zip(decisions, reference)]))
+            entry["decision_flips"] = int(sum(a[1] != b[1] for a, b in zip(decisions, reference)))
+
+        entry["accepted"] = int(sum(d[1] for d in decisions))
+        entry["false_accepts"] = int(sum(d[1] and not p[2] for d, p in zip(decisions, probes)))
+        report["storages"][storage] = entry
+
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quantized gallery benchmark")
+    parser.add_argument("--students", type=int, default=20000, help="Synthetic gallery size")
+    parser.add_argument("--templates", type=int, default=5, help="Templates per student")
+    parser.add_argument("--probes", type=int, default=500, help="Number of probe searches")
+    parser.add_argument("--threshold", type=float, default=0.92, help="Similarity threshold (FaceDetector.min_confidence)")
+    args = parser.parse_args()
+
+    print(json.dumps(run_benchmark(args.students, args.templates, args.probes, args.threshold), indent=2))
@@ -0,0 +1,127 @@
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from prefork_server import memory_usage
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def child_pids(pid):
+    """Direct children of pid (Linux /proc)"""
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        children = []
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                try:
+                    with open(f"/proc/{entry}/stat") as f:
+                        if int(f.read().rsplit(")", 1)[1].split()[1]) == pid:
+                            children.append(int(entry))
+                except (OSError, IndexError, ValueError):
+                    pass
+        return children
+
+def wait_for_port(port, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("localhost", port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.5)
+    return False
+
+def sample(master):
+    """Memory of the master and each child in MB"""
+    processes = {"master": master}
+    processes.update({str(pid): pid for pid in child_pids(master)})
+    report = {}
+    for name, pid in processes.items():
+        usage = memory_usage(pid)
+        if usage:
+            report[name] = {"pid": pid, **{k.lower() + "_mb": v / 1024 for k, v in usage.items()}}
+    children = [v for k, v in report.items() if k != "master"]
+    report["total"] = {
+        "rss_mb": sum(v["rss_mb"] for v in report.values()),
+        "pss_mb": sum(v["pss_mb"] for v in report.values()),
+        "workers": len(children),
+        "private_per_worker_mb": (
+            sum(v["private_dirty_mb"] + v["private_clean_mb"] for v in children) / len(children) if children else 0.0
+        )
+    }
+    return report
+
+def drive(url, count, concurrency):
+    def get(_):
+        try:
+            with urllib.request.urlopen(url, timeout=30) as response:
+                return response.status
+        except Exception as e:
+            return type(e).__name__
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        statuses = list(pool.map(get, range(count)))
+    return {str(s): statuses.count(s) for s in set(statuses)}
+
+def run(args):
+    command = [sys.executable, os.path.join(BASE_DIR, "prefork_server.py"), "--app", args.app, "--port", str(args.port),
+               "--workers", str(args.workers), "--max-requests", str(args.max_requests), "--processor", "none"]
+    if args.no_warm:
+        command.append("--no-warm")
+    server = subprocess.Popen(command, cwd=BASE_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        start = time.time()
+        if not wait_for_port(args.port, args.startup_timeout):
+            raise SystemExit("Prefork server did not start")
+        time.sleep(args.settle)
+        report = {"startup_seconds": time.time() - start, "idle": sample(server.pid), "rounds": []}
+
+        url = f"http://localhost:{args.port}{args.path}"
+        for round_number in range(args.rounds):
+            statuses = drive(url, args.requests, args.concurrency)
+            time.sleep(args.settle)
+            report["rounds"].append({"requests": args.requests * (round_number + 1), "status": statuses,
+                                     "memory": sample(server.pid)})
+
+        # N independently started servers would each hold what the warm master holds
+        master_rss = report["idle"]["master"]["rss_mb"]
+        final = report["rounds"][-1]["memory"]["total"] if report["rounds"] else report["idle"]["total"]
+        report["summary"] = {
+            "workers": args.workers,
+            "master_rss_mb": master_rss,
+            "independent_processes_estimate_mb": master_rss * args.workers,
+            "prefork_pss_total_mb": final["pss_mb"],
+            "private_per_worker_mb": final["private_per_worker_mb"]
+        }
+        return report
+    finally:
+        server.terminate()
+        server.wait(30)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RSS/PSS per worker of the prefork server")
+    parser.add_argument("--app", default="attendance_app:app", help="WSGI app as module:attribute")
+    parser.add_argument("--port", type=int, default=3100, help="Port for the benchmark server")
+    parser.add_argument("--workers", type=int, default=4, help="Worker processes")
+    parser.add_argument("--max-requests", type=int, default=0, help="Worker recycling limit (0 = off)")
+    parser.add_argument("--path", default="/stats", help="Endpoint requested each round")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per round")
+    parser.add_argument("--rounds", type=int, default=5, help="Rounds of requests (memory sampled after each)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent requests")
+    parser.add_argument("--settle", type=float, default=1.0, help="Seconds to wait before each sample")
+    parser.add_argument("--startup-timeout", type=float, default=180.0, help="Seconds to wait for the server")
+    parser.add_argument("--no-warm", action="store_true", help="Pass --no-warm to the server")
+    parser.add_argument("--output", default=None, help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    output = json.dumps(run(args), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
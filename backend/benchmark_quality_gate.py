@@ -0,0 +1,113 @@
+import os
+import cv2
+import json
+import time
+import argparse
+import numpy as np
+from face_detector import face_detector
+from quality_gate import quality_gate
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+def collect_images(folders):
+    paths = []
+    for folder in folders:
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(folder, name))
+    return paths
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+def run_image(path):
+    """Run one image through the gated pipeline, timing every stage in ms"""
+    record = {"image": os.path.basename(path), "folder": os.path.basename(os.path.dirname(path)), "stages": {}}
+    stages = record["stages"]
+
+    image, stages["decode"] = timed(cv2.imread, path)
+    if image is None:
+        record["outcome"] = "unreadable"
+        return record
+
+    gate, stages["gate_image"] = timed(quality_gate.check_image, image)
+    if not gate["passed"]:
+        record["outcome"] = "rejected_before_detection"
+        record["reason"] = gate["reason"]
+        return record
+
+    (detections, rgb_image), stages["detect"] = timed(face_detector.detect_faces_detailed, image)
+    if len(detections) != 1:
+        record["outcome"] = "no_face" if not detections else "multiple_faces"
+        return record
+
+    gate, stages["gate_face"] = timed(quality_gate.check_face, image, detections[0])
+    if not gate["passed"]:
+        record["outcome"] = "rejected_before_encoding"
+        record["reason"] = gate["reason"]
+        return record
+
+    encoding, stages["encode"] = timed(face_detector.extract_face_encoding, detections[0]["face_image"])
+    if encoding is None:
+        record["outcome"] = "encoding_failed"
+        return record
+
+    _, stages["match"] = timed(face_detector.gallery_view().search, encoding, 3)
+    record["outcome"] = "encoded"
+    return record
+
+def summarize(records):
+    stage_names = ["decode", "gate_image", "detect", "gate_face", "encode", "match"]
+    stage_times = {name: [r["stages"][name] for r in records if name in r["stages"]] for name in stage_names}
+
+    outcomes = {}
+    reasons = {}
+    for r in records:
+        outcomes[r["outcome"]] = outcomes.get(r["outcome"], 0) + 1
+        if "reason" in r:
+            reasons[r["reason"]] = reasons.get(r["reason"], 0) + 1
+
+    # Cost a rejected image would have paid without the gate, estimated from
+    # the images that did go through detection/encoding
+    mean = {name: float(np.mean(times)) if times else 0.0 for name, times in stage_times.items()}
+    downstream = mean["encode"] + mean["match"]
+    saved_ms = (outcomes.get("rejected_before_detection", 0) * (mean["detect"] + downstream)
+                + outcomes.get("rejected_before_encoding", 0) * downstream)
+    gate_ms = sum(stage_times["gate_image"]) + sum(stage_times["gate_face"])
+
+    return {
+        "images": len(records),
+        "outcomes": outcomes,
+        "reject_reasons": reasons,
+        "stages_ms": {
+            name: {
+                "count": len(times),
+                "mean": mean[name],
+                "p95": float(np.percentile(times, 95)) if times else 0.0,
+                "total": float(np.sum(times))
+            }
+            for name, times in stage_times.items()
+        },
+        "gate_cost_ms": gate_ms,
+        "estimated_cpu_saved_ms": saved_ms,
+        "net_saved_ms": saved_ms - gate_ms
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stage timings of the early-reject quality gate")
+    parser.add_argument("folders", nargs="*", default=[os.path.join(BASE_DIR, "processed"), os.path.join(BASE_DIR, "failed")],
+                        help="Folders of sample uploads (default: processed/ and failed/)")
+    parser.add_argument("--details", action="store_true", help="Include per-image records in the output")
+    args = parser.parse_args()
+
+    records = [run_image(path) for path in collect_images(args.folders)]
+    report = summarize(records)
+    if args.details:
+        report["records"] = records
+
+    print(json.dumps(report, indent=2))
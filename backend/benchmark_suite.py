@@ -0,0 +1,296 @@
+import os
+import sys
+import cv2
+import json
+import time
+import platform
+import argparse
+import tempfile
+import contextlib
+import subprocess
+import numpy as np
+from datetime import datetime
+from face_gallery import FaceGallery
+from template_manager import template_manager
+from benchmark_gallery import make_synthetic_gallery, make_synthetic_probes
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_FOLDERS = [os.path.join(BASE_DIR, "processed"), os.path.join(BASE_DIR, "failed")]
+SECTIONS = ("gallery", "quality_gate", "recognition", "registration", "liveness", "attendance")
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+def latency_summary(seconds):
+    """Throughput and latency percentiles of a list of per-item timings"""
+    if not seconds:
+        return {"count": 0}
+    ms = np.asarray(seconds) * 1000
+    return {
+        "count": len(ms),
+        "per_second": len(ms) / (ms.sum() / 1000) if ms.sum() > 0 else 0.0,
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max())
+    }
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def sample_images(folders, limit=None):
+    paths = []
+    for folder in folders:
+        if os.path.isdir(folder):
+            paths.extend(os.path.join(folder, f) for f in sorted(os.listdir(folder)) if f.lower().endswith(IMAGE_EXTENSIONS))
+    return paths[:limit] if limit else paths
+
+def synthetic_probe_images(image, rng, count):
+    """Degraded variants of a sample upload: rescaled, blurred, darkened, brightened, noisy"""
+    variants = []
+    for _ in range(count):
+        variant = image
+        scale = rng.uniform(0.3, 1.0)
+        variant = cv2.resize(variant, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        if rng.random() < 0.3:
+            variant = cv2.GaussianBlur(variant, (0, 0), rng.uniform(1.0, 6.0))
+        if rng.random() < 0.3:
+            variant = cv2.convertScaleAbs(variant, alpha=rng.uniform(0.2, 1.8), beta=rng.uniform(-40, 40))
+        if rng.random() < 0.2:
+            noise = rng.normal(0, 12, variant.shape)
+            variant = np.clip(variant + noise, 0, 255).astype(np.uint8)
+        variants.append(variant)
+    return variants
+
+def bench_gallery(args):
+    """Synthetic 128-D galleries: search latency per size and storage"""
+    report = {}
+    for size in args.gallery_sizes:
+        face_db, identities = make_synthetic_gallery(size, args.templates, seed=args.seed)
+        probes = make_synthetic_probes(face_db, identities, args.probes, seed=args.seed + 1)
+        report[str(size)] = {}
+        for storage in args.storages:
+            gallery = FaceGallery(storage=storage)
+            start = time.perf_counter()
+            gallery.invalidate(face_db)
+            view = gallery.view()
+            build_time = time.perf_counter() - start
+            times = [timed(view.search, probe, top_k=3)[1] for _, probe, _ in probes]
+            report[str(size)][storage] = dict(latency_summary(times), build_ms=build_time * 1000)
+    return report
+
+def bench_quality_gate(args, images):
+    """Pre-screen cost on the samples and on synthetic degraded probe images"""
+    from quality_gate import quality_gate
+
+    rng = np.random.default_rng(args.seed)
+    probes = list(images)
+    for image in images:
+        probes.extend(synthetic_probe_images(image, rng, args.variants))
+
+    times = []
+    rejected = {}
+    for image in probes:
+        result, elapsed = timed(quality_gate.check_image, image)
+        times.append(elapsed)
+        if not result["passed"]:
+            rejected[result["reason"]] = rejected.get(result["reason"], 0) + 1
+    return {"check_image": latency_summary(times), "images": len(probes), "rejected": rejected}
+
+def stage_snapshot(metrics, before):
+    """Stage histograms recorded since `before` (a metrics.snapshot())"""
+    after = metrics.snapshot()["stages"]
+    return {stage: s for stage, s in after.items() if s["count"] > before.get(stage, {}).get("count", 0)}
+
+def bench_recognition(args, paths):
+    """Replay sample uploads end to end through FaceDetector.recognize_face"""
+    from face_detector import face_detector
+    from metrics import metrics
+
+    # Every repetition after the first is served by the embedding cache, so
+    # measure cold (cache cleared) and warm passes separately
+    before = metrics.snapshot()["stages"]
+    face_detector.embedding_cache.entries.clear()
+    face_detector.embedding_cache.phash_index.clear()
+    cold, outcomes = [], {}
+    for path in paths:
+        result, elapsed = timed(face_detector.recognize_face, path)
+        cold.append(elapsed)
+        key = "verified" if result.get("verified") else result.get("message", "not verified")
+        outcomes[key] = outcomes.get(key, 0) + 1
+    stages = stage_snapshot(metrics, before)
+
+    warm = [timed(face_detector.recognize_face, path)[1] for path in paths]
+    return {
+        "gallery_students": len(face_detector.face_db),
+        "cold": latency_summary(cold),
+        "warm": latency_summary(warm),
+        "stages": stages,
+        "outcomes": outcomes
+    }
+
+def bench_registration(args, paths):
+    """Registration compute (gate, detect, encode, template pruning) without touching known_faces"""
+    from face_detector import face_detector
+    from quality_gate import quality_gate
+
+    times, stages = [], {"detect": [], "encode": [], "templates": []}
+    entry = {"encodings": [], "image_paths": []}
+    for path in paths:
+        start = time.perf_counter()
+        image = cv2.imread(path)
+        if image is None or not quality_gate.check_image(image)["passed"]:
+            continue
+        (detections, _), elapsed = timed(face_detector.detect_faces_detailed, image)
+        stages["detect"].append(elapsed)
+        if len(detections) != 1 or not quality_gate.check_face(image, detections[0])["passed"]:
+            continue
+        encoding, elapsed = timed(face_detector.extract_face_encoding, detections[0]["face_image"])
+        stages["encode"].append(elapsed)
+        if encoding is None:
+            continue
+        _, elapsed = timed(template_manager.add_template, entry, encoding, path)
+        stages["templates"].append(elapsed)
+        times.append(time.perf_counter() - start)
+
+    return {
+        "registered": latency_summary(times),
+        "stages": {name: latency_summary(values) for name, values in stages.items()}
+    }
+
+def bench_liveness(args, paths):
+    """Single-image liveness (texture, eyes and replay score) on the samples"""
+    from liveness_detection import liveness_detector
+
+    times, live = [], 0
+    for path in paths:
+        result, elapsed = timed(liveness_detector.verify_liveness, path)
+        times.append(elapsed)
+        live += bool(result.get("is_live"))
+    return {"verify_liveness": latency_summary(times), "live": live}
+
+def bench_attendance(args):
+    """Durable attendance writes against a scratch audit log
+
+    AuditLog.append only buffers rows, so each write is timed up to the
+    fsync of its flush, when the rows are actually on disk. The shared
+    attendance.csv is opened lazily by get_audit_log(), which nothing here
+    calls; its stat is compared afterwards to make sure it was left alone.
+    """
+    from database import AttendanceDB
+    from audit_log import AuditLog, ATTENDANCE_LOG
+
+    def log_stat():
+        try:
+            stat = os.stat(ATTENDANCE_LOG)
+            return stat.st_size, stat.st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    before = log_stat()
+    with tempfile.TemporaryDirectory() as scratch:
+        log = AuditLog(os.path.join(scratch, "attendance.csv"))
+        db = AttendanceDB(log=log)
+        student_ids = [f"{23100000 + i}" for i in range(args.attendance_students)]
+
+        def durable(mark, *mark_args):
+            mark(*mark_args)
+            log.flush(fsync=True)
+
+        single = [timed(durable, db.mark_attendance, sid, "Present", "Benchmark", "BENCH")[1] for sid in student_ids]
+        bulk = [timed(durable, db.mark_attendance_bulk, student_ids, "Present", "Benchmark", "BENCH")[1] for _ in range(5)]
+        rows = len(log.read_rows())
+        unique = len(db.get_attendance()["data"])
+        log.close()
+    if log_stat() != before:
+        raise RuntimeError(f"bench_attendance modified {ATTENDANCE_LOG}")
+    return {"mark_attendance": latency_summary(single), "mark_attendance_bulk": latency_summary(bulk), "rows": rows, "unique": unique}
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                                capture_output=True, text=True, timeout=5).stdout.strip()
+    except Exception:
+        commit = None
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count()
+    }
+
+def compare(report, baseline, path=()):
+    """Relative change of every *_ms / per_second value against a baseline report"""
+    changes = {}
+    for key, value in report.items():
+        if key not in baseline or key == "environment":
+            continue
+        if isinstance(value, dict) and isinstance(baseline[key], dict):
+            changes.update(compare(value, baseline[key], path + (key,)))
+        elif (key.endswith("_ms") or key == "per_second") and isinstance(value, (int, float)) and baseline[key]:
+            changes[".".join(path + (key,))] = round((value - baseline[key]) / baseline[key] * 100, 1)
+    return changes
+
+def run_suite(args):
+    paths = sample_images(args.folders, args.limit)
+    report = {"environment": environment(), "config": vars(args), "samples": len(paths)}
+
+    for section in args.sections:
+        print(f"Running {section} benchmark...", file=sys.stderr)
+        try:
+            if section == "gallery":
+                report[section] = bench_gallery(args)
+            elif section == "quality_gate":
+                images = [image for image in (cv2.imread(p) for p in paths) if image is not None]
+                report[section] = bench_quality_gate(args, images)
+            elif section == "recognition":
+                report[section] = bench_recognition(args, paths)
+            elif section == "registration":
+                report[section] = bench_registration(args, paths)
+            elif section == "liveness":
+                report[section] = bench_liveness(args, paths)
+            elif section == "attendance":
+                report[section] = bench_attendance(args)
+        except ImportError as e:
+            # The face pipeline needs mtcnn/tensorflow/dlib; report instead of failing the run
+            report[section] = {"skipped": f"missing dependency: {e}"}
+
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless benchmark suite (JSON output)")
+    parser.add_argument("--sections", default=",".join(SECTIONS),
+                        help=f"Comma-separated sections to run ({', '.join(SECTIONS)})")
+    parser.add_argument("--folders", nargs="*", default=SAMPLE_FOLDERS, help="Folders of sample uploads to replay")
+    parser.add_argument("--limit", type=int, default=None, help="Replay at most this many sample images")
+    parser.add_argument("--gallery-sizes", default="1000,10000,50000", help="Synthetic gallery sizes (students)")
+    parser.add_argument("--templates", type=int, default=5, help="Templates per synthetic student")
+    parser.add_argument("--storages", default="float64,int8", help="Gallery storages to benchmark")
+    parser.add_argument("--probes", type=int, default=200, help="Synthetic probe embeddings per gallery")
+    parser.add_argument("--variants", type=int, default=5, help="Synthetic degraded images per sample")
+    parser.add_argument("--attendance-students", type=int, default=200, help="Students written in the attendance benchmark")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for every synthetic generator")
+    parser.add_argument("--output", default=None, help="Write the JSON report to this file")
+    parser.add_argument("--compare", default=None, help="Baseline JSON report to compare against")
+    args = parser.parse_args()
+
+    args.sections = [s.strip() for s in args.sections.split(",") if s.strip()]
+    args.gallery_sizes = [int(s) for s in args.gallery_sizes.split(",")]
+    args.storages = [s.strip() for s in args.storages.split(",")]
+
+    # Modules print status lines while loading; keep stdout pure JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run_suite(args)
+    if args.compare:
+        with open(args.compare) as f:
+            report["change_percent"] = compare(report, json.load(f))
+
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
@@ -0,0 +1,257 @@
+import os
+import csv
+import json
+import time
+import logging
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('bulk_enrollment')
+
+# Define constants directly in the module (no config import)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "known_faces")
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+ENROLL_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+COMMIT_BATCH = 200             # Encodings written to face_db.pickle per commit
+IN_FLIGHT_PER_WORKER = 4       # Images queued per worker, so results stream back in bounded memory
+PROGRESS_INTERVAL = 10.0       # Seconds between progress log lines
+CHECKPOINT_NAME = ".enrollment_checkpoint.json"
+FAILURE_REPORT_NAME = "enrollment_failures.csv"
+TEMPLATE_JPEG_QUALITY = 90     # Same quality artifact_writer uses for template crops
+
+
+def student_for(relative_path):
+    """Student ID of an enrolment photo
+
+    Photos in a subdirectory belong to the student the directory is named
+    after (photos/23100001/front.jpg); top-level photos are named
+    student_id.jpg or student_id_<anything>.jpg, as in register_faces_in_bulk.
+    """
+    parts = relative_path.split(os.sep)
+    if len(parts) > 1:
+        return parts[-2]
+    return os.path.splitext(parts[-1])[0].split("_")[0]
+
+
+def find_images(directory):
+    """Relative paths of every image under directory, in a stable order"""
+    images = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                images.append(os.path.relpath(os.path.join(root, filename), directory))
+    return images
+
+
+def encode_image(directory, relative_path, student_id, data_dir):
+    """Decode, detect and encode one photo and write its template crop (runs in the process pool)
+
+    The face crop path is derived from the source path, so re-encoding a
+    photo after an interrupted run overwrites its crop instead of adding one.
+
+    Returns:
+        dict with "file", "student_id", "success" and either "encoding" and
+        "face_path" or "message"
+    """
+    import cv2
+    from face_detector import face_detector
+
+    result = {"file": relative_path, "student_id": student_id}
+    try:
+        image = cv2.imread(os.path.join(directory, relative_path))
+        if image is None:
+            return {**result, "success": False, "message": "Could not read image"}
+
+        encoded = face_detector.encode_registration_image(image)
+        if not encoded["success"]:
+            return {**result, "success": False, "message": encoded["message"], "retake": encoded.get("retake", False)}
+
+        name = os.path.splitext(relative_path)[0].replace(os.sep, "_")
+        face_path = os.path.join(data_dir, student_id, f"face_bulk_{name}.jpg")
+        os.makedirs(os.path.dirname(face_path), exist_ok=True)
+        if not cv2.imwrite(face_path, encoded["face_image"], [cv2.IMWRITE_JPEG_QUALITY, TEMPLATE_JPEG_QUALITY]):
+            return {**result, "success": False, "message": "Could not save face image"}
+
+        return {**result, "success": True, "encoding": encoded["encoding"], "face_path": face_path}
+    except Exception as e:
+        return {**result, "success": False, "message": f"Error registering face: {e}"}
+
+
+class Checkpoint:
+    """Files already committed (or failed) by earlier runs over the same directory
+
+    Written with a rename after every commit, so an interrupted run resumes
+    with the first file whose encoding never reached face_db.pickle.
+    """
+
+    def __init__(self, path, directory):
+        self.path = path
+        self.directory = os.path.abspath(directory)
+        self.completed = set()
+        self.failures = {}     # relative path -> failure row
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            state = json.load(f)
+        if state.get("directory") != self.directory:
+            raise ValueError(f"Checkpoint {self.path} belongs to {state.get('directory')}, not {self.directory}")
+        self.completed = set(state.get("completed", []))
+        self.failures = state.get("failures", {})
+        logger.info(f"Resuming: {len(self.completed)} files committed and {len(self.failures)} failed in earlier runs")
+
+    def is_done(self, relative_path, retry_failed=False):
+        return relative_path in self.completed or (relative_path in self.failures and not retry_failed)
+
+    def record(self, committed, failed):
+        for relative_path in committed:
+            self.completed.add(relative_path)
+            self.failures.pop(relative_path, None)
+        for row in failed:
+            self.failures[row["file"]] = row
+        self.save()
+
+    def save(self):
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"directory": self.directory, "completed": sorted(self.completed),
+                       "failures": self.failures, "updated_at": time.time()}, f)
+        os.replace(temp_path, self.path)
+
+
+class BulkEnrollment:
+    """Enrol a directory of photos in parallel with batched database commits
+
+    Worker processes (spawned, each with its own MTCNN and dlib models) run
+    the quality gate, detection and encoding and write the template crops.
+    The parent adds their encodings to face_db through
+    FaceDetector.add_templates, COMMIT_BATCH at a time, so the pickle is
+    rewritten once per batch rather than once per photo.
+    """
+
+    def __init__(self, directory, workers=ENROLL_WORKERS, batch_size=COMMIT_BATCH,
+                 checkpoint_path=None, report_path=None, subject=None, retry_failed=False):
+        self.directory = directory
+        self.workers = workers
+        self.batch_size = batch_size
+        self.checkpoint = Checkpoint(checkpoint_path or os.path.join(directory, CHECKPOINT_NAME), directory)
+        self.report_path = report_path or os.path.join(directory, FAILURE_REPORT_NAME)
+        self.subject = subject
+        self.retry_failed = retry_failed
+
+        self.pending = []      # Successful results not committed yet
+        self.failed = []       # Failure rows not checkpointed yet
+        self.counts = {"enrolled": 0, "failed": 0, "skipped": 0}
+
+    def _commit(self):
+        from face_detector import face_detector
+        from roster import subject_roster
+
+        if self.pending:
+            face_detector.add_templates([(r["student_id"], r["encoding"], r["face_path"]) for r in self.pending])
+            if self.subject:
+                subject_roster.enroll_many(self.subject, {r["student_id"] for r in self.pending})
+        self.checkpoint.record([r["file"] for r in self.pending], self.failed)
+        self.pending, self.failed = [], []
+
+    def _collect(self, result):
+        if result["success"]:
+            self.pending.append(result)
+            self.counts["enrolled"] += 1
+        else:
+            self.failed.append({"file": result["file"], "student_id": result["student_id"],
+                                "reason": result["message"], "retake": result.get("retake", False)})
+            self.counts["failed"] += 1
+        if len(self.pending) + len(self.failed) >= self.batch_size:
+            self._commit()
+
+    def _progress(self, done, total, start):
+        elapsed = time.time() - start
+        rate = done / elapsed if elapsed else 0.0
+        eta = (total - done) / rate if rate else float("inf")
+        logger.info(f"{done}/{total} photos ({self.counts['enrolled']} enrolled, {self.counts['failed']} failed), "
+                    f"{rate:.1f} photos/s, ETA {eta / 60:.1f} min")
+
+    def write_report(self):
+        """Failures of this and earlier runs as CSV: file, student ID, reason, whether a retake helps"""
+        with open(self.report_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["File", "Student ID", "Reason", "Retake"])
+            for relative_path in sorted(self.checkpoint.failures):
+                row = self.checkpoint.failures[relative_path]
+                writer.writerow([row["file"], row["student_id"], row["reason"], row["retake"]])
+
+    def run(self):
+        images = find_images(self.directory)
+        todo = [p for p in images if not self.checkpoint.is_done(p, self.retry_failed)]
+        self.counts["skipped"] = len(images) - len(todo)
+        logger.info(f"{len(images)} photos in {self.directory}, {len(todo)} to enrol with {self.workers} workers")
+
+        start = last_progress = time.time()
+        done = 0
+        # spawn: workers load their own models instead of inheriting the parent's TensorFlow state
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context) as pool:
+            queue = iter(todo)
+            in_flight = set()
+            try:
+                while True:
+                    for relative_path in queue:
+                        in_flight.add(pool.submit(encode_image, self.directory, relative_path,
+                                                  student_for(relative_path), DATA_DIR))
+                        if len(in_flight) >= self.workers * IN_FLIGHT_PER_WORKER:
+                            break
+                    if not in_flight:
+                        break
+
+                    finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        self._collect(future.result())
+                        done += 1
+
+                    if time.time() - last_progress >= PROGRESS_INTERVAL:
+                        last_progress = time.time()
+                        self._progress(done, len(todo), start)
+            finally:
+                # On Ctrl-C keep what was encoded so far; the checkpoint covers exactly what was committed
+                for future in in_flight:
+                    future.cancel()
+                self._commit()
+                self.write_report()
+
+        self._progress(done, len(todo), start)
+        return {
+            "photos": len(images),
+            **self.counts,
+            "failures_total": len(self.checkpoint.failures),
+            "seconds": time.time() - start,
+            "checkpoint": self.checkpoint.path,
+            "failure_report": self.report_path
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parallel, resumable bulk face enrolment")
+    parser.add_argument("directory", help="Photos named student_id[_n].jpg, or one subdirectory per student ID")
+    parser.add_argument("--workers", type=int, default=ENROLL_WORKERS, help="Encoding processes")
+    parser.add_argument("--batch-size", type=int, default=COMMIT_BATCH, help="Photos per database commit")
+    parser.add_argument("--subject", default=None, help="Also enrol every registered student in this subject's roster")
+    parser.add_argument("--checkpoint", default=None, help=f"Checkpoint file (default: <directory>/{CHECKPOINT_NAME})")
+    parser.add_argument("--report", default=None, help=f"Failure report CSV (default: <directory>/{FAILURE_REPORT_NAME})")
+    parser.add_argument("--retry-failed", action="store_true", help="Encode photos that failed in earlier runs again")
+    args = parser.parse_args()
+
+    enrollment = BulkEnrollment(
+        args.directory, workers=args.workers, batch_size=args.batch_size, checkpoint_path=args.checkpoint,
+        report_path=args.report, subject=args.subject, retry_failed=args.retry_failed
+    )
+    print(json.dumps(enrollment.run(), indent=2))
@@ -0,0 +1,152 @@
+import os
+import time
+import sqlite3
+import threading
+
+# Define constants directly in the module (no config import)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+COOLDOWN_DB = os.path.join(BASE_DIR, "known_faces", "cooldowns.db")
+COOLDOWN_PERIOD = 300          # Seconds between accepted submissions of the same student and subject
+EVICT_EVERY = 256              # Claims between sweeps of expired rows
+BUSY_TIMEOUT_MS = 5000         # How long a writer waits for another process's lock
+
+
+class CooldownStore:
+    """Duplicate-submission cooldowns shared by every local process
+
+    Backed by a SQLite table in WAL mode, keyed by "<roll>_<subject>", so
+    the check is a primary-key lookup, several monitor processes see the
+    same cooldowns, and a restart does not reopen the window. Expired rows
+    are ignored on read and swept out periodically.
+
+    claim() is an atomic check-and-set; a claim that did not lead to
+    attendance being marked is handed back with release().
+    """
+
+    def __init__(self, path=COOLDOWN_DB, ttl=COOLDOWN_PERIOD, table="cooldowns"):
+        self.path = path
+        self.ttl = ttl
+        self.table = table     # Other shared TTL sets (QR replays, photo claims) live in their own tables
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # sqlite3 connections must not be shared between threads
+        self.local = threading.local()
+        self.claims = 0
+        self.lock = threading.Lock()
+
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                key TEXT PRIMARY KEY,
+                claimed_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            ) WITHOUT ROWID
+        """)
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_expiry ON {table} (expires_at)")
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+            conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def claim(self, key, now=None):
+        """Start the cooldown for key unless one is already running
+
+        Returns:
+            (allowed, seconds since the running cooldown started or None)
+        """
+        now = time.time() if now is None else now
+        conn = self._connection()
+
+        # IMMEDIATE takes the write lock up front, so two processes cannot
+        # both see the key as free
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                f"SELECT claimed_at FROM {self.table} WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row is not None:
+                conn.execute("ROLLBACK")
+                return False, now - row[0]
+
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, claimed_at, expires_at) VALUES (?, ?, ?)",
+                (key, now, now + self.ttl)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        self._sweep_sometimes(now)
+        return True, None
+
+    def _sweep_sometimes(self, now):
+        with self.lock:
+            self.claims += 1
+            sweep = self.claims % EVICT_EVERY == 0
+        if sweep:
+            self.evict_expired(now)
+
+    def release(self, key):
+        """Hand back a claim whose submission was rejected"""
+        self._connection().execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def touch(self, key, now=None):
+        """Start (or restart) the cooldown for key whether or not one is running"""
+        now = time.time() if now is None else now
+        self._connection().execute(
+            f"INSERT OR REPLACE INTO {self.table} (key, claimed_at, expires_at) VALUES (?, ?, ?)",
+            (key, now, now + self.ttl)
+        )
+        self._sweep_sometimes(now)
+
+    def active_with_prefix(self, prefix, now=None):
+        """Keys starting with prefix whose cooldown is running (a primary-key range scan)"""
+        now = time.time() if now is None else now
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        rows = self._connection().execute(
+            f"SELECT key FROM {self.table} WHERE key >= ? AND key < ? AND expires_at > ?", (prefix, upper, now)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def is_cooling_down(self, key, now=None):
+        now = time.time() if now is None else now
+        row = self._connection().execute(
+            f"SELECT 1 FROM {self.table} WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        return row is not None
+
+    def evict_expired(self, now=None):
+        """Delete expired cooldowns; returns how many were removed"""
+        now = time.time() if now is None else now
+        return self._connection().execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (now,)).rowcount
+
+    def after_fork(self):
+        # SQLite connections must not be used across fork
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def count(self, now=None):
+        """Keys whose cooldown is running at now"""
+        now = time.time() if now is None else now
+        return self._connection().execute(
+            f"SELECT COUNT(*) FROM {self.table} WHERE expires_at > ?", (now,)
+        ).fetchone()[0]
+
+    def __len__(self):
+        return self.count()
+
+
+# Create singleton instance
+cooldown_store = CooldownStore()
+
+# Forked workers (prefork_server.py) must not share SQLite connections with the master
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=cooldown_store.after_fork)
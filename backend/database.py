@@ -2,85 +2,102 @@ import os
 import pandas as pd
 from datetime import datetime
 from flask import Flask, request, jsonify
+from metrics import metrics
+from audit_log import get_audit_log, AUDIT_COLUMNS, ATTENDANCE_LOG
 
 app = Flask(__name__)
 
 class AttendanceDB:
-    def __init__(self):
+    def __init__(self, log=None):
         self.base_dir = os.path.dirname(os.path.abspath(__file__))
-        self.attendance_file = os.path.join(self.base_dir, "attendance.csv")
         
-        # Create attendance file if it doesn't exist
-        if not os.path.exists(self.attendance_file):
-            self._initialize_file()
+        # Every module appends to the same audit log with one schema; the
+        # shared one is opened on first use, not when this module is imported
+        self._log = log
+        self.attendance_file = log.path if log else ATTENDANCE_LOG
             
         print(f"Attendance database initialized: {self.attendance_file}")
     
-    def _initialize_file(self):
-        """Create a new attendance file"""
-        df = pd.DataFrame(columns=[
-            "Student ID", "Date", "Time", "Status", "Method"
-        ])
-        df.to_csv(self.attendance_file, index=False)
-        print(f"Created new attendance file: {self.attendance_file}")
+    @property
+    def log(self):
+        if self._log is None:
+            self._log = get_audit_log()
+        return self._log
     
-    def mark_attendance(self, student_id, status="Present", method="Face"):
-        """Mark attendance for a student"""
+    def mark_attendance(self, student_id, status="Present", method="Face", subject=None, qr_token=None, confidence=None):
+        """Mark attendance for a student
+        
+        The row is appended to the audit log; a later row for the same student,
+        date and subject supersedes earlier ones when attendance is read back.
+        
+        Args:
+            subject: Optional subject the attendance was verified for
+            qr_token: Optional id of the QR token that proved presence
+        """
         try:
-            # Load existing data
-            df = pd.read_csv(self.attendance_file)
-            
-            # Get current date and time
-            now = datetime.now()
-            current_date = now.strftime("%Y-%m-%d")
-            current_time = now.strftime("%H:%M:%S")
+            with metrics.stage("csv_write"):
+                self.log.append({
+                    "Student ID": student_id,
+                    "Subject": subject,
+                    "Status": status,
+                    "Method": method,
+                    "Confidence": confidence,
+                    "QR Token": qr_token
+                })
             
-            # Check if student already has entry for today
-            today_record = df[(df["Student ID"] == student_id) & (df["Date"] == current_date)]
+            return {"success": True, "message": f"Attendance marked for {student_id}"}
+        
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            return {"success": False, "message": f"Error marking attendance: {str(e)}"}
+    
+    def mark_attendance_bulk(self, student_ids, status="Present", method="Group Photo", subject=None):
+        """Mark attendance for many students in one append to the audit log"""
+        try:
+            student_ids = list(dict.fromkeys(student_ids))
             
-            if len(today_record) == 0:
-                # Create new record
-                new_record = {
+            with metrics.stage("csv_write"):
+                self.log.append([{
                     "Student ID": student_id,
-                    "Date": current_date,
-                    "Time": current_time,
+                    "Subject": subject,
                     "Status": status,
                     "Method": method
-                }
-                df = pd.concat([df, pd.DataFrame([new_record])], ignore_index=True)
-            else:
-                # Update existing record
-                df.loc[(df["Student ID"] == student_id) & (df["Date"] == current_date), 
-                      ["Time", "Status", "Method"]] = [current_time, status, method]
-            
-            # Save updated data
-            df.to_csv(self.attendance_file, index=False)
+                } for student_id in student_ids])
             
-            return {"success": True, "message": f"Attendance marked for {student_id}"}
+            return {"success": True, "message": f"Attendance marked for {len(student_ids)} students"}
         
         except Exception as e:
             import traceback
             traceback.print_exc()
             return {"success": False, "message": f"Error marking attendance: {str(e)}"}
     
+    def _read_attendance(self, date=None, student_id=None):
+        """Current attendance, one row per student, date and subject
+        
+        The audit log keeps every attempt; a Present row wins over later
+        rejections (e.g. a duplicate submission), otherwise the latest row wins.
+        """
+        with metrics.stage("csv_read"):
+            df = pd.DataFrame(self.log.read_rows(), columns=AUDIT_COLUMNS)
+        
+        # Apply filters
+        if date:
+            df = df[df["Date"] == date]
+        
+        if student_id:
+            df = df[df["Student ID"] == str(student_id)]
+        
+        present = df["Status"].str.startswith("Present").astype(int)
+        df = df.assign(_present=present, _order=range(len(df)))
+        df = df.sort_values(["_present", "_order"]).drop_duplicates(["Student ID", "Date", "Subject"], keep="last")
+        return df.sort_values("_order").drop(columns=["_present", "_order"])
+    
     def get_attendance(self, date=None, student_id=None):
         """Get attendance records"""
         try:
-            if not os.path.exists(self.attendance_file):
-                print(f"Attendance file not found: {self.attendance_file}")
-                return {"success": False, "message": "Attendance file not found", "data": []}
-                
-            df = pd.read_csv(self.attendance_file)
-            
-            # Apply filters
-            if date:
-                df = df[df["Date"] == date]
-            
-            if student_id:
-                df = df[df["Student ID"] == student_id]
-            
             # Convert to records format
-            records = df.to_dict(orient="records")
+            records = self._read_attendance(date=date, student_id=student_id).to_dict(orient="records")
             return {"success": True, "data": records}
         
         except Exception as e:
@@ -91,11 +108,7 @@ class AttendanceDB:
     def export_csv(self, output_path=None, date=None):
         """Export attendance to CSV file"""
         try:
-            df = pd.read_csv(self.attendance_file)
-            
-            # Apply date filter if provided
-            if date:
-                df = df[df["Date"] == date]
+            df = self._read_attendance(date=date)
             
             # Use default path if none provided
             if not output_path:
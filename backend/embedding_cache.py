@@ -0,0 +1,171 @@
+import os
+import cv2
+import time
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from cooldown_store import CooldownStore, COOLDOWN_DB
+
+# Define constants directly in the module (no config import)
+CACHE_MAX_ENTRIES = 10000        # Upper bound on cached uploads
+CACHE_MAX_BYTES = 64 * 1024**2   # Memory budget for cached entries
+CACHE_TTL = 3600                 # Seconds before a cached result must be recomputed
+ENTRY_OVERHEAD_BYTES = 512       # Rough per-entry bookkeeping cost used for the budget
+
+
+def content_hash(data):
+    """SHA-256 of the raw uploaded bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def perceptual_hash(image):
+    """64-bit difference hash (dHash), stable across re-encoding and resizing"""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+class EmbeddingCache:
+    """LRU + TTL cache of detection/encoding/match results keyed by image content
+
+    Entries are looked up by content hash before the image is decoded. The
+    perceptual hash only flags near-duplicates of a recent upload: distinct
+    webcam frames can share a 64-bit dHash, so a match never stands in for
+    detecting and encoding the image itself. The cache also
+    remembers which roll numbers submitted each photo, so one photo used for
+    several students can be flagged; those claims live in SQLite, shared by
+    every server process, since the two submissions may land on different
+    workers.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL, claims_path=COOLDOWN_DB):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+
+        self.entries = OrderedDict()   # content hash -> entry
+        self.phash_index = {}          # perceptual hash -> content hash
+        self.claims = CooldownStore(claims_path, ttl=ttl, table="photo_claims")   # "<content hash>:<roll number>"
+        self.current_bytes = 0
+        self.metrics = {
+            "hits": 0,
+            "misses": 0,
+            "near_duplicates": 0,
+            "evictions": 0,
+            "expired": 0,
+            "match_hits": 0,
+            "shared_photo_flags": 0
+        }
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.current_bytes -= entry["size"]
+        if self.phash_index.get(entry["phash"]) == key:
+            del self.phash_index[entry["phash"]]
+
+    def _evict(self):
+        while self.entries and (len(self.entries) > self.max_entries or self.current_bytes > self.max_bytes):
+            self._remove(next(iter(self.entries)))
+            self.metrics["evictions"] += 1
+
+    def _lookup(self, key, now):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry["expires_at"] <= now:
+            self._remove(key)
+            self.metrics["expired"] += 1
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def get(self, key):
+        """Look up an upload by content hash (before decoding)"""
+        with self.lock:
+            entry = self._lookup(key, time.time())
+            self.metrics["hits" if entry is not None else "misses"] += 1
+            return entry
+
+    def near_duplicate_of(self, phash, key=None):
+        """Content hash of a cached upload with the same perceptual hash, if any
+
+        Only a flag (e.g. a re-encoded copy of another upload); the caller
+        still detects, encodes and matches its own image.
+        """
+        with self.lock:
+            original = self.phash_index.get(phash)
+            if original is None or original == key or self._lookup(original, time.time()) is None:
+                return None
+            self.metrics["near_duplicates"] += 1
+            return original
+
+    def put(self, key, phash, encoding=None, box=None, message=None, near_duplicate_of=None):
+        """Store the detection/encoding outcome of an upload"""
+        entry = {
+            "key": key,
+            "phash": phash,
+            "near_duplicate_of": near_duplicate_of,
+            "encoding": encoding,
+            "box": box,
+            "message": message,
+            "matches": {},
+            "expires_at": time.time() + self.ttl,
+            "size": ENTRY_OVERHEAD_BYTES + (encoding.nbytes if encoding is not None else 0)
+        }
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = entry
+            self.phash_index[phash] = key
+            self.current_bytes += entry["size"]
+            self._evict()
+        return entry
+
+    def get_matches(self, entry, match_key):
+        """Cached gallery match results for this entry, if the gallery is unchanged"""
+        with self.lock:
+            results = entry["matches"].get(match_key)
+            if results is not None:
+                self.metrics["match_hits"] += 1
+            return results
+
+    def put_matches(self, entry, match_key, results):
+        with self.lock:
+            # Only the latest gallery generation is worth keeping
+            entry["matches"] = {match_key: results}
+
+    def record_claim(self, key, roll_number):
+        """Remember that roll_number submitted this photo
+
+        Returns:
+            list of other roll numbers that submitted the same photo recently
+        """
+        now = time.time()
+        self.claims.touch(f"{key}:{roll_number}", now=now)
+        others = [claim.split(":", 1)[1] for claim in self.claims.active_with_prefix(f"{key}:", now=now)]
+        others = [r for r in others if r != roll_number]
+        if others:
+            with self.lock:
+                self.metrics["shared_photo_flags"] += 1
+        return others
+
+    def stats(self):
+        with self.lock:
+            lookups = self.metrics["hits"] + self.metrics["misses"]
+            return dict(
+                self.metrics,
+                entries=len(self.entries),
+                bytes=self.current_bytes,
+                hit_rate=self.metrics["hits"] / lookups if lookups else 0.0
+            )
+
+
+# Create singleton instance
+embedding_cache = EmbeddingCache()
+
+# Forked workers (prefork_server.py) must not share SQLite connections with the master
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=embedding_cache.claims.after_fork)
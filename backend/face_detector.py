@@ -2,13 +2,29 @@ import os
 import cv2
 import numpy as np
 import pickle
+import time
 import face_recognition  # Need to install: pip install face-recognition
 from datetime import datetime
 import shutil
 import logging
 import threading
+from contextlib import contextmanager
 from mtcnn.mtcnn import MTCNN  # Need to install: pip install mtcnn tensorflow
 from sklearn.metrics.pairwise import cosine_similarity
+from scipy.optimize import linear_sum_assignment  # Installed with scikit-learn
+from face_gallery import FaceGallery
+from shared_gallery import SharedGallery, SHARED_GALLERY_ENABLED, SHARED_GALLERY_DIR
+from gallery_shards import ShardedGallery, GALLERY_SHARDS, shard_for
+from roster import subject_roster
+from template_manager import (template_manager, database_path, template_versions, templates_of_version,
+                              LEGACY_MODEL_VERSION)
+from embedding_cache import embedding_cache, content_hash, perceptual_hash
+from quality_gate import quality_gate
+from artifact_writer import artifact_writer
+from image_archive import parse_upload_name
+from metrics import metrics
+from job_scheduler import job_scheduler
+from audit_log import lock_file, unlock_file
 
 # Configure logging
 logging.basicConfig(
@@ -17,6 +33,14 @@ logging.basicConfig(
 )
 logger = logging.getLogger('face_detector')
 
+# Define constants directly in the module (no config import)
+ENCODER_LANDMARKS = os.environ.get("ENCODER_LANDMARKS", "small")   # dlib landmarks used to align faces: "small" (5, the library default) or "large" (68)
+ENCODER_JITTERS = int(os.environ.get("ENCODER_JITTERS", "1"))      # Re-sampled crops averaged per encoding
+# Recorded with every template: encodings of different versions are not comparable
+EMBEDDING_MODEL_VERSION = f"dlib-resnet-v1-{ENCODER_LANDMARKS}-j{ENCODER_JITTERS}"
+DB_POLL_INTERVAL = 2.0     # Seconds between checks for a face database replaced by another process
+
+
 class FaceDetector:
     def __init__(self):
         print("Initializing advanced face detector...")
@@ -35,6 +59,9 @@ class FaceDetector:
         self.debug = True
         self.min_confidence = 0.92  # Minimum confidence for face match (very strict)
         self.min_face_size = (96, 96)  # Minimum face size for detection
+        self.group_min_detection_confidence = 0.95  # Quality bar for faces in group photos
+        self.group_min_face_size = 40  # Smallest face (pixels) accepted in group photos
+        self.gallery_storage = "float64"  # "float16"/"int8" enable quantized coarse search
         
         # Advanced face detector using MTCNN (Multi-task Cascaded Convolutional Networks)
         try:
@@ -52,37 +79,203 @@ class FaceDetector:
         # Face database
         self.face_db = {}
         self.lock = threading.RLock()
+        
+        # Cheap blur/exposure/size/pose checks that run before the encoder
+        self.quality_gate = quality_gate
+        
+        # Detection/encoding/match results of recent uploads, keyed by image content
+        self.embedding_cache = embedding_cache
+        
+        # Matrix view of the face database, with per-subject roster views;
+        # with SHARED_GALLERY=1 the matrix is mapped from files shared by all workers,
+        # with GALLERY_SHARDS set it is partitioned across recognition nodes
+        if GALLERY_SHARDS:
+            self.gallery = ShardedGallery(GALLERY_SHARDS)
+        elif SHARED_GALLERY_ENABLED:
+            # One published gallery per model version, so servers on either side of a re-encode do not mix
+            self.gallery = SharedGallery(storage=self.gallery_storage,
+                                         directory=os.path.join(SHARED_GALLERY_DIR, EMBEDDING_MODEL_VERSION))
+        else:
+            self.gallery = FaceGallery(storage=self.gallery_storage)
+        self.model_version = EMBEDDING_MODEL_VERSION
+        self.db_path = database_path(self.data_dir)
+        self.db_stamp = None
+        self._db_stamps = None       # (face_db.pickle, loaded file) mtimes at the last load
+        self._db_checked_at = 0.0
+        self._db_lock_handle = None  # Open while this process holds the face_db.pickle.lock flock
+        self.roster = subject_roster
         self.load_database()
     
-    def load_database(self):
-        """Load the face database from disk"""
-        db_path = os.path.join(self.data_dir, "face_db.pickle")
+    def _read_database(self, db_path):
+        face_db = {}
         if os.path.exists(db_path):
             try:
                 with open(db_path, 'rb') as f:
-                    self.face_db = pickle.load(f)
-                print(f"Loaded face database with {len(self.face_db)} student records")
+                    face_db = pickle.load(f)
+                print(f"Loaded face database with {len(face_db)} student records from {os.path.basename(db_path)}")
             except Exception as e:
                 print(f"Error loading face database: {str(e)}")
-                self.face_db = {}
+                face_db = {}
         else:
             print("No face database found, creating new one")
-            self.face_db = {}
+        
+        # Templates from before versions were recorded came from the library defaults
+        for student_data in face_db.values():
+            if isinstance(student_data, dict) and "encodings" in student_data and "model_versions" not in student_data:
+                student_data["model_versions"] = [LEGACY_MODEL_VERSION] * len(student_data["encodings"])
+        return face_db
+    
+    def _database_stamps(self):
+        return tuple(os.stat(path).st_mtime_ns if os.path.exists(path) else None
+                     for path in (database_path(self.data_dir), self.db_path))
+    
+    def load_database(self):
+        """Load the face database of this encoder's model version from disk"""
+        with self.lock:
+            self.db_path = database_path(self.data_dir)
+            self.face_db = self._read_database(self.db_path)
+            
+            # After reencode_gallery.py switched face_db.pickle to another model,
+            # processes still running this one keep serving the copy it left behind
+            if template_versions(self.face_db) - {self.model_version}:
+                own_path = database_path(self.data_dir, self.model_version)
+                if os.path.exists(own_path):
+                    self.db_path = own_path
+                    self.face_db = self._read_database(own_path)
+                else:
+                    logger.error(f"Face database holds templates of {sorted(template_versions(self.face_db))}; "
+                                 f"only {self.model_version} templates are matched until reencode_gallery.py is run")
+            self._db_stamps = self._database_stamps()
+            self.db_stamp = self._db_stamps[1]
+            
+            # Bring older databases with unbounded template lists back under the cap
+            pruned = False
+            for student_data in self.face_db.values():
+                if isinstance(student_data, dict) and "encodings" in student_data:
+                    if len(student_data["encodings"]) > template_manager.max_templates or "centroid" not in student_data:
+                        self._remove_template_images(template_manager.prune(student_data))
+                        pruned = True
+            if pruned:
+                self.save_database()
+            
+            self._update_gallery()
+    
+    def _update_gallery(self, student_ids=None):
+        """Rebuild (or, when shared, publish) the gallery after face_db changed"""
+        if isinstance(self.gallery, ShardedGallery):
+            # Shards load their own students; only registrations are forwarded
+            self.gallery.invalidate(self.face_db, student_ids=student_ids)
+            return
+        
+        # Templates of another encoder are never compared with this one's probes
+        face_db = templates_of_version(self.face_db, self.model_version)
+        if isinstance(self.gallery, SharedGallery):
+            # Attaches instead of publishing when the shared gallery already holds this face_db.pickle
+            self.gallery.invalidate(face_db, stamp=self.db_stamp)
+        else:
+            self.gallery.invalidate(face_db)
+    
+    def _reload_if_changed(self):
+        """Pick up registrations saved (or a re-encoded database switched in) by another process"""
+        if self._database_stamps() != self._db_stamps:
+            self.load_database()
+    
+    def _poll_database(self):
+        """_reload_if_changed at most every DB_POLL_INTERVAL seconds, without waiting on a reload in progress"""
+        now = time.time()
+        if now - self._db_checked_at < DB_POLL_INTERVAL:
+            return
+        self._db_checked_at = now
+        if self.lock.acquire(blocking=False):
+            try:
+                self._reload_if_changed()
+            finally:
+                self.lock.release()
+    
+    def _remove_template_images(self, image_paths):
+        """Delete the stored face crops of templates that were pruned
+        
+        Deleted on the artifact writer thread, after the crop's own write if
+        that is still queued, so no crop is written back after its template
+        was pruned.
+        """
+        for path in image_paths:
+            artifact_writer.remove(path)
+    
+    @contextmanager
+    def _database_lock(self):
+        """Hold the lock reencode_gallery.py takes to switch databases (reentrant within this process)
+        
+        flock() excludes other open file descriptions, so a nested open of the
+        lock file would wait on itself; the handle is kept for nested calls.
+        Callers hold self.lock.
+        """
+        if self._db_lock_handle is not None:
+            yield
+            return
+        with open(database_path(self.data_dir) + ".lock", "a+") as lock_handle:
+            lock_file(lock_handle)
+            self._db_lock_handle = lock_handle
+            try:
+                yield
+            finally:
+                self._db_lock_handle = None
+                unlock_file(lock_handle)
+    
+    @contextmanager
+    def _locked_update(self):
+        """Reload, modify and save face_db as one step with respect to other processes
+        
+        Another worker, the bulk enrolment CLI or a re-encode switch can only
+        change the database between our reload and our save if the lock is
+        held across both.
+        """
+        with self.lock, self._database_lock():
+            self._reload_if_changed()
+            if self.db_path != database_path(self.data_dir):
+                raise RuntimeError(f"{os.path.basename(self.db_path)} is not the active face database; "
+                                   f"registrations need a server running its encoder")
+            yield
     
     def save_database(self):
-        """Save the face database to disk"""
+        """Save the face database to disk
+        
+        Written to a temporary file and renamed into place, under the lock
+        reencode_gallery.py takes to switch databases, so readers never see
+        a partial pickle and a switch never interleaves with a save. A save
+        is refused if another process changed or switched the database since
+        this one loaded it; the next access reloads instead.
+        
+        Returns:
+            bool: Whether the database was written
+        """
         try:
-            db_path = os.path.join(self.data_dir, "face_db.pickle")
-            with open(db_path, 'wb') as f:
-                pickle.dump(self.face_db, f)
+            with self.lock, self._database_lock():
+                if self._database_stamps() != self._db_stamps:
+                    logger.error("Face database changed on disk since it was loaded; not overwriting it")
+                    self._db_stamps = None
+                    return False
+                temp_path = self.db_path + ".tmp"
+                with open(temp_path, 'wb') as f:
+                    pickle.dump(self.face_db, f)
+                os.replace(temp_path, self.db_path)
+                self._db_stamps = self._database_stamps()
+                self.db_stamp = self._db_stamps[1]
             print(f"Saved face database with {len(self.face_db)} student records")
+            return True
         except Exception as e:
             print(f"Error saving face database: {str(e)}")
+            return False
     
-    def detect_faces(self, image):
-        """Detect faces using MTCNN"""
+    def detect_faces_detailed(self, image, min_confidence=0.9, min_size=20):
+        """Detect faces using MTCNN and return every face above the quality bar
+        
+        Returns:
+            tuple: (list of face dicts, rgb_image). Each dict holds the margin-padded
+            "box" and "face_image", the raw MTCNN "face_box", "confidence" and "keypoints".
+        """
         if image is None:
-            return [], None, None
+            return [], None
         
         # Convert to RGB for face_recognition library
         rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
@@ -90,12 +283,11 @@ class FaceDetector:
         # Detect faces using MTCNN
         faces = self.mtcnn_detector.detect_faces(rgb_image)
         
-        detected_faces = []
-        face_images = []
+        detections = []
         
         for face in faces:
             # Check confidence
-            if face['confidence'] < 0.9:  # Only accept high confidence detections
+            if face['confidence'] < min_confidence:  # Only accept high confidence detections
                 continue
                 
             # Get face coordinates
@@ -114,11 +306,40 @@ class FaceDetector:
             # Extract face with margin
             face_img = image[y_min:y_max, x_min:x_max]
             
-            if face_img.size == 0 or face_img.shape[0] < 20 or face_img.shape[1] < 20:
+            if face_img.size == 0 or face_img.shape[0] < min_size or face_img.shape[1] < min_size:
                 continue
-                
-            detected_faces.append((x_min, y_min, x_max - x_min, y_max - y_min))
-            face_images.append(face_img)
+            
+            detections.append({
+                "box": (x_min, y_min, x_max - x_min, y_max - y_min),
+                "face_box": (max(0, x), max(0, y), w, h),
+                "face_image": face_img,
+                "confidence": face['confidence'],
+                "keypoints": face.get('keypoints', {})
+            })
+        
+        return detections, rgb_image
+    
+    def detect_faces(self, image, group=False):
+        """Detect faces using MTCNN
+        
+        Args:
+            image: BGR image
+            group: Apply the stricter group-photo quality bar and return every face passing it
+        """
+        if image is None:
+            return [], None, None
+        
+        if group:
+            detections, rgb_image = self.detect_faces_detailed(
+                image,
+                min_confidence=self.group_min_detection_confidence,
+                min_size=self.group_min_face_size
+            )
+        else:
+            detections, rgb_image = self.detect_faces_detailed(image)
+        
+        detected_faces = [d["box"] for d in detections]
+        face_images = [d["face_image"] for d in detections]
         
         return detected_faces, face_images, rgb_image
     
@@ -128,7 +349,7 @@ class FaceDetector:
         rgb_face = cv2.cvtColor(face_image, cv2.COLOR_BGR2RGB)
         
         # Get face landmarks and compute encoding
-        face_encodings = face_recognition.face_encodings(rgb_face)
+        face_encodings = face_recognition.face_encodings(rgb_face, num_jitters=ENCODER_JITTERS, model=ENCODER_LANDMARKS)
         
         if not face_encodings:
             return None
@@ -136,27 +357,58 @@ class FaceDetector:
         # Return first face encoding (we're assuming one face per image)
         return face_encodings[0]
     
-    def register_face(self, image_path, student_id):
-        """Register a new face for the student ID"""
+    def extract_face_encodings_batch(self, rgb_image, face_boxes):
+        """Encode several faces of one image in a single batch
+        
+        Args:
+            rgb_image: Full RGB image the faces were detected in
+            face_boxes: List of (x, y, w, h) boxes from MTCNN
+        
+        Returns:
+            numpy array of shape (len(face_boxes), 128)
+        """
+        if not face_boxes:
+            return np.zeros((0, 128))
+        
+        # face_recognition expects (top, right, bottom, left) locations
+        locations = [(y, x + w, y + h, x) for (x, y, w, h) in face_boxes]
+        encodings = face_recognition.face_encodings(rgb_image, known_face_locations=locations,
+                                                    num_jitters=ENCODER_JITTERS, model=ENCODER_LANDMARKS)
+        return np.asarray(encodings)
+    
+    def gallery_view(self, subject=None, student_ids=None):
+        """Gallery view to search: an explicit student list, the subject roster, or everyone"""
+        self._poll_database()
+        
+        if student_ids is not None:
+            return self.gallery.view(student_ids)
+        
+        roster_ids = self.roster.students(subject)
+        if roster_ids is None:
+            return self.gallery.view()
+        
+        # Cached per subject until the gallery or the rosters change
+        return self.gallery.view(roster_ids, key=(subject.upper(), self.roster.generation))
+    
+    def register_face(self, image_path, student_id, subject=None):
+        """Register a new face for the student ID
+        
+        If a subject with a roster is given, the student is also enrolled in it.
+        Subjects without a roster are left alone: a roster created by one
+        registration would shut every other student out of the subject.
+        """
         try:
+            if not self.accepts_registrations():
+                return {"success": False, "message": "Registration is paused on this server until it runs the current face encoder"}
+            
             # Load the image
             image = cv2.imread(image_path)
             if image is None:
                 return {"success": False, "message": "Could not read image"}
             
-            # Detect faces
-            faces, face_images, rgb_image = self.detect_faces(image)
-            
-            if not faces or not face_images:
-                return {"success": False, "message": "No faces detected in the image"}
-            
-            if len(faces) > 1:
-                return {"success": False, "message": "Multiple faces detected in the image"}
-            
-            # Extract face encoding for deep learning-based comparison
-            face_encoding = self.extract_face_encoding(face_images[0])
-            if face_encoding is None:
-                return {"success": False, "message": "Could not extract face features"}
+            encoded = self.encode_registration_image(image)
+            if not encoded["success"]:
+                return encoded
             
             # Create the student directory if it doesn't exist
             student_dir = os.path.join(self.data_dir, student_id)
@@ -164,10 +416,87 @@ class FaceDetector:
             
             # Save face image for reference
             face_path = os.path.join(student_dir, f"face_{datetime.now().strftime('%Y%m%d%H%M%S')}.jpg")
-            cv2.imwrite(face_path, face_images[0])
+            artifact_writer.write_image(face_path, encoded["face_image"], kind="template")
             
-            # Check if student already exists and handle database structure issues
-            with self.lock:
+            # Add the template and save the updated database
+            self.add_templates([(student_id, encoded["encoding"], face_path)])
+            
+            if subject and self.roster.students(subject) is not None:
+                self.roster.enroll(subject, student_id)
+            
+            return {"success": True, "message": f"Face registered for student {student_id}"}
+            
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            return {"success": False, "message": f"Error registering face: {str(e)}"}
+    
+    def encode_registration_image(self, image):
+        """Quality-check, detect and encode the one face of a registration photo
+        
+        Touches neither the disk nor the face database, so bulk enrolment can
+        run it in worker processes and commit the results in batches.
+        
+        Returns:
+            dict: {"success": True, "face_image": ..., "encoding": ...} or a failure result
+        """
+        # Reject blurry or badly exposed images before running MTCNN
+        gate = self.quality_gate.check_image(image)
+        if not gate["passed"]:
+            return {"success": False, "message": gate["message"], "retake": True}
+        
+        # Detect faces
+        detections, rgb_image = self.detect_faces_detailed(image)
+        
+        if not detections:
+            return {"success": False, "message": "No faces detected in the image"}
+        
+        if len(detections) > 1:
+            return {"success": False, "message": "Multiple faces detected in the image"}
+        
+        # Reject tiny, turned or blurry faces before running the encoder
+        gate = self.quality_gate.check_face(image, detections[0])
+        if not gate["passed"]:
+            return {"success": False, "message": gate["message"], "retake": True}
+        
+        # Extract face encoding for deep learning-based comparison
+        face_encoding = self.extract_face_encoding(detections[0]["face_image"])
+        if face_encoding is None:
+            return {"success": False, "message": "Could not extract face features"}
+        
+        return {"success": True, "face_image": detections[0]["face_image"], "encoding": face_encoding}
+    
+    def accepts_registrations(self):
+        """Whether this process serves face_db.pickle itself
+        
+        A process on another encoder than the active database serves a
+        face_db.<version>.pickle copy (kept after, or staged before, a
+        re-encode). Nothing carries that copy's changes into face_db.pickle,
+        so such a process must not register faces.
+        """
+        with self.lock:
+            self._reload_if_changed()
+            return self.db_path == database_path(self.data_dir)
+    
+    def is_registered(self, student_id):
+        """Whether student_id has at least one template"""
+        with self.lock:
+            student_data = self.face_db.get(student_id)
+            return isinstance(student_data, dict) and bool(student_data.get("encodings"))
+    
+    def add_templates(self, templates):
+        """Add (student_id, encoding, face image path) templates with one database write
+        
+        A template whose image path the student already has is skipped, so a
+        batch can be committed again after an interrupted run.
+        
+        Returns:
+            int: Number of templates added
+        """
+        added = 0
+        student_ids = []
+        with self._locked_update():
+            for student_id, face_encoding, face_path in templates:
                 # Reset the database entry if it has an incorrect structure
                 if student_id in self.face_db:
                     # Check if the structure is correct (has 'encodings' key)
@@ -179,100 +508,199 @@ class FaceDetector:
                             "image_paths": [],
                             "registered_on": datetime.now().isoformat()
                         }
-                        
-                    # Add this face encoding to the existing student record
-                    self.face_db[student_id]["encodings"].append(face_encoding)
-                    self.face_db[student_id]["image_paths"].append(face_path)
                 else:
                     # Create a new student record
                     self.face_db[student_id] = {
-                        "encodings": [face_encoding],
-                        "image_paths": [face_path],
+                        "encodings": [],
+                        "image_paths": [],
                         "registered_on": datetime.now().isoformat()
                     }
                 
-                # Save the updated database
-                self.save_database()
-            
-            return {"success": True, "message": f"Face registered for student {student_id}"}
+                if face_path in self.face_db[student_id].get("image_paths", []):
+                    continue
+                
+                # Add the template, keeping the set bounded and diverse
+                pruned_paths = template_manager.add_template(self.face_db[student_id], face_encoding, face_path,
+                                                             self.model_version)
+                self._remove_template_images(pruned_paths)
+                added += 1
+                if student_id not in student_ids:
+                    student_ids.append(student_id)
             
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
-            return {"success": False, "message": f"Error registering face: {str(e)}"}
+            if added:
+                # Save the updated database
+                if not self.save_database():
+                    self._reload_if_changed()
+                    raise RuntimeError("Face database could not be saved; registration was not stored")
+                self._update_gallery(student_ids)
+        return added
     
     def recognize_face(self, image_path):
         """Recognize a face in an image and return the student ID"""
         try:
-            # Load the image
-            image = cv2.imread(image_path)
-            if image is None:
-                return {"success": False, "message": "Could not read image"}
+            # Load the raw bytes and check the cache before decoding anything
+            with open(image_path, 'rb') as f:
+                data = f.read()
+            
+            content_key = content_hash(data)
+            cached = self.embedding_cache.get(content_key)
             
-            # Extract claimed student ID from filename
+            image = None
+            if cached is None:
+                with metrics.stage("decode"):
+                    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+                if image is None:
+                    return {"success": False, "message": "Could not read image"}
+            
+            # Extract claimed student ID and subject from filename (<roll>_<subject>_...)
             claimed_id = None
+            subject = None
             try:
                 filename = os.path.basename(image_path)
-                name_part = os.path.splitext(filename)[0]
-                if "_" in name_part:
-                    claimed_id = name_part.split("_")[0]
+                if "_" in os.path.splitext(filename)[0]:
+                    claimed_id, subject = parse_upload_name(filename)
                     logger.info(f"Claimed student ID from filename: {claimed_id}")
             except Exception as e:
                 logger.error(f"Error extracting ID from filename: {str(e)}")
             
-            # Detect faces
-            faces, face_images, rgb_image = self.detect_faces(image)
+            return self.recognize_face_image(
+                image, claimed_id=claimed_id, image_name=os.path.basename(image_path), subject=subject,
+                content_key=content_key, cached=cached
+            )
             
-            if not faces or not face_images:
-                return {"success": False, "message": "No faces detected in the image"}
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            return {"success": False, "message": f"Error recognizing face: {str(e)}"}
+    
+    def _encode_single_face(self, image, image_name, content_key=None):
+        """Detect and encode the single face of an upload and cache the outcome
+        
+        The perceptual hash only flags a near-duplicate of a recent upload;
+        separate webcam frames can share a dHash, so the image is always
+        detected and encoded itself.
+        
+        Returns:
+            cache entry with "encoding" and "box", or with "message" on failure
+        """
+        if content_key is None:
+            # Frames decoded by the caller (e.g. the QR kiosk) are keyed by their pixels
+            content_key = content_hash(image.tobytes())
+            cached = self.embedding_cache.get(content_key)
+            if cached is not None:
+                return cached
+        
+        phash = perceptual_hash(image)
+        near_duplicate_of = self.embedding_cache.near_duplicate_of(phash, key=content_key)
+        if near_duplicate_of:
+            logger.info(f"{image_name} looks like a near-duplicate of a recent upload")
+        
+        def put(**outcome):
+            return self.embedding_cache.put(content_key, phash, near_duplicate_of=near_duplicate_of, **outcome)
+        
+        # Reject blurry or badly exposed images before running MTCNN
+        with metrics.stage("quality_gate"):
+            gate = self.quality_gate.check_image(image)
+        if not gate["passed"]:
+            return put(message=gate["message"])
+        
+        # Detect faces
+        with metrics.stage("detect"):
+            detections, rgb_image = self.detect_faces_detailed(image)
+        
+        if not detections:
+            return put(message="No faces detected in the image")
+        
+        if len(detections) > 1:
+            return put(message="Multiple faces detected in the image")
+        
+        # Reject tiny, turned or blurry faces before running the encoder
+        with metrics.stage("quality_gate"):
+            gate = self.quality_gate.check_face(image, detections[0])
+        if not gate["passed"]:
+            return put(message=gate["message"])
+        
+        face_image = detections[0]["face_image"]
+        
+        # Debug: save detected face
+        if self.debug:
+            debug_path = os.path.join(self.debug_dir, f"recognize_{image_name}")
+            artifact_writer.write_image(debug_path, face_image, kind="debug")
             
-            if len(faces) > 1:
-                return {"success": False, "message": "Multiple faces detected in the image"}
+        # Extract face encoding
+        with metrics.stage("encode"):
+            face_encoding = self.extract_face_encoding(face_image)
+        if face_encoding is None:
+            return put(message="Could not extract face features")
+        
+        return put(encoding=face_encoding, box=detections[0]["box"])
+    
+    def recognize_face_image(self, image, claimed_id=None, image_name="image.jpg", subject=None,
+                             content_key=None, cached=None):
+        """Recognize a face in an already decoded BGR image
+        
+        Lets callers that already hold the decoded frame (e.g. the QR kiosk path)
+        run recognition without writing the image to disk and reading it back.
+        When the subject has a roster, only its enrolled students are searched.
+        A cache entry found by content hash can be passed instead of the image.
+        If the claimed student's gallery shard did not answer, the result has
+        "retry": True and the upload should be processed again later.
+        """
+        try:
+            if image is None and cached is None:
+                return {"success": False, "message": "Could not read image"}
             
-            # Debug: save detected face
-            if self.debug:
-                debug_path = os.path.join(self.debug_dir, f"recognize_{os.path.basename(image_path)}")
-                cv2.imwrite(debug_path, face_images[0])
-                
-            # Extract face encoding
-            face_encoding = self.extract_face_encoding(face_images[0])
-            if face_encoding is None:
-                return {"success": False, "message": "Could not extract face features"}
+            # Students outside the subject roster cannot attend it
+            if claimed_id and not self.roster.is_enrolled(subject, claimed_id):
+                return {"success": False, "message": f"Student {claimed_id} is not enrolled in {subject}"}
             
-            # Compare with all registered faces
-            results = []
+            if cached is None:
+                cached = self._encode_single_face(image, image_name, content_key)
             
+            # Flag the same photo being submitted for several roll numbers
+            shared_with = self.embedding_cache.record_claim(cached["key"], claimed_id) if claimed_id else []
+            if shared_with:
+                logger.warning(f"Photo {image_name} for {claimed_id} was also submitted for {shared_with}")
+            
+            if cached["message"]:
+                return {"success": False, "message": cached["message"], "shared_with": shared_with}
+            face_encoding = cached["encoding"]
+            
+            # Compare with the registered faces of the subject roster (or everyone)
             with self.lock:
                 # If no registered faces, return failure
-                if not self.face_db:
-                    return {"success": False, "message": "No registered faces found"}
+                # Workers attached to a shared gallery may hold an older face_db
+                if not self.face_db and not len(self.gallery.view()):
+                    return {"success": False, "message": "No registered faces found", "no_match": True}
                 
-                # Compare with each student's face encodings
-                for student_id, student_data in self.face_db.items():
-                    best_match_score = 0
-                    
-                    # Compare with all encodings for this student
-                    for encoding in student_data["encodings"]:
-                        # Calculate similarity score (higher is better)
-                        similarity = 1 - face_recognition.face_distance([encoding], face_encoding)[0]
-                        
-                        # Keep track of best score
-                        if similarity > best_match_score:
-                            best_match_score = similarity
-                    
+                view = self.gallery_view(subject=subject)
+                match_key = (self.gallery.generation, subject.upper() if subject else None, self.roster.generation)
+            
+            # Matches are reused as long as the gallery and rosters are unchanged
+            results = self.embedding_cache.get_matches(cached, match_key)
+            if results is None:
+                # Best similarity per student (higher is better), top 3 only
+                results = []
+                with metrics.stage("gallery_match"):
+                    matches = view.search(face_encoding, top_k=3)
+                # A sharded gallery answers without shards that are down or slow
+                missing = getattr(view, "last_missing", [])
+                if claimed_id and shard_for(claimed_id, len(self.gallery.clients)) in missing:
+                    return {"success": False, "retry": True, "shared_with": shared_with,
+                            "message": f"Gallery shard of {claimed_id} is unavailable, try again"}
+                for student_id, similarity in matches:
                     # Convert to percentage for easier understanding
-                    confidence = best_match_score * 100
+                    confidence = max(similarity, 0) * 100
                     
-                    # Only add results that meet minimum threshold
-                    # or add all results but mark them as passing/failing threshold
+                    # Add results but mark them as passing/failing threshold
                     results.append({
                         "student_id": student_id,
                         "confidence": confidence,
                         "passes_threshold": confidence >= (self.min_confidence * 100)
                     })
-            
-            # Sort by confidence (highest first)
-            results.sort(key=lambda x: x["confidence"], reverse=True)
+                # Matches from a partial scatter-gather are not cached
+                if not missing:
+                    self.embedding_cache.put_matches(cached, match_key, results)
             
             # Get the best match
             best_match = results[0] if results else None
@@ -301,6 +729,10 @@ class FaceDetector:
                 "passes_threshold": is_match,
                 "verified": verified,
                 "claimed_id": claimed_id,
+                "subject": subject,
+                "gallery_size": len(view),
+                "shared_with": shared_with,
+                "near_duplicate": bool(cached.get("near_duplicate_of")),
                 "threshold": self.min_confidence * 100
             }
             
@@ -309,43 +741,136 @@ class FaceDetector:
             traceback.print_exc()
             return {"success": False, "message": f"Error recognizing face: {str(e)}"}
     
+    def recognize_group(self, image_path, roster=None, subject=None):
+        """Recognize every student in a group (classroom) photo
+        
+        Faces are encoded in one batch and assigned to students one-to-one, so no
+        student can be matched to more than one face.
+        
+        Args:
+            image_path: Path to the group photo
+            roster: Optional iterable of student IDs to match against
+            subject: Optional subject whose roster is used when no roster is given
+        
+        Returns:
+            dict with the matched students and the faces left unmatched
+        """
+        try:
+            # Load the image
+            image = cv2.imread(image_path)
+            if image is None:
+                return {"success": False, "message": "Could not read image"}
+            
+            # Detect every face passing the group quality bar
+            detections, rgb_image = self.detect_faces_detailed(
+                image,
+                min_confidence=self.group_min_detection_confidence,
+                min_size=self.group_min_face_size
+            )
+            
+            if not detections:
+                return {"success": False, "message": "No faces detected in the image"}
+            
+            # Encode all faces in one pass over the image
+            probe_encodings = self.extract_face_encodings_batch(
+                rgb_image, [d["face_box"] for d in detections]
+            )
+            if len(probe_encodings) == 0:
+                return {"success": False, "message": "Could not extract face features"}
+            
+            view = self.gallery_view(subject=subject, student_ids=roster)
+            if len(view) == 0:
+                return {"success": False, "message": "No registered faces found"}
+            
+            similarities = view.similarity_matrix(probe_encodings)
+            student_ids = view.student_ids
+            # Without a shard's students, faces would be assigned to the wrong ones
+            if getattr(view, "last_missing", []):
+                return {"success": False, "retry": True,
+                        "message": f"Gallery shards {view.last_missing} are unavailable, try again"}
+            
+            # One-to-one assignment maximising total similarity
+            face_rows, student_cols = linear_sum_assignment(similarities, maximize=True)
+            
+            matches = []
+            matched_faces = set()
+            for row, col in zip(face_rows, student_cols):
+                confidence = similarities[row, col] * 100
+                if confidence < self.min_confidence * 100:
+                    continue
+                
+                matched_faces.add(row)
+                matches.append({
+                    "student_id": student_ids[col],
+                    "confidence": confidence,
+                    "box": detections[row]["box"]
+                })
+            
+            matches.sort(key=lambda x: x["confidence"], reverse=True)
+            unmatched = [detections[i]["box"] for i in range(len(detections)) if i not in matched_faces]
+            
+            logger.info(f"Group photo {os.path.basename(image_path)}: {len(detections)} faces, {len(matches)} recognized")
+            
+            return {
+                "success": True,
+                "faces_detected": len(detections),
+                "matches": matches,
+                "unmatched_faces": unmatched,
+                "threshold": self.min_confidence * 100
+            }
+            
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            return {"success": False, "message": f"Error recognizing group photo: {str(e)}"}
+    
     def register_faces_in_bulk(self, directory_path):
         """Register multiple faces from a directory
-        Images should be named: student_id.jpg"""
+        Images should be named: student_id.jpg
+        
+        For large batches use bulk_enrollment.py, which encodes in parallel
+        processes, commits in batches and can resume."""
         results = {"success": 0, "failed": 0, "details": []}
         
         if not os.path.exists(directory_path):
             return {"success": False, "message": f"Directory {directory_path} does not exist"}
         
+        pending = []
         for filename in os.listdir(directory_path):
             if filename.endswith(('.jpg', '.jpeg', '.png')):
-                try:
-                    # Extract student_id from filename
-                    student_id = os.path.splitext(filename)[0]
-                    if "_" in student_id:
-                        student_id = student_id.split("_")[0]
-                        
-                    image_path = os.path.join(directory_path, filename)
-                    
-                    # Register the face
-                    result = self.register_face(image_path, student_id)
-                    
-                    if result["success"]:
-                        results["success"] += 1
-                    else:
-                        results["failed"] += 1
+                # Extract student_id from filename
+                student_id = os.path.splitext(filename)[0]
+                if "_" in student_id:
+                    student_id = student_id.split("_")[0]
                     
-                    results["details"].append({
-                        "student_id": student_id,
-                        "result": result
-                    })
-                    
-                except Exception as e:
+                image_path = os.path.join(directory_path, filename)
+                # Enrolment jobs run behind kiosk checks and uploads, all in one
+                # enrolment queue (subject=None): a per-student key would only add queues to rotate through
+                future = job_scheduler.submit(self.register_face, image_path, student_id,
+                                              priority="enrolment", subject=None)
+                pending.append((filename, student_id, future))
+        
+        for filename, student_id, future in pending:
+            try:
+                # Register the face
+                result = future.result()
+                
+                if result["success"]:
+                    results["success"] += 1
+                else:
                     results["failed"] += 1
-                    results["details"].append({
-                        "filename": filename,
-                        "error": str(e)
-                    })
+                
+                results["details"].append({
+                    "student_id": student_id,
+                    "result": result
+                })
+                
+            except Exception as e:
+                results["failed"] += 1
+                results["details"].append({
+                    "filename": filename,
+                    "error": str(e)
+                })
         
         return results
     
@@ -500,6 +1025,10 @@ class FaceDetector:
 # Create a singleton instance
 face_detector = FaceDetector()
 
+# Shared and sharded galleries hold locks and connections a forked worker must not share
+if hasattr(os, "register_at_fork") and hasattr(face_detector.gallery, "after_fork"):
+    os.register_at_fork(after_in_child=face_detector.gallery.after_fork)
+
 if __name__ == "__main__":
     import sys
     
@@ -0,0 +1,300 @@
+import os
+import tempfile
+import threading
+import numpy as np
+
+# Define constants directly in the module (no config import)
+PRESCREEN_CANDIDATES = 64   # Students kept after the centroid pre-screen in large galleries
+RERANK_CANDIDATES = 16      # Students re-ranked exactly after a quantized coarse search
+COARSE_BLOCK_ROWS = 8192    # Rows dequantized at a time, bounds temporary memory per query
+GALLERY_STORAGES = ("float64", "float16", "int8")
+# Where quantized galleries keep their full-precision templates (default: the system temp directory)
+SPILL_DIR = os.environ.get("GALLERY_SPILL_DIR") or None
+
+
+def spill(matrix, directory=SPILL_DIR):
+    """Read-only memory map of a float32 copy of matrix, backed by an unlinked temporary file
+
+    Only the pages that are read get loaded, so the copy does not count
+    against the process's resident memory the way an in-memory array does.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if not matrix.size:
+        return matrix
+    with tempfile.TemporaryFile(dir=directory) as handle:
+        matrix.tofile(handle)
+        handle.flush()
+        # The mapping stays valid after the file is closed
+        return np.memmap(handle, dtype=np.float32, mode="r", shape=matrix.shape)
+
+
+class QuantizedMatrix:
+    """Compact copy of a template matrix for the coarse search
+
+    float16 halves float32 storage; int8 stores each vector as int8 codes
+    with its own float32 scale (max |value| / 127), a quarter of float32.
+    """
+
+    def __init__(self, matrix, storage):
+        if storage not in ("float16", "int8"):
+            raise ValueError(f"Unsupported quantized storage: {storage}")
+        self.storage = storage
+        matrix = np.asarray(matrix, dtype=np.float32)
+
+        if storage == "float16":
+            self.codes = matrix.astype(np.float16)
+            self.scales = None
+        else:
+            scales = np.abs(matrix).max(axis=1) / 127.0 if len(matrix) else np.zeros(0, dtype=np.float32)
+            scales = np.maximum(scales, 1e-12).astype(np.float32)
+            self.codes = np.round(matrix / scales[:, None]).astype(np.int8)
+            self.scales = scales
+
+        # Squared norms of the dequantized vectors, for ||q - x||^2 = |q|^2 + |x|^2 - 2 q.x
+        self.norms = np.empty(len(matrix), dtype=np.float32)
+        for start in range(0, len(matrix), COARSE_BLOCK_ROWS):
+            block = self.dequantize(slice(start, start + COARSE_BLOCK_ROWS))
+            self.norms[start:start + len(block)] = np.sum(block * block, axis=1)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.norms.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def dequantize(self, rows):
+        block = self.codes[rows].astype(np.float32)
+        if self.scales is not None:
+            block *= self.scales[rows][:, None]
+        return block
+
+    def distances(self, probe, rows=None):
+        """Approximate distances from one probe to every row (or the given row indices), float32"""
+        probe = np.asarray(probe, dtype=np.float32)
+        count = len(self.codes) if rows is None else len(rows)
+        dots = np.empty(count, dtype=np.float32)
+        for start in range(0, count, COARSE_BLOCK_ROWS):
+            block_rows = slice(start, start + COARSE_BLOCK_ROWS) if rows is None else rows[start:start + COARSE_BLOCK_ROWS]
+            block = self.dequantize(block_rows)
+            dots[start:start + len(block)] = block @ probe
+        norms = self.norms if rows is None else self.norms[rows]
+        squared = norms + np.dot(probe, probe) - 2.0 * dots
+        return np.sqrt(np.maximum(squared, 0.0))
+
+
+class GalleryView:
+    """Template matrix for a set of students
+
+    Templates are stored grouped by student, so the best match per student
+    is a single np.minimum.reduceat over the distance vector. Views over
+    part of a gallery (subset) keep the gallery's matrix, which may be
+    memory-mapped, and the indices of their rows in it rather than a copy.
+    """
+
+    def __init__(self, student_ids, matrix, starts, centroids=None, rows=None):
+        self.student_ids = student_ids
+        self.matrix = matrix
+        self.rows = rows            # Rows of matrix holding this view's templates (None: all of them)
+        self.starts = starts
+        self.counts = np.diff(np.append(starts, self.template_count)).astype(np.intp)
+        self.row_owner = np.repeat(np.arange(len(student_ids)), self.counts)
+
+        # Per-student centroids for a cheap first pass over large galleries
+        if centroids is None and len(student_ids):
+            centroids = np.add.reduceat(self.templates(), starts, axis=0) / self.counts[:, None]
+        self.centroids = centroids
+
+        # Optional quantized copy used for a coarse first pass
+        self.coarse = None
+
+    def quantize(self, storage):
+        """Attach a float16/int8 copy of the templates for coarse search
+
+        The full-precision templates are then only read to re-rank a few
+        candidates (and the centroids not at all), so unless they are
+        memory-mapped already (SharedGallery) they are moved to spill files
+        and mapped rather than kept in memory.
+        """
+        if storage == "float64":
+            self.coarse = None
+            return self
+        self.coarse = QuantizedMatrix(self.matrix, storage)
+        if not isinstance(self.matrix, np.memmap):
+            self.matrix = spill(self.matrix)
+        if self.centroids is not None and not isinstance(self.centroids, np.memmap):
+            self.centroids = spill(self.centroids)
+        return self
+
+    @property
+    def nbytes(self):
+        """Bytes this view holds in process memory (memory-mapped arrays are not counted)"""
+        arrays = [self.matrix, self.centroids, self.starts, self.counts, self.row_owner, self.rows]
+        resident = sum(a.nbytes for a in arrays if a is not None and not isinstance(a, np.memmap))
+        return resident + (self.coarse.nbytes if self.coarse is not None else 0)
+
+    def __len__(self):
+        return len(self.student_ids)
+
+    @property
+    def template_count(self):
+        return len(self.matrix) if self.rows is None else len(self.rows)
+
+    def templates(self):
+        """This view's templates as one array (gathered from the matrix for subset views)"""
+        return self.matrix if self.rows is None else self.matrix[self.rows]
+
+    def dense(self, dtype=None):
+        """View with its own contiguous copy of the templates, for small re-rank views"""
+        matrix = np.asarray(self.templates(), dtype=dtype)
+        return GalleryView(self.student_ids, matrix, self.starts, self.centroids)
+
+    def distances(self, probes):
+        """Euclidean distances of each probe to every template, shape (P, N)"""
+        matrix = self.templates()
+        probes = np.atleast_2d(np.asarray(probes, dtype=matrix.dtype))
+        if len(probes) == 1:
+            return np.linalg.norm(matrix - probes[0], axis=1)[None, :]
+
+        squared = (np.sum(probes * probes, axis=1)[:, None] +
+                   np.sum(matrix * matrix, axis=1)[None, :] -
+                   2.0 * probes @ matrix.T)
+        return np.sqrt(np.maximum(squared, 0.0))
+
+    def similarity_matrix(self, probes):
+        """Best similarity (1 - face distance) of each probe per student, shape (P, S)"""
+        if len(self.student_ids) == 0:
+            return np.zeros((len(np.atleast_2d(probes)), 0))
+        return 1.0 - np.minimum.reduceat(self.distances(probes), self.starts, axis=1)
+
+    def subset(self, indices):
+        """View over the students at the given (sorted) positions, sharing this view's matrix"""
+        indices = np.asarray(indices, dtype=np.intp)
+        rows = np.flatnonzero(np.isin(self.row_owner, indices))
+        if self.rows is not None:
+            rows = self.rows[rows]
+        counts = self.counts[indices]
+        starts = (np.cumsum(counts) - counts).astype(np.intp)
+        centroids = self.centroids[indices] if self.centroids is not None else None
+        view = GalleryView([self.student_ids[i] for i in indices], self.matrix, starts, centroids, rows=rows)
+        view.coarse = self.coarse
+        return view
+
+    def prescreen(self, probe, candidates=PRESCREEN_CANDIDATES):
+        """Positions of the students whose centroids are closest to the probe"""
+        if self.centroids is None or len(self.student_ids) <= candidates:
+            return np.arange(len(self.student_ids))
+        distances = np.linalg.norm(self.centroids - np.asarray(probe, dtype=self.centroids.dtype), axis=1)
+        return np.sort(np.argpartition(distances, candidates - 1)[:candidates])
+
+    def coarse_candidates(self, probe, candidates=RERANK_CANDIDATES):
+        """Positions of the best students according to the quantized templates"""
+        if len(self.student_ids) <= candidates:
+            return np.arange(len(self.student_ids))
+        best = np.minimum.reduceat(self.coarse.distances(probe, self.rows), self.starts)
+        return np.sort(np.argpartition(best, candidates - 1)[:candidates])
+
+    def search(self, probe, top_k=None, prescreen=PRESCREEN_CANDIDATES):
+        """Rank students by their best similarity to a single probe
+
+        With quantized storage the whole view is scanned coarsely and only the
+        best RERANK_CANDIDATES students are re-ranked in float32. Otherwise
+        large views are first narrowed to the students with the nearest
+        centroids, and only their templates are compared exactly.
+
+        Returns:
+            list of (student_id, similarity) pairs, best first
+        """
+        view = self
+        if self.coarse is not None and len(self.student_ids):
+            rerank = max(RERANK_CANDIDATES, top_k or 0)
+            view = self.subset(self.coarse_candidates(probe, rerank)).dense(np.float32)
+        elif prescreen and len(self.student_ids) > prescreen:
+            view = self.subset(self.prescreen(probe, prescreen))
+
+        similarities = view.similarity_matrix(probe)[0]
+        if top_k is not None and top_k < len(similarities):
+            candidates = np.argpartition(-similarities, top_k - 1)[:top_k]
+        else:
+            candidates = np.arange(len(similarities))
+        order = candidates[np.argsort(-similarities[candidates])]
+        return [(view.student_ids[i], float(similarities[i])) for i in order]
+
+
+class FaceGallery:
+    """Matrix form of face_db with cached per-subject views
+
+    The gallery is rebuilt lazily: registrations only bump the generation,
+    and the next search rebuilds the matrix and any views it needs. With
+    storage="float16" or "int8" views also carry a quantized coarse copy and
+    map their full-precision templates from a spill file.
+    """
+
+    def __init__(self, storage="float64"):
+        if storage not in GALLERY_STORAGES:
+            raise ValueError(f"Unsupported gallery storage: {storage}")
+        self.storage = storage
+        self.lock = threading.RLock()
+        self.generation = 0
+        self._built_generation = -1
+        self._full_view = GalleryView([], np.zeros((0, 128)), np.zeros(0, dtype=np.intp))
+        self._views = {}
+        self._face_db = {}
+
+    def invalidate(self, face_db=None):
+        """Mark the gallery stale after face_db changed (e.g. a new registration)"""
+        with self.lock:
+            if face_db is not None:
+                self._face_db = face_db
+            self.generation += 1
+
+    def _rebuild(self):
+        student_ids = []
+        blocks = []
+        starts = []
+        centroids = []
+        offset = 0
+
+        for student_id, student_data in self._face_db.items():
+            if not isinstance(student_data, dict) or not student_data.get("encodings"):
+                continue
+            encodings = np.asarray(student_data["encodings"], dtype=np.float64)
+            student_ids.append(student_id)
+            blocks.append(encodings)
+            starts.append(offset)
+            offset += len(encodings)
+
+            # Centroids are maintained by the template manager on registration
+            centroid = student_data.get("centroid")
+            centroids.append(encodings.mean(axis=0) if centroid is None else centroid)
+
+        matrix = np.vstack(blocks) if blocks else np.zeros((0, 128))
+        self._full_view = GalleryView(
+            student_ids, matrix, np.asarray(starts, dtype=np.intp),
+            np.vstack(centroids) if centroids else None
+        ).quantize(self.storage)
+        self._views = {}
+        self._built_generation = self.generation
+
+    def _ensure_built(self):
+        if self._built_generation != self.generation:
+            self._rebuild()
+
+    def view(self, student_ids=None, key=None):
+        """Gallery view restricted to student_ids (None means everyone)
+
+        Views are cached under key (e.g. the subject) until the next rebuild.
+        """
+        with self.lock:
+            self._ensure_built()
+            if student_ids is None:
+                return self._full_view
+
+            if key is not None and key in self._views:
+                return self._views[key]
+
+            full = self._full_view
+            wanted = set(student_ids)
+            indices = [i for i, student_id in enumerate(full.student_ids) if student_id in wanted]
+            view = full.subset(indices)
+
+            if key is not None:
+                self._views[key] = view
+            return view
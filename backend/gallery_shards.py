@@ -0,0 +1,515 @@
+import os
+import json
+import time
+import zlib
+import heapq
+import pickle
+import secrets
+import logging
+import argparse
+import threading
+import numpy as np
+from multiprocessing.connection import Listener, Client
+from concurrent.futures import ThreadPoolExecutor
+from face_gallery import FaceGallery
+
+logger = logging.getLogger('gallery_shards')
+
+# Define constants directly in the module (no config import)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FACE_DB_PATH = os.path.join(BASE_DIR, "known_faces", "face_db.pickle")
+# Comma-separated host:port list; shard i must be listed at position i
+GALLERY_SHARDS = [a.strip() for a in os.environ.get("GALLERY_SHARDS", "").split(",") if a.strip()]
+# Shared secret of the shard RPC (pickle behind an HMAC challenge); required, since
+# anyone who knows it can make a shard unpickle arbitrary objects
+SHARD_AUTHKEY = os.environ.get("GALLERY_SHARD_AUTHKEY", "").encode() or None
+SHARD_TIMEOUT = 0.5          # Seconds a search waits for the slowest shard before answering without it
+RETRY_INTERVAL = 5.0         # Seconds a shard that timed out or refused a connection is skipped
+LOAD_TIMEOUT = 60.0          # Seconds a shard may take to load or update its students
+IDLE_CONNECTIONS = 4         # Open connections kept per shard between requests
+
+
+def shard_for(student_id, num_shards):
+    """Stable shard of a student (same on every host and Python run)"""
+    return zlib.crc32(str(student_id).encode()) % num_shards
+
+
+def partition(face_db, num_shards):
+    """Split face_db into num_shards dicts by shard_for"""
+    parts = [{} for _ in range(num_shards)]
+    for student_id, student_data in face_db.items():
+        parts[shard_for(student_id, num_shards)][student_id] = student_data
+    return parts
+
+
+def parse_address(address):
+    host, _, port = address.rpartition(":")
+    return (host or "localhost", int(port))
+
+
+def gallery_entry(student_data):
+    """The part of a face_db entry a shard needs (no image paths)"""
+    return {"encodings": student_data.get("encodings", []), "centroid": student_data.get("centroid")}
+
+
+class ShardServer:
+    """One recognition node holding the students that hash to its shard
+
+    Requests are dicts sent over multiprocessing.connection (pickle behind an
+    HMAC challenge with SHARD_AUTHKEY); each connection is served by its own
+    thread and searches run concurrently against the shard's FaceGallery.
+    """
+
+    def __init__(self, shard, num_shards, address, storage="float64", delay=0.0, authkey=SHARD_AUTHKEY):
+        if not authkey:
+            raise ValueError("Set GALLERY_SHARD_AUTHKEY to a secret shared by the shards and their coordinators")
+        self.shard = shard
+        self.num_shards = num_shards
+        self.address = address
+        self.delay = delay          # Artificial latency, for testing slow shards
+        self.authkey = authkey
+        self.face_db = {}
+        self.lock = threading.Lock()
+        self.gallery = FaceGallery(storage=storage)
+        self.requests = 0
+
+    def load(self, face_db):
+        """Keep the students of face_db that belong to this shard"""
+        with self.lock:
+            self.face_db = {
+                student_id: gallery_entry(student_data)
+                for student_id, student_data in face_db.items()
+                if isinstance(student_data, dict) and shard_for(student_id, self.num_shards) == self.shard
+            }
+            self.gallery.invalidate(self.face_db)
+            # Build the matrix now rather than on the first search
+            self.gallery.view()
+        logger.info(f"Shard {self.shard}/{self.num_shards} holds {len(self.face_db)} students")
+
+    def load_pickle(self, path=FACE_DB_PATH):
+        with open(path, "rb") as f:
+            self.load(pickle.load(f))
+
+    def upsert(self, entries):
+        with self.lock:
+            for student_id, student_data in entries.items():
+                if shard_for(student_id, self.num_shards) == self.shard:
+                    self.face_db[student_id] = student_data
+            self.gallery.invalidate(self.face_db)
+
+    def _view(self, student_ids, key):
+        if student_ids is None:
+            return self.gallery.view()
+        return self.gallery.view(student_ids, key=key)
+
+    def handle(self, request):
+        op = request.get("op")
+        if self.delay:
+            time.sleep(self.delay)
+
+        if op == "search":
+            view = self._view(request.get("student_ids"), request.get("key"))
+            response = {"matches": view.search(request["probe"], top_k=request.get("top_k"))}
+        elif op == "similarity":
+            view = self._view(request.get("student_ids"), request.get("key"))
+            response = {"student_ids": list(view.student_ids), "similarities": view.similarity_matrix(request["probes"])}
+        elif op == "upsert":
+            self.upsert(request["entries"])
+            response = {}
+        elif op == "load":
+            self.load(request["face_db"])
+            response = {}
+        elif op == "stats":
+            response = {"shard": self.shard, "requests": self.requests}
+        else:
+            return {"error": f"Unknown op: {op}"}
+
+        response["generation"] = self.gallery.generation
+        response["students"] = len(self.face_db)
+        return response
+
+    def serve_connection(self, conn):
+        try:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    break
+                self.requests += 1
+                try:
+                    response = self.handle(request)
+                except Exception as e:
+                    logger.error(f"Shard {self.shard} failed on {request.get('op')}: {e}")
+                    response = {"error": str(e)}
+                try:
+                    conn.send(response)
+                except (BrokenPipeError, OSError):
+                    break
+        finally:
+            conn.close()
+
+    def serve_forever(self, ready=None):
+        with Listener(self.address, authkey=self.authkey) as listener:
+            logger.info(f"Shard {self.shard}/{self.num_shards} listening on {self.address}")
+            if ready is not None:
+                ready.set()
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    # Failed handshakes (wrong authkey, port scans) must not stop the shard
+                    logger.warning(f"Rejected connection: {e}")
+                    continue
+                threading.Thread(target=self.serve_connection, args=(conn,), daemon=True).start()
+
+
+class ShardClient:
+    """Coordinator-side connections to one shard
+
+    A request that times out leaves its reply in flight, so that connection
+    is closed rather than reused. A timeout or a refused connection marks the
+    shard down for RETRY_INTERVAL so searches stop waiting on it.
+    """
+
+    def __init__(self, shard, address, authkey=SHARD_AUTHKEY):
+        self.shard = shard
+        self.address = address
+        self.authkey = authkey
+        self.lock = threading.Lock()
+        self.idle = []
+        self.down_until = 0.0
+        self.students = None
+        self.generation = 0
+        self.unsynced = {}      # student ID -> entry this shard has not acknowledged yet
+
+    def _connect(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        return Client(self.address, authkey=self.authkey)
+
+    def _release(self, conn):
+        with self.lock:
+            if len(self.idle) < IDLE_CONNECTIONS:
+                self.idle.append(conn)
+                return
+        conn.close()
+
+    def is_down(self):
+        return time.time() < self.down_until
+
+    def request(self, message, timeout):
+        """Send one request; returns the response dict or raises"""
+        try:
+            conn = self._connect()
+        except OSError:
+            self.down_until = time.time() + RETRY_INTERVAL
+            raise
+        try:
+            conn.send(message)
+            if not conn.poll(timeout):
+                raise TimeoutError(f"Shard {self.shard} did not answer within {timeout:.2f}s")
+            response = conn.recv()
+        except TimeoutError:
+            # Skip a slow shard for a while instead of waiting on it every search
+            conn.close()
+            self.down_until = time.time() + RETRY_INTERVAL
+            raise
+        except BaseException:
+            conn.close()
+            raise
+        self._release(conn)
+
+        if "error" in response:
+            raise RuntimeError(f"Shard {self.shard}: {response['error']}")
+        self.students = response.get("students", self.students)
+        self.generation = response.get("generation", self.generation)
+        return response
+
+
+class ShardedView:
+    """Gallery view whose templates live on the shards
+
+    Supports what FaceDetector needs from a GalleryView: search(),
+    similarity_matrix() (after which student_ids holds the column order) and
+    len(). Shards that are down or slower than the timeout are left out and
+    listed in last_missing.
+    """
+
+    def __init__(self, gallery, student_ids=None, key=None):
+        self.gallery = gallery
+        self.requested_ids = list(student_ids) if student_ids is not None else None
+        self.key = key
+        self.student_ids = []
+        self.last_missing = []
+
+    def __len__(self):
+        if self.requested_ids is not None:
+            return len(self.requested_ids)
+        return self.gallery.student_count()
+
+    def _messages(self, message):
+        """Per-shard copies of message, each with only that shard's roster"""
+        if self.requested_ids is None:
+            return [dict(message) for _ in self.gallery.clients]
+        rosters = partition(dict.fromkeys(self.requested_ids), len(self.gallery.clients))
+        return [dict(message, student_ids=list(roster), key=self.key) for roster in rosters]
+
+    def search(self, probe, top_k=None):
+        """Top-k students across every shard that answered, best first"""
+        message = {"op": "search", "probe": np.asarray(probe), "top_k": top_k}
+        responses, self.last_missing = self.gallery.scatter(self._messages(message))
+        matches = [match for response in responses.values() for match in response["matches"]]
+        if top_k is None:
+            return sorted(matches, key=lambda m: -m[1])
+        return heapq.nlargest(top_k, matches, key=lambda m: m[1])
+
+    def similarity_matrix(self, probes):
+        probes = np.atleast_2d(np.asarray(probes))
+        message = {"op": "similarity", "probes": probes}
+        responses, self.last_missing = self.gallery.scatter(self._messages(message))
+        self.student_ids = []
+        blocks = []
+        for shard in sorted(responses):
+            self.student_ids.extend(responses[shard]["student_ids"])
+            blocks.append(np.asarray(responses[shard]["similarities"]).reshape(len(probes), -1))
+        return np.hstack(blocks) if blocks else np.zeros((len(probes), 0))
+
+
+class ShardedGallery:
+    """Coordinator with the FaceGallery interface over N shard servers
+
+    Shards own their students: each loads its partition of face_db itself
+    (ShardServer.load_pickle, or load() from this coordinator), and
+    invalidate() only forwards the entries of newly registered students to
+    the shard they hash to. A shard that misses them gets them again every
+    RETRY_INTERVAL until it acknowledges them.
+    """
+
+    def __init__(self, addresses=GALLERY_SHARDS, timeout=SHARD_TIMEOUT, authkey=SHARD_AUTHKEY):
+        if not addresses:
+            raise ValueError("No shard addresses given")
+        if not authkey:
+            raise ValueError("Set GALLERY_SHARD_AUTHKEY to the secret the shards were started with")
+        self.clients = [ShardClient(i, parse_address(a) if isinstance(a, str) else a, authkey)
+                        for i, a in enumerate(addresses)]
+        self.timeout = timeout
+        self.pool = ThreadPoolExecutor(max_workers=len(self.clients) * 4, thread_name_prefix="shard")
+        self.lock = threading.Lock()
+        self.partial_responses = 0
+        self.sync_timer = None
+
+    @property
+    def generation(self):
+        # Changes whenever any shard's gallery changed, for the match cache key
+        return tuple(client.generation for client in self.clients)
+
+    def scatter(self, messages, timeout=None):
+        """Send messages[i] to shard i in parallel
+
+        Returns:
+            ({shard: response} for the shards that answered in time, [missing shards])
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.time() + timeout
+        futures = {}
+        missing = []
+        for client, message in zip(self.clients, messages):
+            if client.is_down():
+                missing.append(client.shard)
+            else:
+                futures[client.shard] = self.pool.submit(client.request, message, timeout)
+
+        responses = {}
+        for shard, future in futures.items():
+            try:
+                responses[shard] = future.result(timeout=max(deadline - time.time(), 0) + 0.05)
+            except Exception as e:
+                logger.warning(f"Shard {shard} left out: {type(e).__name__}: {e}")
+                missing.append(shard)
+
+        if missing:
+            with self.lock:
+                self.partial_responses += 1
+        return responses, sorted(missing)
+
+    def broadcast(self, message):
+        return self.scatter([dict(message) for _ in self.clients])
+
+    def student_count(self):
+        if any(client.students is None for client in self.clients):
+            self.broadcast({"op": "stats"})
+        return sum(client.students or 0 for client in self.clients)
+
+    def load(self, face_db):
+        """Push each shard its partition (bootstrap for local tests)"""
+        parts = partition(
+            {sid: gallery_entry(d) for sid, d in face_db.items() if isinstance(d, dict)}, len(self.clients)
+        )
+        return self.scatter([{"op": "load", "face_db": part} for part in parts], timeout=LOAD_TIMEOUT)
+
+    def invalidate(self, face_db=None, student_ids=None):
+        """Forward changed students to their shards (nothing to rebuild locally)"""
+        if face_db is None or not student_ids:
+            return
+        with self.lock:
+            for student_id in student_ids:
+                if isinstance(face_db.get(student_id), dict):
+                    client = self.clients[shard_for(student_id, len(self.clients))]
+                    client.unsynced[student_id] = gallery_entry(face_db[student_id])
+        self.sync()
+
+    def sync(self):
+        """Send every shard the entries it has not acknowledged; retried while shards miss them"""
+        with self.lock:
+            self.sync_timer = None
+            parts = [dict(client.unsynced) for client in self.clients]
+        if not any(parts):
+            return
+        responses, missing = self.scatter(
+            [{"op": "upsert", "entries": part} if part else {"op": "stats"} for part in parts], timeout=LOAD_TIMEOUT
+        )
+
+        with self.lock:
+            for shard in responses:
+                unsynced = self.clients[shard].unsynced
+                for student_id, entry in parts[shard].items():
+                    # Unless re-registered meanwhile (a newer entry is waiting)
+                    if unsynced.get(student_id) is entry:
+                        del unsynced[student_id]
+            missed = {shard: len(parts[shard]) for shard in missing if parts[shard]}
+            if missed and self.sync_timer is None:
+                self.sync_timer = threading.Timer(RETRY_INTERVAL, self.sync)
+                self.sync_timer.daemon = True
+                self.sync_timer.start()
+        if missed:
+            logger.error(f"Shards missed registrations {missed}; sending them again in {RETRY_INTERVAL:.0f}s")
+
+    def view(self, student_ids=None, key=None):
+        return ShardedView(self, student_ids, key)
+
+    def after_fork(self):
+        """Drop the parent's shard connections and fan-out threads in a forked child"""
+        self.pool = ThreadPoolExecutor(max_workers=len(self.clients) * 4, thread_name_prefix="shard")
+        self.lock = threading.Lock()
+        # The parent keeps sending the registrations it has not synced yet
+        self.sync_timer = None
+        for client in self.clients:
+            # Sockets shared with the parent would interleave both processes' replies
+            client.idle = []
+            client.lock = threading.Lock()
+            client.unsynced = {}
+
+    def stats(self):
+        return {
+            "shards": [
+                {"shard": c.shard, "address": f"{c.address[0]}:{c.address[1]}", "students": c.students,
+                 "down": c.is_down(), "unsynced": len(c.unsynced)}
+                for c in self.clients
+            ],
+            "partial_responses": self.partial_responses
+        }
+
+
+def run_shard(shard, num_shards, port, face_db=None, storage="float64", delay=0.0, ready=None,
+              host="localhost", authkey=SHARD_AUTHKEY):
+    """Entry point of a shard process"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    server = ShardServer(shard, num_shards, (host, port), storage=storage, delay=delay, authkey=authkey)
+    if face_db is not None:
+        server.load_pickle(face_db)
+    server.serve_forever(ready)
+
+
+def local_test(args):
+    """Start N local shard processes and compare scatter-gather with a single gallery"""
+    import multiprocessing
+    from benchmark_gallery import make_synthetic_gallery, make_synthetic_probes
+
+    face_db, identities = make_synthetic_gallery(args.students, args.templates, seed=args.seed)
+    probes = make_synthetic_probes(face_db, identities, args.probes, seed=args.seed + 1)
+    reference = FaceGallery()
+    reference.invalidate(face_db)
+    # The local shards only talk to this process
+    authkey = SHARD_AUTHKEY or secrets.token_bytes(32)
+
+    processes = []
+    for shard in range(args.shards):
+        ready = multiprocessing.Event()
+        delay = args.delay if shard == args.slow_shard else 0.0
+        process = multiprocessing.Process(
+            target=run_shard, args=(shard, args.shards, args.port + shard),
+            kwargs={"delay": delay, "ready": ready, "authkey": authkey}, daemon=True
+        )
+        process.start()
+        ready.wait(10)
+        processes.append(process)
+
+    try:
+        gallery = ShardedGallery([f"localhost:{args.port + shard}" for shard in range(args.shards)],
+                                 timeout=args.timeout, authkey=authkey)
+        gallery.load(face_db)
+        if args.kill_shard is not None:
+            processes[args.kill_shard].terminate()
+            processes[args.kill_shard].join()
+
+        view = gallery.view()
+        times, agree, partial = [], 0, 0
+        for _, probe, _ in probes:
+            start = time.perf_counter()
+            matches = view.search(probe, top_k=args.top_k)
+            times.append(time.perf_counter() - start)
+            partial += bool(view.last_missing)
+            expected = reference.view().search(probe, top_k=1)
+            agree += bool(matches) and matches[0][0] == expected[0][0]
+
+        ms = np.asarray(times) * 1000
+        return {
+            "shards": args.shards,
+            "students": args.students,
+            "probes": len(probes),
+            "top1_agreement": agree / len(probes),
+            "partial_responses": partial,
+            "latency": {"mean_ms": float(ms.mean()), "p50_ms": float(np.percentile(ms, 50)),
+                        "p95_ms": float(np.percentile(ms, 95)), "max_ms": float(ms.max())},
+            "gallery": gallery.stats()
+        }
+    finally:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sharded face gallery: shard server and local scatter-gather test")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    serve = sub.add_parser("serve", help="Run one shard server")
+    serve.add_argument("--shard", type=int, required=True, help="Index of this shard")
+    serve.add_argument("--shards", type=int, required=True, help="Total number of shards")
+    serve.add_argument("--host", default="localhost",
+                       help="Interface to listen on (0.0.0.0 for coordinators on other hosts)")
+    serve.add_argument("--port", type=int, required=True, help="Port to listen on")
+    serve.add_argument("--face-db", default=FACE_DB_PATH, help="face_db.pickle to take this shard's students from")
+    serve.add_argument("--storage", default="float64", help="Gallery storage (float64, float16, int8)")
+
+    local = sub.add_parser("local", help="Start N local shards and compare against a single gallery")
+    local.add_argument("--shards", type=int, default=4, help="Number of local shard processes")
+    local.add_argument("--port", type=int, default=6100, help="Port of shard 0 (shard i uses port + i)")
+    local.add_argument("--students", type=int, default=20000, help="Synthetic students")
+    local.add_argument("--templates", type=int, default=5, help="Templates per synthetic student")
+    local.add_argument("--probes", type=int, default=200, help="Probe embeddings")
+    local.add_argument("--top-k", type=int, default=3, help="Matches merged per probe")
+    local.add_argument("--timeout", type=float, default=SHARD_TIMEOUT, help="Per-search shard timeout (seconds)")
+    local.add_argument("--slow-shard", type=int, default=None, help="Shard that answers after --delay seconds")
+    local.add_argument("--delay", type=float, default=1.0, help="Delay of the slow shard")
+    local.add_argument("--kill-shard", type=int, default=None, help="Shard to stop after loading")
+    local.add_argument("--seed", type=int, default=0, help="Seed for the synthetic gallery")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        if not SHARD_AUTHKEY:
+            raise SystemExit("GALLERY_SHARD_AUTHKEY must be set: the shard RPC unpickles whatever an authenticated peer sends")
+        run_shard(args.shard, args.shards, args.port, host=args.host,
+                  face_db=args.face_db if os.path.exists(args.face_db) else None, storage=args.storage)
+    else:
+        print(json.dumps(local_test(args), indent=2))
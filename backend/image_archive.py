@@ -0,0 +1,333 @@
+import os
+import re
+import cv2
+import time
+import shutil
+import sqlite3
+import hashlib
+import argparse
+import logging
+import threading
+import numpy as np
+from datetime import datetime
+from artifact_writer import artifact_writer
+
+logger = logging.getLogger('image_archive')
+
+# Define constants directly in the module (no config import)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ARCHIVE_DIR = os.path.join(BASE_DIR, "archive")
+THUMBNAIL_SIZE = 160                 # Longest side of dashboard thumbnails
+THUMBNAIL_QUALITY = 80
+IMAGE_RETENTION_DAYS = 30            # Full-size images are deleted after this many days
+RECORD_RETENTION_DAYS = 365          # Records and thumbnails are kept this long
+MAX_ARCHIVE_BYTES = 2 * 1024**3      # Full-size images beyond this budget are deleted oldest first
+DEBUG_RETENTION_DAYS = 3             # Loose files in debug/ are deleted after this many days
+ARCHIVE_CATEGORIES = ("processed", "failed", "rejected")
+
+# Reprocessed files pick up one timestamp prefix per pass (20250331222139_...)
+TIMESTAMP_PREFIX = re.compile(r"^(\d{14}_)+")
+
+
+def parse_upload_name(filename):
+    """Student ID and subject from an upload name like [timestamps_]ROLL_SUBJECT[_...].jpg
+
+    Group photos (GROUP_SUBJECT.jpg) have no student ID.
+    """
+    name_part = TIMESTAMP_PREFIX.sub("", os.path.splitext(os.path.basename(filename))[0])
+    parts = name_part.split("_")
+    if parts[0].upper() == "GROUP":
+        return None, parts[1].upper() if len(parts) > 1 else None
+    student_id = parts[0].upper() or None
+    subject = parts[1].upper() if len(parts) > 1 and not parts[1].isdigit() else None
+    return student_id, subject
+
+
+class ImageArchive:
+    """Content-addressed store for processed/failed/rejected uploads
+
+    Each distinct image is stored once under objects/<aa>/<bb>/<sha256><ext>,
+    however many times it is reprocessed, with a small JPEG thumbnail under
+    thumbs/<aa>/. A SQLite index maps student/subject/date/outcome to
+    records, so lookups never scan directories. Full-size images are removed
+    by age and size budget before the (much smaller) records and thumbnails.
+    """
+
+    def __init__(self, archive_dir=ARCHIVE_DIR):
+        self.archive_dir = archive_dir
+        self.objects_dir = os.path.join(archive_dir, "objects")
+        self.thumbs_dir = os.path.join(archive_dir, "thumbs")
+        self.index_path = os.path.join(archive_dir, "index.db")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.thumbs_dir, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.index_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self._create_schema()
+
+    def _create_schema(self):
+        with self.lock, self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS images (
+                    content_hash TEXT PRIMARY KEY,
+                    object_path TEXT,
+                    thumb_path TEXT,
+                    size INTEGER NOT NULL,
+                    stored_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS records (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    content_hash TEXT NOT NULL REFERENCES images(content_hash),
+                    student_id TEXT,
+                    subject TEXT,
+                    date TEXT NOT NULL,
+                    archived_at REAL NOT NULL,
+                    outcome TEXT NOT NULL,
+                    reason TEXT,
+                    original_name TEXT
+                );
+                CREATE INDEX IF NOT EXISTS records_student ON records (student_id, date);
+                CREATE INDEX IF NOT EXISTS records_subject ON records (subject, date);
+                CREATE INDEX IF NOT EXISTS records_date ON records (date, outcome);
+                CREATE INDEX IF NOT EXISTS records_hash ON records (content_hash);
+                CREATE INDEX IF NOT EXISTS images_stored ON images (stored_at);
+            """)
+
+    def _object_path(self, content_hash, extension):
+        return os.path.join(self.objects_dir, content_hash[:2], content_hash[2:4], content_hash + extension)
+
+    def _thumb_path(self, content_hash):
+        return os.path.join(self.thumbs_dir, content_hash[:2], content_hash + ".jpg")
+
+    def _write_thumbnail(self, data, thumb_path):
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_REDUCED_COLOR_2)
+        if image is None:
+            return None
+        scale = min(1.0, THUMBNAIL_SIZE / max(image.shape[:2]))
+        if scale < 1.0:
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        ok, buffer = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_QUALITY])
+        if not ok:
+            return None
+        os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+        with open(thumb_path, "wb") as f:
+            f.write(buffer.tobytes())
+        return thumb_path
+
+    def archive(self, image_path, outcome, student_id=None, subject=None, reason=None):
+        """Store an upload (moving it out of its folder) and index the outcome
+
+        Student ID and subject default to the ones in the file name.
+
+        Returns:
+            the new record as a dict
+        """
+        with open(image_path, "rb") as f:
+            data = f.read()
+        content_hash = hashlib.sha256(data).hexdigest()
+
+        parsed_student, parsed_subject = parse_upload_name(image_path)
+        student_id = student_id or parsed_student
+        subject = subject or parsed_subject
+        now = time.time()
+
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT object_path FROM images WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+            stored = row is not None and row["object_path"] and os.path.exists(row["object_path"])
+
+        if stored:
+            # Same bytes already archived: only the record is new
+            os.remove(image_path)
+            object_path = row["object_path"]
+        else:
+            object_path = self._object_path(content_hash, os.path.splitext(image_path)[1].lower() or ".jpg")
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            shutil.move(image_path, object_path)
+        thumb_path = self._thumb_path(content_hash)
+        if not os.path.exists(thumb_path):
+            thumb_path = self._write_thumbnail(data, thumb_path)
+
+        record = {
+            "content_hash": content_hash,
+            "student_id": student_id,
+            "subject": subject,
+            "date": datetime.fromtimestamp(now).strftime("%Y-%m-%d"),
+            "archived_at": now,
+            "outcome": outcome,
+            "reason": reason,
+            "original_name": TIMESTAMP_PREFIX.sub("", os.path.basename(image_path))
+        }
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO images (content_hash, object_path, thumb_path, size, stored_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(content_hash) DO UPDATE SET object_path = excluded.object_path, "
+                "thumb_path = COALESCE(excluded.thumb_path, images.thumb_path), stored_at = excluded.stored_at",
+                (content_hash, object_path, thumb_path, len(data), now)
+            )
+            cursor = self.conn.execute(
+                "INSERT INTO records (content_hash, student_id, subject, date, archived_at, outcome, reason, original_name) "
+                "VALUES (:content_hash, :student_id, :subject, :date, :archived_at, :outcome, :reason, :original_name)",
+                record
+            )
+            record["id"] = cursor.lastrowid
+
+        logger.info(f"Archived {record['original_name']} as {content_hash[:12]} ({outcome})")
+        return record
+
+    def archive_async(self, image_path, outcome, student_id=None, subject=None, reason=None):
+        """Archive on the artifact writer thread (the upload stays pending until then)"""
+        return artifact_writer.submit(
+            "archive", self.archive, image_path, outcome, student_id, subject, reason,
+            pending_path=os.path.abspath(image_path)
+        )
+
+    def lookup(self, student_id=None, subject=None, date=None, outcome=None, limit=100):
+        """Most recent records matching every given filter"""
+        clauses, params = [], []
+        for column, value in (("student_id", student_id), ("subject", subject), ("date", date), ("outcome", outcome)):
+            if value is not None:
+                clauses.append(f"r.{column} = ?")
+                params.append(value.upper() if column in ("student_id", "subject") else value)
+
+        query = ("SELECT r.*, i.object_path IS NOT NULL AS has_image, i.thumb_path IS NOT NULL AS has_thumbnail "
+                 "FROM records r JOIN images i ON i.content_hash = r.content_hash")
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY r.archived_at DESC LIMIT ?"
+        params.append(int(limit))
+
+        with self.lock:
+            return [dict(row) for row in self.conn.execute(query, params)]
+
+    def thumbnail_path(self, content_hash):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT thumb_path FROM images WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+        return row["thumb_path"] if row and row["thumb_path"] and os.path.exists(row["thumb_path"]) else None
+
+    def image_path(self, content_hash):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT object_path FROM images WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+        return row["object_path"] if row and row["object_path"] and os.path.exists(row["object_path"]) else None
+
+    def _delete_file(self, path):
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def enforce_retention(self, image_days=IMAGE_RETENTION_DAYS, record_days=RECORD_RETENTION_DAYS,
+                          max_bytes=MAX_ARCHIVE_BYTES, debug_dir=None, debug_days=DEBUG_RETENTION_DAYS):
+        """Apply the age and size policies
+
+        Returns:
+            dict with the number of images, records and debug files removed
+        """
+        now = time.time()
+        removed = {"images": 0, "bytes": 0, "records": 0, "thumbnails": 0, "debug_files": 0}
+
+        with self.lock, self.conn:
+            # Full-size images: by age, then oldest first until under budget
+            expired = self.conn.execute(
+                "SELECT content_hash, object_path, size FROM images WHERE object_path IS NOT NULL AND stored_at < ?",
+                (now - image_days * 86400,)
+            ).fetchall()
+            total = self.conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM images WHERE object_path IS NOT NULL"
+            ).fetchone()[0] - sum(row["size"] for row in expired)
+            over_budget = []
+            if total > max_bytes:
+                for row in self.conn.execute(
+                    "SELECT content_hash, object_path, size FROM images WHERE object_path IS NOT NULL "
+                    "AND stored_at >= ? ORDER BY stored_at", (now - image_days * 86400,)
+                ):
+                    if total <= max_bytes:
+                        break
+                    over_budget.append(row)
+                    total -= row["size"]
+
+            for row in expired + over_budget:
+                self._delete_file(row["object_path"])
+                self.conn.execute("UPDATE images SET object_path = NULL WHERE content_hash = ?", (row["content_hash"],))
+                removed["images"] += 1
+                removed["bytes"] += row["size"]
+
+            # Records, then thumbnails that no record refers to any more
+            removed["records"] = self.conn.execute(
+                "DELETE FROM records WHERE archived_at < ?", (now - record_days * 86400,)
+            ).rowcount
+            orphans = self.conn.execute(
+                "SELECT content_hash, object_path, thumb_path FROM images "
+                "WHERE content_hash NOT IN (SELECT content_hash FROM records)"
+            ).fetchall()
+            for row in orphans:
+                for path in (row["object_path"], row["thumb_path"]):
+                    if path and self._delete_file(path) and path == row["thumb_path"]:
+                        removed["thumbnails"] += 1
+                self.conn.execute("DELETE FROM images WHERE content_hash = ?", (row["content_hash"],))
+
+        # Debug crops are not archived at all, only aged out
+        if debug_dir and os.path.isdir(debug_dir):
+            cutoff = now - debug_days * 86400
+            for entry in os.scandir(debug_dir):
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    removed["debug_files"] += self._delete_file(entry.path)
+
+        logger.info(f"Archive retention: {removed}")
+        return removed
+
+    def import_directory(self, directory, outcome):
+        """Archive every image in a legacy folder (processed/, failed/, rejected/)"""
+        count = 0
+        for entry in sorted(os.scandir(directory), key=lambda e: e.name):
+            if entry.is_file() and entry.name.lower().endswith(('.jpg', '.jpeg', '.png')):
+                self.archive(entry.path, outcome)
+                count += 1
+        return count
+
+    def after_fork(self):
+        # SQLite connections must not be used across fork
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.index_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+
+    def stats(self):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT COUNT(*) AS images, COALESCE(SUM(CASE WHEN object_path IS NOT NULL THEN size END), 0) AS bytes "
+                "FROM images"
+            ).fetchone()
+            records = self.conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+        return {"images": row["images"], "bytes": row["bytes"], "records": records}
+
+
+# Create singleton instance
+image_archive = ImageArchive()
+
+# Forked workers (prefork_server.py) must not share the index connection with the master
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=image_archive.after_fork)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Image archive maintenance")
+    parser.add_argument("--import-legacy", action="store_true",
+                        help="Archive the contents of processed/, failed/ and rejected/")
+    parser.add_argument("--retention", action="store_true", help="Apply the retention policies")
+    args = parser.parse_args()
+
+    if args.import_legacy:
+        for category in ARCHIVE_CATEGORIES:
+            directory = os.path.join(BASE_DIR, category)
+            if os.path.isdir(directory):
+                print(f"{category}: archived {image_archive.import_directory(directory, category)} images")
+    if args.retention:
+        print(image_archive.enforce_retention(debug_dir=os.path.join(BASE_DIR, "debug")))
+    print(image_archive.stats())
@@ -0,0 +1,189 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from metrics import metrics
+
+logger = logging.getLogger('job_scheduler')
+
+# Define constants directly in the module (no config import)
+# Highest priority first: a student at the kiosk, the upload folder, bulk
+# registrations, then a teacher's backlog run through /process_now
+PRIORITY_CLASSES = ("interactive", "ingestion", "enrolment", "reprocessing")
+SCHEDULER_WORKERS = 4          # Recognition jobs run in parallel
+RESERVED_INTERACTIVE = 1       # Workers only interactive jobs may use, so a kiosk never waits behind a backlog
+
+
+class DeadlineExpired(Exception):
+    """The job's deadline (e.g. the end of its QR window) passed before a worker got to it"""
+
+
+class Job:
+    __slots__ = ("fn", "args", "kwargs", "priority", "subject", "deadline", "submitted_at", "future")
+
+    def __init__(self, fn, args, kwargs, priority, subject, deadline):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.subject = subject
+        self.deadline = deadline
+        self.submitted_at = time.time()
+        self.future = Future()
+
+
+class JobScheduler:
+    """Priority classes with per-subject fair queuing in front of the recognition workers
+
+    Workers always take the highest non-empty class. Within a class every
+    subject has its own FIFO and subjects are served round-robin, so one
+    subject's 300 uploads do not delay another subject's first one. Jobs with
+    a deadline that has passed by the time a worker reaches them are dropped
+    with DeadlineExpired instead of being run. RESERVED_INTERACTIVE workers
+    never pick up non-interactive work.
+    """
+
+    def __init__(self, workers=SCHEDULER_WORKERS, reserved=RESERVED_INTERACTIVE):
+        self.workers = workers
+        self.reserved = min(reserved, workers - 1)
+        self._start()
+
+    def _start(self):
+        self.condition = threading.Condition()
+        self.queues = {priority: OrderedDict() for priority in PRIORITY_CLASSES}   # subject -> deque of jobs
+        self.queued = dict.fromkeys(PRIORITY_CLASSES, 0)
+        self.running = dict.fromkeys(PRIORITY_CLASSES, 0)
+        self.counts = {"completed": 0, "failed": 0, "expired": 0}
+        self.stopped = False
+        self.threads = [
+            threading.Thread(target=self._work, name=f"scheduler-worker-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, fn, *args, priority="ingestion", subject=None, deadline=None, **kwargs):
+        """Queue fn(*args, **kwargs)
+
+        Args:
+            priority: One of PRIORITY_CLASSES
+            subject: Fair-queuing key within the class (None shares one queue)
+            deadline: Epoch seconds after which the job is dropped unrun
+
+        Returns:
+            concurrent.futures.Future with the result
+        """
+        if priority not in self.queues:
+            raise ValueError(f"Unknown priority class: {priority}")
+        job = Job(fn, args, kwargs, priority, subject.upper() if subject else None, deadline)
+        with self.condition:
+            if self.stopped:
+                raise RuntimeError("Scheduler has been shut down")
+            queues = self.queues[priority]
+            if job.subject not in queues:
+                queues[job.subject] = deque()
+            queues[job.subject].append(job)
+            self.queued[priority] += 1
+            self.condition.notify()
+        return job.future
+
+    def run(self, fn, *args, priority="interactive", subject=None, deadline=None, **kwargs):
+        """Submit and wait for the result (raises DeadlineExpired if dropped)"""
+        return self.submit(fn, *args, priority=priority, subject=subject, deadline=deadline, **kwargs).result()
+
+    def _pop(self):
+        """Next job by class, then round-robin over subjects; caller holds the condition"""
+        busy_background = sum(n for priority, n in self.running.items() if priority != "interactive")
+        for priority in PRIORITY_CLASSES:
+            if priority != "interactive" and busy_background >= self.workers - self.reserved:
+                return None
+            queues = self.queues[priority]
+            if not queues:
+                continue
+            subject, queue = next(iter(queues.items()))
+            job = queue.popleft()
+            if queue:
+                queues.move_to_end(subject)
+            else:
+                del queues[subject]
+            self.queued[priority] -= 1
+            self.running[priority] += 1
+            return job
+        return None
+
+    def _work(self):
+        while True:
+            with self.condition:
+                job = self._pop()
+                while job is None:
+                    if self.stopped:
+                        return
+                    self.condition.wait()
+                    job = self._pop()
+
+            try:
+                self._execute(job)
+            finally:
+                with self.condition:
+                    self.running[job.priority] -= 1
+                    # A finished background job may unblock one that waited for a free worker
+                    self.condition.notify()
+
+    def _execute(self, job):
+        if not job.future.set_running_or_notify_cancel():
+            return
+
+        started = time.time()
+        metrics.observe(f"queue_wait_{job.priority}", started - job.submitted_at)
+        if job.deadline is not None and started > job.deadline:
+            self._count("expired")
+            metrics.count("jobs_dropped", priority=job.priority, reason="deadline")
+            logger.warning(f"Dropped {job.priority} job for {job.subject}: deadline passed "
+                           f"{started - job.deadline:.1f}s before a worker was free")
+            job.future.set_exception(DeadlineExpired(f"Deadline passed {started - job.deadline:.1f}s ago"))
+            return
+
+        try:
+            result = job.fn(*job.args, **job.kwargs)
+        except BaseException as e:
+            self._count("failed")
+            job.future.set_exception(e)
+        else:
+            self._count("completed")
+            job.future.set_result(result)
+
+    def _count(self, name):
+        with self.condition:
+            self.counts[name] += 1
+
+    def stats(self):
+        with self.condition:
+            return {
+                "queued": dict(self.queued),
+                "running": dict(self.running),
+                "subjects_waiting": {p: len(q) for p, q in self.queues.items()},
+                **self.counts
+            }
+
+    def shutdown(self, wait=True):
+        """Stop after the queued jobs have run"""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        if wait:
+            for thread in self.threads:
+                thread.join()
+
+    def after_fork(self):
+        # Worker threads do not survive fork; a forked child starts with an empty scheduler
+        self._start()
+
+
+# Create singleton instance
+job_scheduler = JobScheduler()
+
+# Forked workers (prefork_server.py) need their own worker threads
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=job_scheduler.after_fork)
@@ -2,11 +2,16 @@ import cv2
 import numpy as np
 import time
 import os
+from texture_analysis import texture_analyzer
+from artifact_writer import artifact_writer
 
 # Define constants directly in the module (no config import)
 BLINK_THRESHOLD = 0.3
 BLINK_CONSECUTIVE_FRAMES = 3
 LIVENESS_THRESHOLD = 0.7
+# Replay scores at or above this are reported as a suspected print/screen spoof; the
+# score is not calibrated against real captures, so it does not decide is_live
+REPLAY_THRESHOLD = 0.75
 
 class LivenessDetector:
     def __init__(self):
@@ -16,6 +21,10 @@ class LivenessDetector:
         self.BLINK_THRESHOLD = BLINK_THRESHOLD
         self.BLINK_CONSECUTIVE_FRAMES = BLINK_CONSECUTIVE_FRAMES
         self.LIVENESS_THRESHOLD = LIVENESS_THRESHOLD
+        self.REPLAY_THRESHOLD = REPLAY_THRESHOLD
+        
+        # Multi-scale texture features for print/screen replay detection
+        self.texture_analyzer = texture_analyzer
         
         # Load face detector
         self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
@@ -76,6 +85,10 @@ class LivenessDetector:
         
         return normalized_variance
     
+    def calculate_replay_scores(self, face_crops):
+        """Score a batch of face crops for print/screen replay (higher is more likely a spoof)"""
+        return self.texture_analyzer.score_batch(face_crops)
+    
     def detect_eye_blinks(self, frames, min_blinks=1, timeout=5):
         """
         Detect eye blinks in a sequence of frames
@@ -97,6 +110,7 @@ class LivenessDetector:
         
         # Store liveness score components
         texture_scores = []
+        texture_crops = []
         has_sufficient_eye_movements = False
         
         # For eye tracking
@@ -140,6 +154,7 @@ class LivenessDetector:
                 # Calculate texture variance for this face
                 texture_score = self.calculate_texture_variance(face_gray)
                 texture_scores.append(texture_score)
+                texture_crops.append(face_gray)
                 
                 # Draw face rectangle
                 x, y, w, h = face_rect
@@ -205,6 +220,10 @@ class LivenessDetector:
         
         # Calculate final liveness score
         avg_texture = np.mean(texture_scores) if texture_scores else 0
+        
+        # Score all collected face crops for replay in one batch
+        replay_scores = self.calculate_replay_scores(texture_crops)
+        replay_score = float(np.mean(replay_scores)) if len(replay_scores) else 0.0
         blink_score = min(1.0, blink_counter / min_blinks)
         movement_score = 1.0 if has_sufficient_eye_movements else 0.0
         
@@ -218,6 +237,8 @@ class LivenessDetector:
             "score": liveness_score,
             "blinks_detected": blink_counter,
             "texture_score": avg_texture,
+            "replay_score": replay_score,
+            "replay_suspected": replay_score >= self.REPLAY_THRESHOLD,
             "movement_score": movement_score,
             "frames_processed": frame_count
         }
@@ -247,6 +268,7 @@ class LivenessDetector:
             
             # Calculate texture variance for liveness detection
             texture_score = self.calculate_texture_variance(detections[0]["face_gray"])
+            replay_score = float(self.calculate_replay_scores([detections[0]["face_color"]])[0])
             
             # Check for eyes
             has_eyes = len(detections[0]["eyes"]) >= 2
@@ -254,13 +276,16 @@ class LivenessDetector:
             # For single image, primarily rely on texture
             is_live = texture_score > 0.5 and has_eyes
             
-            # Save debug image
+            # Save a sample of debug images off the request path
             debug_path = os.path.join(self.debug_dir, f"liveness_check_{time.time()}.jpg")
-            cv2.imwrite(debug_path, frame)
+            if not artifact_writer.write_image(debug_path, frame, kind="liveness_debug"):
+                debug_path = None
             
             return {
                 "is_live": is_live,
                 "score": texture_score,
+                "replay_score": replay_score,
+                "replay_suspected": replay_score >= self.REPLAY_THRESHOLD,
                 "has_eyes": has_eyes,
                 "debug_image": debug_path
             }
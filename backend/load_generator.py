@@ -0,0 +1,272 @@
+import os
+import cv2
+import json
+import time
+import base64
+import sqlite3
+import argparse
+import threading
+import urllib.request
+import urllib.error
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from image_archive import parse_upload_name
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_FOLDERS = [os.path.join(BASE_DIR, "processed"), os.path.join(BASE_DIR, "failed")]
+UPLOAD_DIR = os.path.join(BASE_DIR, "uploads")
+ARCHIVE_INDEX = os.path.join(BASE_DIR, "archive", "index.db")
+ARRIVAL_PATTERNS = ("burst", "poisson", "ramp")
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+SYNTHETIC_ID_BASE = 23100000   # First roll number given out with --unique-students
+
+def arrival_offsets(pattern, count, rate, duration, bursts=1, rng=None):
+    """Send times (seconds from start) for each upload
+
+    burst:   count uploads split over `bursts` instants spread across duration
+    poisson: exponential gaps at `rate` uploads/second
+    ramp:    rate rises linearly from 0 to 2*rate over duration (same mean)
+    """
+    rng = rng or np.random.default_rng(0)
+    if pattern == "burst":
+        starts = np.linspace(0, duration, bursts, endpoint=False) if bursts > 1 else np.zeros(1)
+        return np.sort(np.repeat(starts, int(np.ceil(count / len(starts))))[:count])
+    if pattern == "poisson":
+        return np.cumsum(rng.exponential(1.0 / rate, size=count))
+    if pattern == "ramp":
+        # Inverse of the cumulative arrivals rate*t^2/duration of a linear ramp
+        arrivals = np.sort(rng.uniform(0, rate * duration, size=count))
+        return np.sqrt(arrivals * duration / rate)
+    raise ValueError(f"Unknown arrival pattern: {pattern}")
+
+def load_recorded_uploads(folders, subject):
+    """Sample selfies as (roll number from the file name, subject, decoded image)"""
+    uploads = []
+    for folder in folders:
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            # Group photos and names without a roll number cannot be replayed as selfies
+            roll_number, _ = parse_upload_name(name)
+            if not roll_number:
+                continue
+            image = cv2.imread(os.path.join(folder, name))
+            if image is None:
+                continue
+            uploads.append((roll_number, subject, image))
+    return uploads
+
+def encode_upload(image, rng, perturb):
+    """JPEG bytes of a recorded selfie; perturbed copies defeat content-hash caches"""
+    if perturb:
+        image = image.copy()
+        y, x = rng.integers(image.shape[0]), rng.integers(image.shape[1])
+        image[y, x] = rng.integers(0, 256, size=image.shape[2] if image.ndim == 3 else None)
+    ok, buffer = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return buffer.tobytes()
+
+def read_rss_kb(pid):
+    """Resident set size of a process from /proc (Linux only)"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+class LoadGenerator:
+    def __init__(self, args):
+        self.args = args
+        self.rng = np.random.default_rng(args.seed)
+        self.lock = threading.Lock()
+        self.uploads = {}      # filename -> {sent_at, http_ms, status, completed_at, outcome}
+        self.samples = []      # periodic queue depth / RSS / throughput samples
+        self.stop_sampling = threading.Event()
+
+    def send(self, filename, payload):
+        request = urllib.request.Request(
+            self.args.url,
+            data=json.dumps({"image": payload, "filename": filename}).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+        sent_at = time.time()
+        try:
+            with urllib.request.urlopen(request, timeout=self.args.timeout) as response:
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except Exception as e:
+            status = type(e).__name__
+        with self.lock:
+            self.uploads[filename].update(sent_at=sent_at, http_ms=(time.time() - sent_at) * 1000, status=status)
+
+    def pending_uploads(self):
+        with self.lock:
+            return [name for name, u in self.uploads.items() if u.get("status") == 200 and "completed_at" not in u]
+
+    def check_completions(self):
+        """Mark uploads whose outcome has been recorded (archive index, or file left the upload folder)"""
+        pending = self.pending_uploads()
+        if not pending:
+            return
+        now = time.time()
+        outcomes = {}
+        if os.path.exists(self.args.archive_index):
+            try:
+                conn = sqlite3.connect(f"file:{self.args.archive_index}?mode=ro", uri=True, timeout=1)
+                placeholders = ",".join("?" * len(pending))
+                for name, outcome, archived_at in conn.execute(
+                    f"SELECT original_name, outcome, archived_at FROM records WHERE original_name IN ({placeholders})", pending
+                ):
+                    outcomes[name] = (outcome, archived_at)
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+        with self.lock:
+            for name in pending:
+                if name in outcomes:
+                    self.uploads[name].update(outcome=outcomes[name][0], completed_at=outcomes[name][1])
+                elif self.args.upload_dir and not os.path.exists(os.path.join(self.args.upload_dir, name)) \
+                        and now - self.uploads[name]["sent_at"] > 1.0:
+                    self.uploads[name].update(outcome="left upload folder", completed_at=now)
+
+    def queue_depth(self):
+        if not self.args.upload_dir or not os.path.isdir(self.args.upload_dir):
+            return None
+        return sum(1 for name in os.listdir(self.args.upload_dir) if name.lower().endswith(IMAGE_EXTENSIONS))
+
+    def sampler(self, start):
+        while not self.stop_sampling.wait(self.args.sample_interval):
+            self.check_completions()
+            with self.lock:
+                sent = sum(1 for u in self.uploads.values() if "status" in u)
+                completed = sum(1 for u in self.uploads.values() if "completed_at" in u)
+            self.samples.append({
+                "t": round(time.time() - start, 2),
+                "sent": sent,
+                "completed": completed,
+                "queue_depth": self.queue_depth(),
+                "rss_kb": {str(pid): read_rss_kb(pid) for pid in self.args.pids}
+            })
+
+    def run(self):
+        args = self.args
+        recorded = load_recorded_uploads(args.folders, args.subject)
+        if not recorded:
+            raise SystemExit("No recorded uploads found")
+
+        offsets = arrival_offsets(args.pattern, args.count, args.rate, args.duration, args.bursts, self.rng)
+        start = time.time()
+        sampler = threading.Thread(target=self.sampler, args=(start,), daemon=True)
+        sampler.start()
+
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for i, offset in enumerate(offsets):
+                roll_number, subject, image = recorded[i % len(recorded)]
+                if args.unique_students:
+                    roll_number = f"{SYNTHETIC_ID_BASE + i}"
+                filename = f"{roll_number}_{subject}_{i}.jpg"
+                payload = "data:image/jpeg;base64," + base64.b64encode(encode_upload(image, self.rng, args.perturb)).decode()
+                with self.lock:
+                    self.uploads[filename] = {"scheduled": float(offset)}
+
+                delay = start + offset - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(self.send, filename, payload)
+
+        # Give the pipeline time to drain before reporting
+        drain_deadline = time.time() + args.drain
+        while time.time() < drain_deadline and self.pending_uploads():
+            time.sleep(args.sample_interval)
+            self.check_completions()
+        self.stop_sampling.set()
+        sampler.join()
+        return self.report(time.time() - start)
+
+    def report(self, elapsed):
+        uploads = list(self.uploads.values())
+        http_ms = [u["http_ms"] for u in uploads if "http_ms" in u]
+        end_to_end = [(u["completed_at"] - u["sent_at"]) * 1000 for u in uploads if "completed_at" in u]
+        statuses, outcomes = {}, {}
+        for u in uploads:
+            statuses[str(u.get("status"))] = statuses.get(str(u.get("status")), 0) + 1
+            if "outcome" in u:
+                outcomes[u["outcome"]] = outcomes.get(u["outcome"], 0) + 1
+
+        def percentiles(values):
+            if not values:
+                return {"count": 0}
+            return {
+                "count": len(values),
+                "p50_ms": float(np.percentile(values, 50)),
+                "p95_ms": float(np.percentile(values, 95)),
+                "p99_ms": float(np.percentile(values, 99)),
+                "max_ms": float(np.max(values))
+            }
+
+        memory = {}
+        for pid in self.args.pids:
+            series = [(s["t"], s["rss_kb"][str(pid)]) for s in self.samples if s["rss_kb"].get(str(pid))]
+            if len(series) >= 2:
+                t, rss = np.array(series, dtype=float).T
+                memory[str(pid)] = {
+                    "start_mb": rss[0] / 1024,
+                    "end_mb": rss[-1] / 1024,
+                    "max_mb": rss.max() / 1024,
+                    "growth_mb_per_hour": float(np.polyfit(t, rss, 1)[0]) * 3600 / 1024 if t[-1] > t[0] else 0.0
+                }
+
+        depths = [s["queue_depth"] for s in self.samples if s["queue_depth"] is not None]
+        errors = sum(count for status, count in statuses.items() if status != "200")
+        return {
+            "config": {k: v for k, v in vars(self.args).items() if k != "folders"},
+            "elapsed_seconds": elapsed,
+            "uploads": len(uploads),
+            "offered_rate": len(uploads) / elapsed if elapsed else 0.0,
+            "error_rate": errors / len(uploads) if uploads else 0.0,
+            "http_status": statuses,
+            "http_latency": percentiles(http_ms),
+            "end_to_end_latency": percentiles(end_to_end),
+            "not_completed": sum(1 for u in uploads if u.get("status") == 200 and "completed_at" not in u),
+            "outcomes": outcomes,
+            "queue_depth": {"max": max(depths), "final": depths[-1]} if depths else None,
+            "memory": memory,
+            "timeline": self.samples
+        }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Upload load generator / soak test for the attendance servers")
+    parser.add_argument("--url", default="http://localhost:5000/upload", help="Upload endpoint (backend/app.py or idk/server.py)")
+    parser.add_argument("--pattern", choices=ARRIVAL_PATTERNS, default="poisson", help="Arrival pattern")
+    parser.add_argument("--count", type=int, default=500, help="Total uploads to send")
+    parser.add_argument("--rate", type=float, default=10.0, help="Mean uploads per second (poisson, ramp)")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds the ramp or the bursts are spread over")
+    parser.add_argument("--bursts", type=int, default=1, help="Number of bursts (burst pattern)")
+    parser.add_argument("--concurrency", type=int, default=32, help="Maximum in-flight uploads")
+    parser.add_argument("--timeout", type=float, default=30.0, help="HTTP timeout per upload")
+    parser.add_argument("--subject", default="LOAD", help="Subject put in the upload file names")
+    parser.add_argument("--folders", nargs="*", default=SAMPLE_FOLDERS, help="Recorded selfies to replay")
+    parser.add_argument("--unique-students", action="store_true", help="Give every upload its own synthetic roll number instead of the recorded one")
+    parser.add_argument("--perturb", action="store_true", help="Change one pixel per upload so content caches miss")
+    parser.add_argument("--upload-dir", default=UPLOAD_DIR, help="Folder the server writes uploads to (queue depth)")
+    parser.add_argument("--archive-index", default=ARCHIVE_INDEX, help="Archive index used to detect recorded outcomes")
+    parser.add_argument("--pids", type=int, nargs="*", default=[], help="Server/pipeline PIDs whose RSS is tracked")
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="Seconds between timeline samples")
+    parser.add_argument("--drain", type=float, default=120.0, help="Seconds to wait for the pipeline to finish")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for arrivals and perturbations")
+    parser.add_argument("--output", default=None, help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = LoadGenerator(args).run()
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
@@ -0,0 +1,292 @@
+import os
+import json
+import time
+import uuid
+import bisect
+import threading
+from contextlib import contextmanager
+
+# Define constants directly in the module (no config import)
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+METRICS_PREFIX = "attendance"
+# Set by prefork_server.py: each worker snapshots its metrics here and a
+# scrape of any worker reports the sum over all of them
+METRICS_DIR = os.environ.get("METRICS_DIR")
+METRICS_FLUSH_INTERVAL = 5.0   # Seconds between snapshots of a process's metrics to METRICS_DIR
+RETIRED_FILE = "retired.json"  # Summed metrics of workers that have exited
+
+# Latency buckets in seconds (upper bounds): 0.5 ms to ~30 s in steps of 1.5x,
+# so interpolated quantiles are never off by more than one bucket width
+LATENCY_BUCKETS = tuple(round(0.0005 * 1.5 ** i, 6) for i in range(28))
+
+
+class Histogram:
+    """Fixed-bucket latency histogram; quantiles are interpolated within a bucket"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)   # Last slot is +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q):
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count * 1000 if self.count else 0.0,
+            "p50_ms": self.quantile(0.50) * 1000,
+            "p95_ms": self.quantile(0.95) * 1000,
+            "p99_ms": self.quantile(0.99) * 1000
+        }
+
+
+def _merge(into, state):
+    """Add one process's exported state (see MetricsRegistry.export) to into"""
+    for stage, (counts, total, count) in state["histograms"].items():
+        if stage not in into["histograms"]:
+            into["histograms"][stage] = [list(counts), total, count]
+        else:
+            merged = into["histograms"][stage]
+            merged[0] = [a + b for a, b in zip(merged[0], counts)]
+            merged[1] += total
+            merged[2] += count
+    for name, labels, value in state["counters"]:
+        key = (name, tuple(tuple(label) for label in labels))
+        into["counters"][key] = into["counters"].get(key, 0) + value
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, data):
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+
+class MetricsRegistry:
+    """In-process stage timings and outcome counters
+
+    Recording is a perf_counter pair, a bisect and a counter increment under
+    a lock; all formatting happens only when /metrics is scraped. With
+    METRICS_ENABLED=0 every recording call returns immediately.
+
+    With a shared directory (METRICS_DIR, set by the prefork server) each
+    process writes its histograms and counters to <pid>.json every
+    METRICS_FLUSH_INTERVAL seconds, and prometheus() reports their sum, so
+    a scrape answered by any worker covers all of them. Gauges are read
+    live and describe only the process that answered.
+    """
+
+    def __init__(self, enabled=METRICS_ENABLED, prefix=METRICS_PREFIX, directory=METRICS_DIR):
+        self.enabled = enabled
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.histograms = {}   # stage -> Histogram
+        self.counters = {}     # (name, labels tuple) -> count
+        self.gauges = {}       # name -> callable returning the current value
+        self.started_at = time.time()
+        self.directory = None
+        if directory and enabled:
+            self.share(directory)
+
+    def share(self, directory):
+        """Start snapshotting this process's metrics into directory"""
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.process_id = uuid.uuid4().hex   # Pids are reused; this is not
+        threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            self.flush()
+
+    def flush(self):
+        if self.directory:
+            _write_json(os.path.join(self.directory, f"{os.getpid()}.json"), self.export())
+
+    def export(self):
+        with self.lock:
+            return {
+                "id": self.process_id if self.directory else None,
+                "histograms": {stage: [list(h.counts), h.total, h.count] for stage, h in self.histograms.items()},
+                "counters": [[name, [list(label) for label in labels], value]
+                             for (name, labels), value in self.counters.items()]
+            }
+
+    def retire(self, pid):
+        """Fold an exited worker's last snapshot into RETIRED_FILE (called by the prefork master)"""
+        if not self.directory:
+            return
+        path = os.path.join(self.directory, f"{pid}.json")
+        state = _read_json(path)
+        if state is not None:
+            retired_path = os.path.join(self.directory, RETIRED_FILE)
+            retired = _read_json(retired_path) or {"ids": [], "histograms": {}, "counters": []}
+            merged = {"histograms": retired["histograms"],
+                      "counters": {(n, tuple(tuple(l) for l in ls)): v for n, ls, v in retired["counters"]}}
+            _merge(merged, state)
+            _write_json(retired_path, {
+                "ids": retired["ids"] + [state["id"]],
+                "histograms": merged["histograms"],
+                "counters": [[n, [list(l) for l in ls], v] for (n, ls), v in merged["counters"].items()]
+            })
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _collect(self):
+        """(histograms, counters, processes) of this process, or summed over the shared directory"""
+        if not self.directory:
+            with self.lock:
+                histograms = {stage: (list(h.counts), h.total, h.count, h.buckets) for stage, h in self.histograms.items()}
+                counters = dict(self.counters)
+            return histograms, counters, 1
+
+        self.flush()
+        retired = _read_json(os.path.join(self.directory, RETIRED_FILE)) or {"ids": [], "histograms": {}, "counters": []}
+        merged = {"histograms": {}, "counters": {}}
+        _merge(merged, retired)
+        processes = 0
+        for entry in os.listdir(self.directory):
+            if entry == RETIRED_FILE or not entry.endswith(".json"):
+                continue
+            state = _read_json(os.path.join(self.directory, entry))
+            # Already counted in retired.json when the master folded it in
+            if state is None or state["id"] in retired["ids"]:
+                continue
+            _merge(merged, state)
+            processes += 1
+        histograms = {stage: (counts, total, count, LATENCY_BUCKETS)
+                      for stage, (counts, total, count) in merged["histograms"].items()}
+        return histograms, merged["counters"], processes
+
+    def after_fork(self):
+        """A forked worker starts from zero (the master's counts are its own) with its own flush thread"""
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.started_at = time.time()
+        if self.directory:
+            self.share(self.directory)
+
+    def observe(self, stage, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def stage(self, name):
+        """Time the enclosed block as one pipeline stage"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def count(self, name, amount=1, **labels):
+        """Increment a counter, e.g. count("outcomes", outcome="rejected", reason="Face too blurry")"""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def gauge(self, name, fn):
+        """Register a callable that is read at scrape time (queue depths, cache sizes)"""
+        self.gauges[name] = fn
+
+    def snapshot(self):
+        """JSON-friendly summary with p50/p95/p99 per stage"""
+        with self.lock:
+            return {
+                "stages": {stage: h.summary() for stage, h in sorted(self.histograms.items())},
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ]
+            }
+
+    def _labels(self, labels):
+        if not labels:
+            return ""
+        escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ") for _, v in labels)
+        return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+    def prometheus(self):
+        """Render every metric in the Prometheus text exposition format"""
+        p = self.prefix
+        lines = []
+        histograms, counters, processes = self._collect()
+
+        lines.append(f"# HELP {p}_stage_seconds Time spent in each pipeline stage")
+        lines.append(f"# TYPE {p}_stage_seconds histogram")
+        for stage, (counts, total, count, buckets) in sorted(histograms.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{p}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{p}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'{p}_stage_seconds_sum{{stage="{stage}"}} {total}')
+            lines.append(f'{p}_stage_seconds_count{{stage="{stage}"}} {count}')
+
+        names = sorted({name for name, _ in counters})
+        for name in names:
+            lines.append(f"# TYPE {p}_{name}_total counter")
+            for (counter_name, labels), value in sorted(counters.items()):
+                if counter_name == name:
+                    lines.append(f"{p}_{name}_total{self._labels(labels)} {value}")
+
+        for name, fn in sorted(self.gauges.items()):
+            try:
+                value = float(fn())
+            except Exception:
+                continue
+            lines.append(f"# TYPE {p}_{name} gauge")
+            lines.append(f"{p}_{name} {value}")
+
+        lines.append(f"# TYPE {p}_uptime_seconds gauge")
+        lines.append(f"{p}_uptime_seconds {time.time() - self.started_at}")
+        lines.append(f"# TYPE {p}_processes_reporting gauge")
+        lines.append(f"{p}_processes_reporting {processes}")
+        return "\n".join(lines) + "\n"
+
+
+# Create singleton instance
+metrics = MetricsRegistry()
+
+# Forked workers (prefork_server.py) count their own requests and need their own flush thread
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=metrics.after_fork)
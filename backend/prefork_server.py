@@ -0,0 +1,302 @@
+import os
+import gc
+import sys
+import time
+import random
+import shutil
+import signal
+import socket
+import tempfile
+import logging
+import argparse
+import importlib
+import threading
+import numpy as np
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('prefork_server')
+
+# Define constants directly in the module (no config import)
+PREFORK_WORKERS = 4            # HTTP worker processes
+MAX_REQUESTS = 1000            # Requests a worker serves before it is replaced
+MAX_REQUESTS_JITTER = 100      # Random extra requests, so workers do not recycle together
+RESPAWN_DELAY = 1.0            # Seconds between respawns of a worker that keeps dying at startup
+WORKER_FLUSH_TIMEOUT = 10.0    # Seconds an exiting worker waits for queued artifact writes
+MEMORY_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+
+
+def load_object(spec):
+    """Resolve "module:attribute", e.g. "attendance_app:app\""""
+    module_name, _, attribute = spec.partition(":")
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+def memory_usage(pid):
+    """RSS/PSS breakdown in kB from /proc/<pid>/smaps_rollup (Linux only)
+
+    PSS divides every shared page among the processes mapping it, so the sum
+    of PSS over the master and its workers is their real combined footprint.
+    """
+    usage = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in MEMORY_FIELDS:
+                    usage[name] = int(value.split()[0])
+    except (OSError, ValueError):
+        return None
+    return usage
+
+
+def warm_master():
+    """Load everything workers share before forking
+
+    Models, the gallery matrix and the rosters are imported (and the dlib
+    encoder and gallery views built) once here, so workers map the same
+    pages copy-on-write. MTCNN inference is left to the workers: TensorFlow
+    creates its thread pools on the first run and they do not survive fork.
+    """
+    from face_detector import face_detector
+    from quality_gate import quality_gate
+
+    blank = np.zeros((160, 160, 3), dtype=np.uint8)
+    quality_gate.check_image(blank)
+    face_detector.extract_face_encoding(blank)
+    face_detector.gallery.view()
+    for subject in list(face_detector.roster.subjects):
+        face_detector.gallery_view(subject=subject)
+
+
+def warm_worker():
+    """Run the first MTCNN detection in the worker before it takes requests"""
+    from face_detector import face_detector
+    face_detector.detect_faces_detailed(np.zeros((160, 160, 3), dtype=np.uint8))
+
+
+class RequestLimit:
+    """WSGI middleware that stops its worker after max_requests requests"""
+
+    def __init__(self, app, max_requests, on_limit):
+        self.app = app
+        self.max_requests = max_requests
+        self.on_limit = on_limit
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        with self.lock:
+            self.requests += 1
+            reached = self.requests == self.max_requests
+        if reached:
+            # Finish this request; the server stops accepting and the master forks a fresh worker
+            threading.Thread(target=self.on_limit, daemon=True).start()
+        return self.app(environ, start_response)
+
+
+class PreforkServer:
+    """Master that loads the app once and forks HTTP workers from it
+
+    The master imports the app (and with it the face models, the gallery
+    and the rosters), warms them, collects garbage and calls gc.freeze() so
+    the collector never writes to the inherited objects. Workers forked
+    after that share those pages with the master copy-on-write instead of
+    loading their own copies. All workers accept from one listening socket.
+
+    A worker exits after max_requests (plus jitter) requests and is replaced
+    by a fresh fork of the warm master, which caps per-worker memory drift.
+    An optional processor child runs the upload folder loop.
+    """
+
+    def __init__(self, app_spec, host="0.0.0.0", port=3000, workers=PREFORK_WORKERS,
+                 max_requests=MAX_REQUESTS, jitter=MAX_REQUESTS_JITTER, processor=None, warm=True):
+        self.app_spec = app_spec
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.max_requests = max_requests
+        self.jitter = jitter
+        self.processor_spec = processor
+        self.warm = warm
+
+        self.children = {}     # pid -> ("worker", slot) or ("processor", None)
+        self.stopping = False
+        self.recycled = 0
+
+    def _listen(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(256)
+        # Every worker wakes on a new connection; the ones that lose the
+        # accept() race must get EAGAIN instead of blocking in accept()
+        sock.setblocking(False)
+        return sock
+
+    def _load(self):
+        self.app = load_object(self.app_spec)
+        self.processor = load_object(self.processor_spec) if self.processor_spec else None
+        if self.warm:
+            start = time.time()
+            warm_master()
+            logger.info(f"Warmed models and gallery in {time.time() - start:.1f}s")
+
+        # Everything allocated so far is shared with the workers; keep the
+        # collector from touching (and so copying) those pages
+        gc.collect()
+        gc.freeze()
+        logger.info(f"Froze {gc.get_freeze_count()} objects in the master")
+
+    def _fork(self, role, slot=None):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = (role, slot)
+            return pid
+
+        # Child: never return into the master's loop
+        code = 0
+        try:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)   # The master handles Ctrl-C
+            if role == "worker":
+                self._run_worker(slot)
+            else:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                self.processor()
+        except BaseException:
+            logger.exception(f"{role} {os.getpid()} failed")
+            code = 1
+        finally:
+            self._flush_child()
+            os._exit(code)
+
+    def _run_worker(self, slot):
+        from werkzeug.serving import make_server
+
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        if self.warm:
+            warm_worker()
+
+        limit = self.max_requests + random.randint(0, self.jitter) if self.max_requests else None
+        server = make_server(self.host, self.port, self.app, threaded=True, fd=self.sock.fileno())
+        # Track request threads so server_close() can wait for them; werkzeug
+        # makes them daemons, which os._exit would kill mid-response
+        server.daemon_threads = False
+        server.block_on_close = True
+        app = RequestLimit(self.app, limit, server.shutdown) if limit else self.app
+        server.app = app
+
+        # SIGTERM: stop accepting, finish in-flight requests, then exit
+        signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown, daemon=True).start())
+        logger.info(f"Worker {slot} (pid {os.getpid()}) serving, recycles after {limit or 'unlimited'} requests")
+        server.serve_forever()
+        # serve_forever() returns once accepting stops; finish the requests still running
+        server.server_close()
+        served = app.requests if limit else None
+        logger.info(f"Worker {slot} (pid {os.getpid()}) exiting after {served} requests")
+
+    def _flush_child(self):
+        """Write out a child's buffered artifacts and attendance rows before os._exit"""
+        for module, flush in (("artifact_writer", lambda m: m.artifact_writer.flush(WORKER_FLUSH_TIMEOUT)),
+                              ("audit_log", lambda m: m.close_audit_log()),
+                              ("metrics", lambda m: m.metrics.flush())):
+            if module in sys.modules:
+                try:
+                    flush(sys.modules[module])
+                except Exception as e:
+                    logger.error(f"Could not flush {module}: {e}")
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _recycle_all(self, signum, frame):
+        """SIGHUP: replace every worker (e.g. after a model or gallery update on disk)"""
+        for pid, (role, _) in list(self.children.items()):
+            if role == "worker":
+                os.kill(pid, signal.SIGTERM)
+
+    def _retire_metrics(self, pid):
+        """Keep an exited child's counters in the totals every worker's /metrics reports"""
+        if "metrics" in sys.modules:
+            try:
+                sys.modules["metrics"].metrics.retire(pid)
+            except Exception as e:
+                logger.error(f"Could not retire metrics of {pid}: {e}")
+
+    def serve(self):
+        self.sock = self._listen()
+        # Workers sum their metrics through this directory (metrics.py reads it on import)
+        metrics_dir = None
+        if "METRICS_DIR" not in os.environ:
+            metrics_dir = os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix="attendance-metrics-")
+        self._load()
+
+        for slot in range(self.workers):
+            self._fork("worker", slot)
+        if self.processor is not None:
+            self._fork("processor")
+
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGHUP, self._recycle_all)
+        logger.info(f"Master {os.getpid()} serving {self.app_spec} on {self.host}:{self.port} "
+                    f"with {self.workers} workers")
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            role, slot = self.children.pop(pid, (None, None))
+            self._retire_metrics(pid)
+            if role is None or self.stopping:
+                continue
+
+            code = os.waitstatus_to_exitcode(status)
+            if code == 0:
+                self.recycled += 1
+            else:
+                logger.warning(f"{role} {pid} exited with {code}, respawning")
+                time.sleep(RESPAWN_DELAY)
+            self._fork(role, slot)
+
+        self.sock.close()
+        if metrics_dir:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+        logger.info("Master stopped")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Preforking recognition server (Linux/macOS)")
+    parser.add_argument("--app", default="attendance_app:app", help="WSGI app as module:attribute")
+    parser.add_argument("--host", default="0.0.0.0", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=3000, help="Port to listen on")
+    parser.add_argument("--workers", type=int, default=PREFORK_WORKERS, help="HTTP worker processes")
+    parser.add_argument("--max-requests", type=int, default=MAX_REQUESTS,
+                        help="Requests before a worker is recycled (0 disables recycling)")
+    parser.add_argument("--max-requests-jitter", type=int, default=MAX_REQUESTS_JITTER,
+                        help="Random extra requests per worker")
+    parser.add_argument("--processor", default="attendance_app:background_processor",
+                        help="Upload folder loop run in its own child (\"none\" to disable)")
+    parser.add_argument("--no-warm", action="store_true", help="Skip model and gallery warm-up (apps without the face pipeline)")
+    args = parser.parse_args()
+
+    if not hasattr(os, "fork"):
+        raise SystemExit("The prefork server needs os.fork (Linux or macOS)")
+
+    # Before any worker opens the attendance log
+    from audit_log import migrate_log
+    migrate_log()
+
+    PreforkServer(
+        args.app, host=args.host, port=args.port, workers=args.workers,
+        max_requests=args.max_requests, jitter=args.max_requests_jitter,
+        processor=None if args.processor == "none" else args.processor, warm=not args.no_warm
+    ).serve()
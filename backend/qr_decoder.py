@@ -0,0 +1,223 @@
+import os
+import cv2
+import json
+import base64
+import logging
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger('qr_decoder')
+
+# Define constants directly in the module (no config import)
+QR_MAX_SIDE = 800           # Frames are downscaled so their longest side is at most this
+QR_DECODE_WORKERS = 4       # Threads used for batch decoding (OpenCV releases the GIL)
+
+
+def decode_image_bytes(data):
+    """Decode raw or base64 (data URL) image bytes into a BGR array, once"""
+    if isinstance(data, str):
+        if data.startswith('data:image'):
+            data = data.split(',', 1)[1]
+        data = base64.b64decode(data)
+
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+
+
+def parse_qr_payload(text):
+    """Extract the signed token from a teacher QR payload (JSON or bare token)"""
+    try:
+        payload = json.loads(text)
+    except ValueError:
+        return {"token": text, "subject": None}
+
+    if isinstance(payload, dict):
+        return {"token": payload.get("authKey") or payload.get("token"), "subject": payload.get("subject")}
+    return {"token": text, "subject": None}
+
+
+class QRDecoder:
+    def __init__(self, max_side=QR_MAX_SIDE, workers=QR_DECODE_WORKERS):
+        print("Initializing QR decoder...")
+        self.max_side = max_side
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="qr-decode")
+
+        # cv2.QRCodeDetector is not thread-safe, so each thread gets its own
+        self._local = threading.local()
+
+    def _detector(self):
+        detector = getattr(self._local, "detector", None)
+        if detector is None:
+            detector = cv2.QRCodeDetector()
+            self._local.detector = detector
+        return detector
+
+    def decode(self, image):
+        """Find and decode a QR code in a BGR frame
+
+        Detection runs on a downscaled grayscale copy first and only falls back
+        to full resolution when that fails. The input frame is never modified,
+        so the same buffer can go on to the face pipeline.
+        """
+        if image is None:
+            return {"found": False, "message": "Could not read image"}
+
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        scale = min(1.0, self.max_side / max(gray.shape[:2]))
+
+        detector = self._detector()
+        attempts = [scale, 1.0] if scale < 1.0 else [1.0]
+
+        for attempt_scale in attempts:
+            if attempt_scale < 1.0:
+                small = cv2.resize(gray, None, fx=attempt_scale, fy=attempt_scale, interpolation=cv2.INTER_AREA)
+            else:
+                small = gray
+
+            text, points, _ = detector.detectAndDecode(small)
+            if text:
+                corners = (points.reshape(-1, 2) / attempt_scale).tolist() if points is not None else None
+                return {"found": True, "data": text, "points": corners, "scale": attempt_scale}
+
+        return {"found": False, "message": "No QR code found"}
+
+    def after_fork(self):
+        # Executor threads started in the parent do not exist in a forked child
+        self.executor = ThreadPoolExecutor(max_workers=self.executor._max_workers, thread_name_prefix="qr-decode")
+        self._local = threading.local()
+
+    def decode_batch(self, images):
+        """Decode QR codes in many frames concurrently, results in input order"""
+        return list(self.executor.map(self.decode, images))
+
+
+# Create singleton instance
+qr_decoder = QRDecoder()
+
+# Forked workers (prefork_server.py) must not share decoder threads with the master
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=qr_decoder.after_fork)
+
+
+def process_kiosk_frame(image_data, roll_number, subject=None, qr_result=None):
+    """Verify one kiosk upload: QR proof and face from the same decoded frame
+
+    Args:
+        image_data: Raw/base64 image bytes, or an already decoded BGR array
+        roll_number: Roll number the student entered at the kiosk
+        subject: Optional subject the kiosk is bound to
+        qr_result: QR decode result for this frame, if it was already decoded in a batch
+
+    Returns:
+        dict with the verification outcome
+    """
+    # Imported here so the QR decoder can be used without loading the face models
+    from qr_tokens import qr_token_service
+    from job_scheduler import job_scheduler, DeadlineExpired
+
+    image = image_data if isinstance(image_data, np.ndarray) else decode_image_bytes(image_data)
+    if image is None:
+        return {"success": False, "message": "Could not read image"}
+
+    # Step 1: QR proof
+    if qr_result is None:
+        qr_result = qr_decoder.decode(image)
+    if not qr_result["found"]:
+        return {"success": False, "message": qr_result["message"]}
+
+    payload = parse_qr_payload(qr_result["data"])
+    verification = qr_token_service.verify_and_consume(payload["token"] or "", roll_number, subject=subject)
+    if not verification["valid"]:
+        logger.warning(f"Kiosk frame for {roll_number} rejected: {verification['message']}")
+        return {"success": False, "message": verification["message"]}
+
+    # Steps 2 and 3 wait for a recognition worker ahead of any bulk work, and
+    # are dropped if the QR window closes before one is free
+    try:
+        return job_scheduler.run(
+            _verify_kiosk_face, image, roll_number, verification,
+            priority="interactive", subject=verification["subject"],
+            deadline=qr_token_service.expires_at(verification["window"])
+        )
+    except DeadlineExpired:
+        logger.warning(f"Kiosk frame for {roll_number} dropped: QR window expired while queued")
+        return {"success": False, "message": "QR code expired before verification, please scan again",
+                "subject": verification["subject"]}
+
+
+def _verify_kiosk_face(image, roll_number, verification):
+    """Face check and attendance for a kiosk frame whose QR proof was verified"""
+    from face_detector import face_detector
+    from database import attendance_db
+
+    # Step 2: face, reusing the frame that was already decoded for the QR code
+    recognition = face_detector.recognize_face_image(
+        image, claimed_id=roll_number, image_name=f"{roll_number}_{verification['subject']}_kiosk.jpg",
+        subject=verification["subject"]
+    )
+    if not recognition.get("success", False):
+        return {"success": False, "message": recognition["message"], "subject": verification["subject"]}
+
+    if not recognition["verified"]:
+        return {
+            "success": False,
+            "message": "Face does not match roll number",
+            "subject": verification["subject"],
+            "best_confidence": recognition["best_confidence"]
+        }
+
+    # Step 3: record attendance tied to the token that proved presence
+    attendance_db.mark_attendance(
+        roll_number,
+        status="Present",
+        method="QR Kiosk",
+        subject=verification["subject"],
+        qr_token=f"{verification['window']}:{verification['nonce']}",
+        confidence=recognition["best_confidence"]
+    )
+    logger.info(f"Kiosk attendance marked for {roll_number} in {verification['subject']}")
+
+    return {
+        "success": True,
+        "student_id": roll_number,
+        "subject": verification["subject"],
+        "confidence": recognition["best_confidence"]
+    }
+
+
+def _decode_kiosk_frame(frame):
+    """Decoded image of one batch frame, or None if its image is missing or malformed"""
+    try:
+        return decode_image_bytes(frame["image"])
+    except Exception as e:
+        logger.warning(f"Could not decode kiosk frame: {type(e).__name__}: {e}")
+        return None
+
+
+def process_kiosk_batch(frames, subject=None):
+    """Process many kiosk uploads: decode and QR-scan in parallel, then recognize
+
+    A malformed frame only fails its own entry of the results.
+
+    Args:
+        frames: List of dicts with "image" (raw/base64 bytes) and "roll_number"
+    """
+    frames = [frame if isinstance(frame, dict) else {} for frame in frames]
+    images = list(qr_decoder.executor.map(_decode_kiosk_frame, frames))
+    qr_results = qr_decoder.decode_batch(images)
+
+    # Each frame's recognition is queued as interactive work on the job scheduler
+    results = []
+    for image, frame, qr_result in zip(images, frames, qr_results):
+        if image is None:
+            results.append({"success": False, "message": "Could not read image"})
+        elif not frame.get("roll_number"):
+            results.append({"success": False, "message": "Missing roll_number"})
+        else:
+            try:
+                results.append(process_kiosk_frame(image, frame["roll_number"], subject=subject, qr_result=qr_result))
+            except Exception as e:
+                logger.error(f"Kiosk frame for {frame['roll_number']} failed: {e}", exc_info=True)
+                results.append({"success": False, "message": f"Error processing frame: {e}"})
+    return results
@@ -0,0 +1,222 @@
+import os
+import re
+import hmac
+import json
+import time
+import base64
+import hashlib
+import secrets
+import logging
+from cooldown_store import CooldownStore, COOLDOWN_DB
+
+logger = logging.getLogger('qr_tokens')
+
+# Define constants directly in the module (no config import)
+QR_WINDOW_SECONDS = 2          # Teacher page rotates the QR code every window
+QR_GRACE_WINDOWS = 2           # Accept tokens up to this many windows old (scan delay)
+UPLOAD_GRANT_SECONDS = 300     # A scan's upload grant lasts as long as the selfie page session
+SIGNATURE_BYTES = 16           # Truncated HMAC-SHA256 length
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def verified_upload_name(filename, subject):
+    """Name an upload <roll>_<subject>_<rest> after its QR token verified subject
+
+    The monitor, the rosters and the per-subject queues read the subject
+    from the filename, so it must be the subject the token was issued for.
+    """
+    stem, ext = os.path.splitext(filename)
+    parts = stem.split("_")
+    subject_part = re.sub(r"[^A-Za-z0-9-]", "-", subject).upper()
+    rest = parts[1:]
+    if rest and rest[0].upper() == subject_part:
+        rest = rest[1:]
+    return "_".join([parts[0], subject_part] + rest) + ext
+
+
+class QRTokenService:
+    """Rotating QR tokens for the teacher page and the upload grants they are exchanged for
+
+    A token is only valid for a few seconds, so it is checked when the
+    student scans it (issue_grant) or at the kiosk, never at selfie upload
+    time. The scan returns a signed grant for the token's subject that the
+    selfie page sends with its upload (verify_grant_and_consume).
+    """
+
+    def __init__(self, secret=None, window_seconds=QR_WINDOW_SECONDS, grace_windows=QR_GRACE_WINDOWS,
+                 replay_path=COOLDOWN_DB, grant_seconds=UPLOAD_GRANT_SECONDS):
+        print("Initializing QR token service...")
+        self.base_dir = os.path.dirname(os.path.abspath(__file__))
+        self.secret_path = os.path.join(self.base_dir, "known_faces", "qr_secret.key")
+
+        self.secret = secret or self._load_secret()
+        self.window_seconds = window_seconds
+        self.grace_windows = grace_windows
+
+        # A token can only be replayed while it is still inside the validity window.
+        # Used tokens live in SQLite so every server process (prefork workers,
+        # the async front end, app.py) rejects the same replay
+        ttl = window_seconds * (grace_windows + 1)
+        self.replay_cache = CooldownStore(replay_path, ttl=ttl, table="qr_replays")
+
+        # Used grants, and the (scanned token, student) pairs they were used for
+        self.grant_seconds = grant_seconds
+        self.grant_cache = CooldownStore(replay_path, ttl=grant_seconds, table="qr_grants")
+
+    def _load_secret(self):
+        """Use QR_TOKEN_SECRET, or a key file shared by every server process"""
+        env_secret = os.environ.get("QR_TOKEN_SECRET")
+        if env_secret:
+            return env_secret.encode("utf-8")
+
+        if os.path.exists(self.secret_path):
+            with open(self.secret_path, "rb") as f:
+                return f.read()
+
+        os.makedirs(os.path.dirname(self.secret_path), exist_ok=True)
+        secret = secrets.token_bytes(32)
+        with open(self.secret_path, "wb") as f:
+            f.write(secret)
+        logger.info(f"Created new QR signing key: {self.secret_path}")
+        return secret
+
+    def _sign(self, payload):
+        return hmac.new(self.secret, payload, hashlib.sha256).digest()[:SIGNATURE_BYTES]
+
+    def current_window(self, now=None):
+        now = time.time() if now is None else now
+        return int(now // self.window_seconds)
+
+    def expires_at(self, window):
+        """Epoch time after which tokens of this window stop verifying"""
+        return (window + 1 + self.grace_windows) * self.window_seconds
+
+    def issue(self, subject, now=None):
+        """Issue a signed token for the subject's current QR window"""
+        now = time.time() if now is None else now
+        window = self.current_window(now)
+        payload = json.dumps(
+            {"s": subject, "w": window, "n": secrets.token_hex(4)},
+            separators=(",", ":")
+        ).encode("utf-8")
+
+        token = f"{_b64encode(payload)}.{_b64encode(self._sign(payload))}"
+        expires_at = self.expires_at(window)
+        return {
+            "token": token,
+            "subject": subject,
+            "issued_at": now,
+            "expires_at": expires_at,
+            "refresh_in": (window + 1) * self.window_seconds - now
+        }
+
+    def verify(self, token, subject=None, now=None):
+        """Check signature, subject and time window without any stored state"""
+        try:
+            payload_part, signature_part = token.split(".", 1)
+            payload = _b64decode(payload_part)
+            signature = _b64decode(signature_part)
+        except (AttributeError, ValueError):
+            return {"valid": False, "message": "Malformed QR token"}
+
+        if not hmac.compare_digest(signature, self._sign(payload)):
+            return {"valid": False, "message": "Invalid QR token signature"}
+
+        claims = json.loads(payload)
+        if "w" not in claims:
+            return {"valid": False, "message": "Malformed QR token"}
+        if subject is not None and claims["s"] != subject:
+            return {"valid": False, "message": "QR token is for a different subject"}
+
+        age = self.current_window(now) - claims["w"]
+        if age < 0 or age > self.grace_windows:
+            return {"valid": False, "message": "QR token has expired"}
+
+        return {"valid": True, "subject": claims["s"], "window": claims["w"], "nonce": claims["n"]}
+
+    def verify_and_consume(self, token, student_id, subject=None, now=None):
+        """Verify a token and reject a second use of it by the same student
+
+        The same QR code is shown to the whole class, so reuse is tracked per
+        (token, student) pair rather than per token.
+        """
+        result = self.verify(token, subject=subject, now=now)
+        if not result["valid"]:
+            return result
+
+        replay_key = f"{token.rsplit('.', 1)[1]}:{student_id}"
+        if not self.replay_cache.claim(replay_key, now=now)[0]:
+            return {"valid": False, "message": "QR token already used"}
+
+        return result
+
+    def issue_grant(self, token, subject=None, now=None):
+        """Exchange a freshly scanned QR token for a single-use upload grant
+
+        Returns:
+            verify()'s failure, or dict with the signed grant, its subject and expiry
+        """
+        now = time.time() if now is None else now
+        result = self.verify(token, subject=subject, now=now)
+        if not result["valid"]:
+            return result
+
+        expires_at = now + self.grant_seconds
+        payload = json.dumps(
+            {"g": token.rsplit(".", 1)[1], "s": result["subject"], "e": expires_at, "n": secrets.token_hex(4)},
+            separators=(",", ":")
+        ).encode("utf-8")
+        return {
+            "valid": True,
+            "grant": f"{_b64encode(payload)}.{_b64encode(self._sign(payload))}",
+            "subject": result["subject"],
+            "expires_at": expires_at
+        }
+
+    def verify_grant_and_consume(self, grant, student_id, subject=None, now=None):
+        """Check an upload grant and use it up for student_id
+
+        A grant is good for one upload, and a student cannot upload twice
+        with grants from the same scanned QR code.
+        """
+        now = time.time() if now is None else now
+        try:
+            payload_part, signature_part = grant.split(".", 1)
+            payload = _b64decode(payload_part)
+            signature = _b64decode(signature_part)
+        except (AttributeError, ValueError):
+            return {"valid": False, "message": "Malformed upload grant"}
+
+        if not hmac.compare_digest(signature, self._sign(payload)):
+            return {"valid": False, "message": "Invalid upload grant signature"}
+
+        claims = json.loads(payload)
+        if "g" not in claims:
+            return {"valid": False, "message": "Malformed upload grant"}
+        if subject is not None and claims["s"] != subject:
+            return {"valid": False, "message": "Upload grant is for a different subject"}
+        if now > claims["e"]:
+            return {"valid": False, "message": "Upload grant has expired, scan the QR code again"}
+
+        if not self.grant_cache.claim(f"grant:{signature_part}", now=now)[0]:
+            return {"valid": False, "message": "Upload grant already used"}
+        if not self.grant_cache.claim(f"{claims['g']}:{student_id}", now=now)[0]:
+            return {"valid": False, "message": "QR token already used"}
+
+        return {"valid": True, "subject": claims["s"], "expires_at": claims["e"]}
+
+
+# Create singleton instance
+qr_token_service = QRTokenService()
+
+# Forked workers (prefork_server.py) must not share SQLite connections with the master
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=qr_token_service.replay_cache.after_fork)
+    os.register_at_fork(after_in_child=qr_token_service.grant_cache.after_fork)
@@ -0,0 +1,131 @@
+import cv2
+import time
+import numpy as np
+
+# Define constants directly in the module (no config import)
+GATE_MAX_SIDE = 320            # Images are checked on a grayscale copy at most this large
+MIN_BLUR_VARIANCE = 40.0       # Laplacian variance below this is too blurry to encode reliably
+MIN_BRIGHTNESS = 40            # Mean gray level below this is too dark
+MAX_BRIGHTNESS = 220           # Mean gray level above this is washed out
+MAX_CLIPPED_FRACTION = 0.35    # Fraction of pixels crushed to black or blown to white
+MIN_FACE_SIZE = 80             # Smallest face side (pixels, original image) worth encoding
+MAX_YAW_RATIO = 2.5            # Ratio of eye-to-nose distances; larger means a turned head
+MAX_ROLL_DEGREES = 25          # Tilt of the eye line
+
+
+class QualityGate:
+    """Cheap pre-screening that rejects bad uploads before the face encoder runs
+
+    check_image runs before MTCNN on a downscaled grayscale copy (blur and
+    exposure). check_face runs after MTCNN and before dlib encoding (face
+    size and pose from the MTCNN keypoints, plus blur/exposure of the face).
+    """
+
+    def __init__(self):
+        print("Initializing quality gate...")
+        self.min_blur_variance = MIN_BLUR_VARIANCE
+        self.min_brightness = MIN_BRIGHTNESS
+        self.max_brightness = MAX_BRIGHTNESS
+        self.max_clipped_fraction = MAX_CLIPPED_FRACTION
+        self.min_face_size = MIN_FACE_SIZE
+        self.max_yaw_ratio = MAX_YAW_RATIO
+        self.max_roll_degrees = MAX_ROLL_DEGREES
+
+    def _downscaled_gray(self, image):
+        # Shrink first so the color conversion only touches the small copy
+        scale = min(1.0, GATE_MAX_SIDE / max(image.shape[:2]))
+        if scale < 1.0:
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+    def _blur_and_exposure(self, gray):
+        blur = float(cv2.Laplacian(gray, cv2.CV_32F).var())
+        brightness = float(gray.mean())
+        clipped = float(np.count_nonzero((gray <= 10) | (gray >= 245))) / gray.size
+        return blur, brightness, clipped
+
+    def _exposure_reason(self, brightness, clipped):
+        if brightness < self.min_brightness:
+            return "Image too dark"
+        if brightness > self.max_brightness:
+            return "Image overexposed"
+        if clipped > self.max_clipped_fraction:
+            return "Harsh lighting (too many clipped pixels)"
+        return None
+
+    def _result(self, start, reason, metrics):
+        return {
+            "passed": reason is None,
+            "reason": reason,
+            "message": f"{reason} - please retake the photo" if reason else None,
+            "metrics": metrics,
+            "elapsed_ms": (time.perf_counter() - start) * 1000
+        }
+
+    def check_image(self, image):
+        """Whole-image blur and exposure check, run before face detection"""
+        start = time.perf_counter()
+        if image is None or image.size == 0:
+            return self._result(start, "Could not read image", {})
+
+        blur, brightness, clipped = self._blur_and_exposure(self._downscaled_gray(image))
+        metrics = {"blur": blur, "brightness": brightness, "clipped": clipped}
+
+        # Whole-image blur is only a coarse screen: backgrounds can be smooth,
+        # so the strict threshold is applied to the face region in check_face
+        reason = self._exposure_reason(brightness, clipped)
+        if reason is None and blur < self.min_blur_variance / 4:
+            reason = "Image too blurry"
+        return self._result(start, reason, metrics)
+
+    def pose_from_keypoints(self, keypoints):
+        """Yaw ratio and roll angle from MTCNN eye/nose keypoints"""
+        try:
+            left_eye = np.asarray(keypoints["left_eye"], dtype=np.float32)
+            right_eye = np.asarray(keypoints["right_eye"], dtype=np.float32)
+            nose = np.asarray(keypoints["nose"], dtype=np.float32)
+        except (KeyError, TypeError):
+            return None, None
+
+        # A frontal face has the nose roughly halfway between the eyes
+        left = np.linalg.norm(nose - left_eye)
+        right = np.linalg.norm(nose - right_eye)
+        yaw_ratio = float(max(left, right) / max(min(left, right), 1e-6))
+
+        dx, dy = right_eye - left_eye
+        roll = float(np.degrees(np.arctan2(dy, dx)))
+        return yaw_ratio, roll
+
+    def check_face(self, image, detection):
+        """Face size, pose, blur and exposure of one MTCNN detection, run before encoding
+
+        Args:
+            image: Full BGR image
+            detection: Face dict from FaceDetector.detect_faces_detailed
+        """
+        start = time.perf_counter()
+        x, y, w, h = detection["face_box"]
+        metrics = {"face_size": int(min(w, h))}
+
+        if min(w, h) < self.min_face_size:
+            return self._result(start, "Face too small (move closer to the camera)", metrics)
+
+        yaw_ratio, roll = self.pose_from_keypoints(detection.get("keypoints"))
+        metrics.update({"yaw_ratio": yaw_ratio, "roll": roll})
+        if yaw_ratio is not None and yaw_ratio > self.max_yaw_ratio:
+            return self._result(start, "Face turned away (look straight at the camera)", metrics)
+        if roll is not None and abs(roll) > self.max_roll_degrees:
+            return self._result(start, "Head tilted (keep your head level)", metrics)
+
+        face = image[y:y + h, x:x + w]
+        blur, brightness, clipped = self._blur_and_exposure(self._downscaled_gray(face))
+        metrics.update({"blur": blur, "brightness": brightness, "clipped": clipped})
+
+        reason = self._exposure_reason(brightness, clipped)
+        if reason is None and blur < self.min_blur_variance:
+            reason = "Face too blurry"
+        return self._result(start, reason, metrics)
+
+
+# Create singleton instance
+quality_gate = QualityGate()
@@ -0,0 +1,268 @@
+import os
+import json
+import time
+import pickle
+import shutil
+import logging
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from template_manager import template_manager, database_path, template_versions, LEGACY_MODEL_VERSION
+from audit_log import lock_file, unlock_file
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('reencode_gallery')
+
+# Define constants directly in the module (no config import)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "known_faces")
+REENCODE_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+CROPS_PER_TASK = 32        # Face crops encoded per pool task
+CATCH_UP_ROUNDS = 5        # Passes over registrations made while re-encoding before giving up on a quiet switch
+
+
+def encode_crops(paths):
+    """Encode stored face crops with this process's encoder (runs in the process pool)
+
+    Returns:
+        (model version, list of (path, encoding or None, failure reason or None))
+    """
+    import cv2
+    from face_detector import face_detector
+
+    results = []
+    for path in paths:
+        try:
+            crop = cv2.imread(path)
+            if crop is None:
+                results.append((path, None, "Face image missing or unreadable"))
+                continue
+            encoding = face_detector.extract_face_encoding(crop)
+            results.append((path, encoding, None if encoding is not None else "Could not extract face features"))
+        except Exception as e:
+            results.append((path, None, f"Error encoding face: {e}"))
+    return face_detector.model_version, results
+
+
+def read_database(path):
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def write_database(face_db, path):
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        pickle.dump(face_db, f)
+    os.replace(temp_path, path)
+
+
+def stored_templates(face_db):
+    """(student ID, face image path) of every template; templates saved without an image cannot be re-encoded"""
+    templates, missing = [], []
+    for student_id, student_data in face_db.items():
+        if not isinstance(student_data, dict) or "encodings" not in student_data:
+            continue
+        image_paths = student_data.get("image_paths", [])
+        for i in range(len(student_data["encodings"])):
+            if i < len(image_paths) and image_paths[i]:
+                templates.append((student_id, image_paths[i]))
+            else:
+                missing.append(student_id)
+    return templates, missing
+
+
+class GalleryReencoder:
+    """Rebuild face_db.pickle with a new encoder from the stored face crops
+
+    The new database is built in worker processes running the target
+    encoder (set through ENCODER_LANDMARKS/ENCODER_JITTERS in their
+    environment) and staged as face_db.<version>.pickle next to the live
+    one, which keeps serving. Registrations made meanwhile are re-encoded
+    in catch-up passes. The switch then happens under the lock
+    FaceDetector.save_database takes: the live database is kept as
+    face_db.<old version>.pickle and the staged one is renamed over
+    face_db.pickle.
+
+    Running detectors notice the rename within DB_POLL_INTERVAL. Those on
+    the new encoder load it; those still on the old one fall back to the
+    copy of their version, so recognition never stops while workers are
+    recycled onto the new encoder. They refuse registrations meanwhile
+    (FaceDetector.accepts_registrations), since the copy is never merged
+    back into face_db.pickle.
+    """
+
+    def __init__(self, data_dir=DATA_DIR, workers=REENCODE_WORKERS, landmarks=None, jitters=None):
+        self.data_dir = data_dir
+        self.active_path = database_path(data_dir)
+        self.workers = workers
+        self.encoder_env = {}
+        if landmarks is not None:
+            self.encoder_env["ENCODER_LANDMARKS"] = landmarks
+        if jitters is not None:
+            self.encoder_env["ENCODER_JITTERS"] = str(jitters)
+
+        self.target_version = None
+        self.failures = {}      # face image path -> reason
+
+    def _stamp(self):
+        return os.stat(self.active_path).st_mtime_ns if os.path.exists(self.active_path) else None
+
+    def _encode(self, pool, paths):
+        """Encode paths in the pool; returns {path: encoding} and records failures"""
+        chunks = [paths[i:i + CROPS_PER_TASK] for i in range(0, len(paths), CROPS_PER_TASK)]
+        encoded = {}
+        done = 0
+        for version, results in pool.map(encode_crops, chunks):
+            if self.target_version is None:
+                self.target_version = version
+            elif version != self.target_version:
+                raise RuntimeError(f"Workers disagree on the model version ({version} vs {self.target_version})")
+            for path, encoding, reason in results:
+                if encoding is None:
+                    self.failures[path] = reason
+                else:
+                    encoded[path] = encoding
+            done += len(results)
+            logger.info(f"Re-encoded {done}/{len(paths)} face images")
+        return encoded
+
+    def _build(self, face_db, encoded):
+        """face_db with every template replaced by its new encoding (templates that failed are dropped)"""
+        new_db = {}
+        for student_id, student_data in face_db.items():
+            if not isinstance(student_data, dict) or "encodings" not in student_data:
+                new_db[student_id] = student_data
+                continue
+            entry = {k: v for k, v in student_data.items()
+                     if k not in ("encodings", "image_paths", "model_versions", "centroid")}
+            entry.update({"encodings": [], "image_paths": [], "model_versions": []})
+            for path in student_data.get("image_paths", []):
+                if path in encoded:
+                    entry["encodings"].append(encoded[path])
+                    entry["image_paths"].append(path)
+                    entry["model_versions"].append(self.target_version)
+            template_manager.update_centroid(entry)
+            new_db[student_id] = entry
+        return new_db
+
+    def _catch_up(self, pool, new_db, seen):
+        """Add templates registered in the live database since it was read; returns the stamp read"""
+        stamp = self._stamp()
+        face_db = read_database(self.active_path)
+        templates, _ = stored_templates(face_db)
+        fresh = [(student_id, path) for student_id, path in templates if path not in seen]
+        if fresh:
+            logger.info(f"Catching up with {len(fresh)} templates registered while re-encoding")
+            encoded = self._encode(pool, [path for _, path in fresh])
+            for student_id, path in fresh:
+                seen.add(path)
+                if path not in encoded:
+                    continue
+                entry = new_db.setdefault(student_id, {
+                    "encodings": [], "image_paths": [], "model_versions": [],
+                    "registered_on": face_db[student_id].get("registered_on")
+                })
+                template_manager.add_template(entry, encoded[path], path, self.target_version)
+        return stamp
+
+    def run(self, switch=True, force=False):
+        start = time.time()
+        if not os.path.exists(self.active_path):
+            raise SystemExit(f"No face database at {self.active_path}")
+
+        stamp = self._stamp()
+        face_db = read_database(self.active_path)
+        old_versions = template_versions(face_db) or {LEGACY_MODEL_VERSION}
+        templates, missing = stored_templates(face_db)
+        logger.info(f"{len(face_db)} students, {len(templates)} templates with face images "
+                    f"({len(missing)} without), encoded by {sorted(old_versions)}")
+
+        # spawn: workers import the encoder with the target settings in their environment
+        saved_env = {name: os.environ.get(name) for name in self.encoder_env}
+        os.environ.update(self.encoder_env)
+        try:
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=self.workers, mp_context=context) as pool:
+                # The workers report the version their settings produce
+                self.target_version = pool.submit(encode_crops, []).result()[0]
+                if old_versions == {self.target_version} and not force:
+                    raise SystemExit(f"Face database is already encoded with {self.target_version}")
+                encoded = self._encode(pool, [path for _, path in templates])
+                new_db = self._build(face_db, encoded)
+
+                staged_path = database_path(self.data_dir, self.target_version)
+                write_database(new_db, staged_path)
+                logger.info(f"Staged {self.target_version} database at {staged_path}")
+
+                seen = {path for _, path in templates}
+                switched = False
+                with open(self.active_path + ".lock", "a+") as lock_handle:
+                    for _ in range(CATCH_UP_ROUNDS if switch else 1):
+                        if stamp != self._stamp():
+                            stamp = self._catch_up(pool, new_db, seen)
+                            write_database(new_db, staged_path)
+                        if not switch:
+                            break
+
+                        lock_file(lock_handle)
+                        try:
+                            # A registration saved since the last catch-up needs another pass first
+                            if stamp == self._stamp():
+                                self._switch(old_versions, staged_path)
+                                switched = True
+                                break
+                        finally:
+                            unlock_file(lock_handle)
+                if switch and not switched:
+                    logger.error(f"Registrations kept arriving; {staged_path} is staged but not switched in")
+        finally:
+            for name, value in saved_env.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+        without_templates = sorted(s for s, d in new_db.items()
+                                   if isinstance(d, dict) and "encodings" in d and not d["encodings"])
+        return {
+            "from_versions": sorted(old_versions),
+            "to_version": self.target_version,
+            "students": len(new_db),
+            "templates": sum(len(d.get("encodings", [])) for d in new_db.values() if isinstance(d, dict)),
+            "templates_without_images": len(missing),
+            "failed": self.failures,
+            "students_without_templates": without_templates,
+            "switched": switched,
+            "database": self.active_path if switched else staged_path,
+            "seconds": time.time() - start
+        }
+
+    def _switch(self, old_versions, staged_path):
+        """Keep the live database for processes on the old encoder, then rename the new one over it"""
+        if len(old_versions) == 1:
+            old_path = database_path(self.data_dir, next(iter(old_versions)))
+            shutil.copy2(self.active_path, old_path + ".tmp")
+            os.replace(old_path + ".tmp", old_path)
+            logger.info(f"Kept the {next(iter(old_versions))} database at {old_path}")
+        os.replace(staged_path, self.active_path)
+        logger.info(f"Switched {self.active_path} to {self.target_version}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-encode the face gallery from stored face images with a new encoder")
+    parser.add_argument("--landmarks", choices=["large", "small"], default=None,
+                        help="Landmark model of the new encoder (default: ENCODER_LANDMARKS or small)")
+    parser.add_argument("--jitters", type=int, default=None,
+                        help="Jitters of the new encoder (default: ENCODER_JITTERS or 1)")
+    parser.add_argument("--workers", type=int, default=REENCODE_WORKERS, help="Encoding processes")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="Directory holding face_db.pickle")
+    parser.add_argument("--stage-only", action="store_true",
+                        help="Build face_db.<version>.pickle without switching face_db.pickle to it")
+    parser.add_argument("--force", action="store_true", help="Re-encode even if the database already has the target version")
+    args = parser.parse_args()
+
+    reencoder = GalleryReencoder(args.data_dir, workers=args.workers, landmarks=args.landmarks, jitters=args.jitters)
+    print(json.dumps(reencoder.run(switch=not args.stage_only, force=args.force), indent=2, default=str))
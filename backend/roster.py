@@ -0,0 +1,101 @@
+import os
+import csv
+import threading
+import logging
+
+logger = logging.getLogger('roster')
+
+
+class SubjectRoster:
+    """Maps each subject to the student IDs enrolled in it
+
+    Rosters are stored in known_faces/rosters.csv with "Subject" and
+    "Student ID" columns. Subjects without a roster fall back to the full
+    gallery, so recognition keeps working before rosters are imported.
+    """
+
+    def __init__(self):
+        self.base_dir = os.path.dirname(os.path.abspath(__file__))
+        self.roster_file = os.path.join(self.base_dir, "known_faces", "rosters.csv")
+        self.subjects = {}
+        self.generation = 0
+        self.lock = threading.RLock()
+        self.load()
+
+    def load(self):
+        """Load the saved rosters from disk"""
+        with self.lock:
+            self.subjects = {}
+            if os.path.exists(self.roster_file):
+                self._read_csv(self.roster_file)
+                print(f"Loaded rosters for {len(self.subjects)} subjects")
+            self.generation += 1
+
+    def save(self):
+        """Save all rosters to disk"""
+        with self.lock:
+            os.makedirs(os.path.dirname(self.roster_file), exist_ok=True)
+            with open(self.roster_file, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(["Subject", "Student ID"])
+                for subject in sorted(self.subjects):
+                    for student_id in sorted(self.subjects[subject]):
+                        writer.writerow([subject, student_id])
+
+    def _read_csv(self, path):
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                subject = (row.get("Subject") or row.get("subject") or "").strip()
+                student_id = (row.get("Student ID") or row.get("student_id") or "").strip()
+                if subject and student_id:
+                    self.subjects.setdefault(subject.upper(), set()).add(student_id)
+
+    def import_csv(self, path, replace=False):
+        """Import rosters from a CSV with Subject and Student ID columns"""
+        with self.lock:
+            if replace:
+                self.subjects = {}
+            self._read_csv(path)
+            self.generation += 1
+            self.save()
+        logger.info(f"Imported rosters from {path}: {len(self.subjects)} subjects")
+        return {"success": True, "subjects": len(self.subjects)}
+
+    def enroll(self, subject, student_id):
+        """Add a student to a subject roster"""
+        with self.lock:
+            students = self.subjects.setdefault(subject.upper(), set())
+            if student_id in students:
+                return False
+            students.add(student_id)
+            self.generation += 1
+            self.save()
+            return True
+
+    def enroll_many(self, subject, student_ids):
+        """Add several students to a subject roster with one save"""
+        with self.lock:
+            students = self.subjects.setdefault(subject.upper(), set())
+            new = set(student_ids) - students
+            if not new:
+                return 0
+            students.update(new)
+            self.generation += 1
+            self.save()
+            return len(new)
+
+    def students(self, subject):
+        """Student IDs enrolled in subject, or None if the subject has no roster"""
+        if not subject:
+            return None
+        with self.lock:
+            students = self.subjects.get(subject.upper())
+            return frozenset(students) if students else None
+
+    def is_enrolled(self, subject, student_id):
+        students = self.students(subject)
+        return students is None or student_id in students
+
+
+# Create singleton instance
+subject_roster = SubjectRoster()
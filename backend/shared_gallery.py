@@ -0,0 +1,181 @@
+import os
+import json
+import time
+import shutil
+import logging
+import numpy as np
+from face_gallery import FaceGallery, GalleryView
+from audit_log import lock_file, unlock_file
+
+logger = logging.getLogger('shared_gallery')
+
+# Define constants directly in the module (no config import)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SHARED_GALLERY_ENABLED = os.environ.get("SHARED_GALLERY", "0") == "1"
+# Put this on /dev/shm to keep the published gallery out of the disk entirely
+SHARED_GALLERY_DIR = os.environ.get("SHARED_GALLERY_DIR", os.path.join(BASE_DIR, "known_faces", "shared_gallery"))
+GENERATION_POLL = 0.5      # Seconds between checks for a gallery published by another process
+KEEP_GENERATIONS = 3       # Published generations kept on disk for readers still mapping them
+
+
+class SharedGallery(FaceGallery):
+    """FaceGallery whose template matrix is shared by every local process
+
+    Publishing writes the templates, per-student offsets and centroids of
+    face_db as .npy files into a new gen-<n> directory and then points the
+    CURRENT file at it. Every process maps those files read-only, so the
+    matrix is held once in the page cache however many workers attach,
+    instead of once per process.
+
+    The generation number in CURRENT is the cross-process counter: workers
+    compare it (at most every GENERATION_POLL seconds) with the one they
+    mapped and remap when another process published a registration.
+    Quantized coarse copies and per-subject views are still built per
+    process, on top of the shared matrix.
+    """
+
+    def __init__(self, storage="float64", directory=SHARED_GALLERY_DIR, poll_interval=GENERATION_POLL):
+        super().__init__(storage=storage)
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self.current_path = os.path.join(directory, "CURRENT")
+        os.makedirs(directory, exist_ok=True)
+        self.lock_handle = open(os.path.join(directory, "publish.lock"), "a+")
+        self._published = None     # Last CURRENT contents seen
+        self._checked_at = 0.0
+
+    def _read_current(self):
+        try:
+            with open(self.current_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def invalidate(self, face_db=None, stamp=None):
+        """Publish face_db to every attached process
+
+        stamp identifies the face_db source (e.g. the pickle's mtime); when
+        the published generation was built from the same stamp, this process
+        just attaches to it instead of publishing a new generation.
+        """
+        with self.lock:
+            if face_db is not None:
+                current = self._read_current()
+                if stamp is None or current is None or current.get("stamp") != stamp:
+                    self.publish(face_db, stamp)
+            self._checked_at = 0.0
+            self._poll()
+
+    def publish(self, face_db, stamp=None):
+        """Write face_db as a new generation and make it current"""
+        student_ids, blocks, starts, centroids = [], [], [], []
+        offset = 0
+        for student_id, student_data in face_db.items():
+            if not isinstance(student_data, dict) or not student_data.get("encodings"):
+                continue
+            encodings = np.asarray(student_data["encodings"], dtype=np.float64)
+            student_ids.append(student_id)
+            blocks.append(encodings)
+            starts.append(offset)
+            offset += len(encodings)
+            centroid = student_data.get("centroid")
+            centroids.append(encodings.mean(axis=0) if centroid is None else centroid)
+
+        lock_file(self.lock_handle)
+        try:
+            current = self._read_current()
+            generation = (current["generation"] if current else 0) + 1
+            name = f"gen-{generation}"
+            temp_dir = os.path.join(self.directory, name + ".tmp")
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            os.makedirs(temp_dir)
+
+            np.save(os.path.join(temp_dir, "templates.npy"), np.vstack(blocks) if blocks else np.zeros((0, 128)))
+            np.save(os.path.join(temp_dir, "starts.npy"), np.asarray(starts, dtype=np.intp))
+            np.save(os.path.join(temp_dir, "centroids.npy"), np.vstack(centroids) if centroids else np.zeros((0, 128)))
+            with open(os.path.join(temp_dir, "students.json"), "w") as f:
+                json.dump(student_ids, f)
+            os.replace(temp_dir, os.path.join(self.directory, name))
+
+            # Readers only ever see complete generations through CURRENT
+            temp_current = self.current_path + ".tmp"
+            with open(temp_current, "w") as f:
+                json.dump({"generation": generation, "name": name, "stamp": stamp,
+                           "students": len(student_ids), "templates": offset, "published_at": time.time()}, f)
+            os.replace(temp_current, self.current_path)
+            self._remove_old_generations(generation)
+        finally:
+            unlock_file(self.lock_handle)
+        logger.info(f"Published shared gallery generation {generation} ({len(student_ids)} students, {offset} templates)")
+
+    def _remove_old_generations(self, generation):
+        # Processes still mapping a removed generation keep their pages until they remap
+        for entry in os.listdir(self.directory):
+            if entry.startswith("gen-") and not entry.endswith(".tmp"):
+                try:
+                    old = int(entry[4:])
+                except ValueError:
+                    continue
+                if old <= generation - KEEP_GENERATIONS:
+                    shutil.rmtree(os.path.join(self.directory, entry), ignore_errors=True)
+
+    def _poll(self):
+        """Look for a newer published generation; caller holds self.lock"""
+        now = time.time()
+        if now - self._checked_at < self.poll_interval:
+            return
+        self._checked_at = now
+        current = self._read_current()
+        if current is not None and (self._published is None or current["generation"] != self._published["generation"]):
+            self._published = current
+            self.generation = current["generation"]
+
+    def _rebuild(self):
+        if self._published is None:
+            super()._rebuild()
+            return
+
+        for _ in range(KEEP_GENERATIONS):
+            try:
+                view = self._map(self._published["name"])
+                break
+            except FileNotFoundError:
+                # Pruned by publishers since CURRENT was read: a newer generation is current
+                current = self._read_current()
+                if current is None or current["generation"] == self._published["generation"]:
+                    raise
+                logger.info(f"Generation {self._published['generation']} was removed, mapping {current['generation']}")
+                self._published = current
+                self.generation = current["generation"]
+        else:
+            raise RuntimeError("Shared gallery generations were removed faster than they could be mapped")
+
+        self._full_view = view
+        self._views = {}
+        self._built_generation = self.generation
+
+    def _map(self, name):
+        """Full view over a published generation's files"""
+        path = os.path.join(self.directory, name)
+        with open(os.path.join(path, "students.json")) as f:
+            student_ids = json.load(f)
+        matrix = np.load(os.path.join(path, "templates.npy"), mmap_mode="r")
+        starts = np.load(os.path.join(path, "starts.npy"))
+        centroids = np.load(os.path.join(path, "centroids.npy"), mmap_mode="r") if student_ids else None
+        return GalleryView(student_ids, matrix, starts, centroids).quantize(self.storage)
+
+    def _ensure_built(self):
+        self._poll()
+        super()._ensure_built()
+
+    def after_fork(self):
+        # flock() locks are shared with the parent through the open file description
+        self.lock_handle = open(os.path.join(self.directory, "publish.lock"), "a+")
+
+    def stats(self):
+        with self.lock:
+            self._poll()
+            published = dict(self._published) if self._published else {}
+        published["directory"] = self.directory
+        published["mapped_generation"] = self._built_generation
+        return published
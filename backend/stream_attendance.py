@@ -0,0 +1,294 @@
+import os
+import cv2
+import time
+import argparse
+import logging
+import numpy as np
+from face_detector import face_detector
+from database import attendance_db
+
+logger = logging.getLogger('stream_attendance')
+
+# Define constants directly in the module (no config import)
+TRACK_MIN_IOU = 0.3           # Minimum overlap to continue an existing track
+TRACK_MAX_MISSED = 15         # Frames a track may go undetected before it is dropped
+TRACK_CONFIRM_HITS = 3        # Detections needed before a recognized track marks attendance
+QUALITY_IMPROVEMENT = 1.25    # Re-encode a track only when its quality improves by this factor
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """Intersection-over-union between two lists of (x, y, w, h) boxes"""
+    if len(boxes_a) == 0 or len(boxes_b) == 0:
+        return np.zeros((len(boxes_a), len(boxes_b)))
+
+    a = np.asarray(boxes_a, dtype=np.float32)[:, None, :]
+    b = np.asarray(boxes_b, dtype=np.float32)[None, :, :]
+
+    x1 = np.maximum(a[..., 0], b[..., 0])
+    y1 = np.maximum(a[..., 1], b[..., 1])
+    x2 = np.minimum(a[..., 0] + a[..., 2], b[..., 0] + b[..., 2])
+    y2 = np.minimum(a[..., 1] + a[..., 3], b[..., 1] + b[..., 3])
+
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    union = a[..., 2] * a[..., 3] + b[..., 2] * b[..., 3] - intersection
+    return intersection / np.maximum(union, 1e-6)
+
+
+class FaceTrack:
+    def __init__(self, track_id, detection, frame_index):
+        self.track_id = track_id
+        self.box = detection["box"]
+        self.detection = detection
+        self.quality = self.face_quality(detection)
+        self.hits = 1
+        self.last_seen = frame_index
+
+        # Recognition state
+        self.encoded_quality = 0.0
+        self.student_id = None
+        self.confidence = 0.0
+        self.marked = False
+
+    @staticmethod
+    def face_quality(detection):
+        """Cheap quality estimate: larger, more confident faces encode better"""
+        _, _, w, h = detection["face_box"]
+        return float(w * h * detection["confidence"])
+
+    def update(self, detection, frame_index):
+        self.box = detection["box"]
+        self.detection = detection
+        self.quality = self.face_quality(detection)
+        self.hits += 1
+        self.last_seen = frame_index
+
+    def needs_recognition(self):
+        """Encode new tracks once, and again only when the face got noticeably better"""
+        if self.encoded_quality == 0.0:
+            return True
+        if self.marked:
+            return False
+        return self.quality >= self.encoded_quality * QUALITY_IMPROVEMENT
+
+
+class FaceTracker:
+    def __init__(self, min_iou=TRACK_MIN_IOU, max_missed=TRACK_MAX_MISSED):
+        self.min_iou = min_iou
+        self.max_missed = max_missed
+        self.tracks = {}
+        self.next_track_id = 1
+
+    def update(self, detections, frame_index):
+        """Associate this frame's detections with existing tracks (greedy IoU)
+
+        Returns:
+            list of tracks that were seen in this frame
+        """
+        track_ids = list(self.tracks.keys())
+        overlaps = iou_matrix([self.tracks[t].box for t in track_ids], [d["box"] for d in detections])
+
+        seen = []
+        unmatched = set(range(len(detections)))
+
+        # Take the best remaining overlap first until nothing is above the threshold
+        while overlaps.size and overlaps.max() >= self.min_iou:
+            row, col = np.unravel_index(np.argmax(overlaps), overlaps.shape)
+            track = self.tracks[track_ids[row]]
+            track.update(detections[col], frame_index)
+            seen.append(track)
+            unmatched.discard(col)
+            overlaps[row, :] = -1
+            overlaps[:, col] = -1
+
+        # Unmatched detections start new tracks
+        for col in sorted(unmatched):
+            track = FaceTrack(self.next_track_id, detections[col], frame_index)
+            self.tracks[track.track_id] = track
+            self.next_track_id += 1
+            seen.append(track)
+
+        # Drop tracks that have not been seen for a while
+        for track_id in track_ids:
+            if frame_index - self.tracks[track_id].last_seen > self.max_missed:
+                del self.tracks[track_id]
+
+        return seen
+
+
+class StreamAttendanceService:
+    def __init__(self, source, subject=None, roster=None, detect_every=1, confirm_hits=TRACK_CONFIRM_HITS):
+        """
+        Args:
+            source: Camera index, video file path or RTSP URL
+            subject: Subject the attendance is recorded for
+            roster: Optional iterable of student IDs (default: the subject's roster)
+            detect_every: Run detection on every Nth frame only
+            confirm_hits: Detections needed before a recognized track is marked
+        """
+        self.source = int(source) if str(source).isdigit() else source
+        self.subject = subject
+        self.roster = list(roster) if roster is not None else None
+        self.detect_every = max(1, detect_every)
+        self.confirm_hits = confirm_hits
+
+        self.tracker = FaceTracker()
+        self.marked_students = {}
+        self.stats = {
+            "frames_read": 0,
+            "frames_detected": 0,
+            "faces_detected": 0,
+            "faces_encoded": 0,
+            "tracks_created": 0,
+            "students_marked": 0,
+            "partial_matches": 0,
+            "detect_time": 0.0,
+            "encode_time": 0.0
+        }
+
+    def recognize_tracks(self, tracks, rgb_image):
+        """Encode the given tracks in one batch and update their identities
+        
+        If gallery shards did not answer, the best match may be on one of
+        them, so the tracks are left as they were and encoded again on a
+        later frame.
+        """
+        start = time.perf_counter()
+        encodings = face_detector.extract_face_encodings_batch(
+            rgb_image, [t.detection["face_box"] for t in tracks]
+        )
+        self.stats["encode_time"] += time.perf_counter() - start
+        self.stats["faces_encoded"] += len(tracks)
+
+        # Even with nothing to match against, these tracks are not re-encoded until their quality improves
+        for track in tracks:
+            track.encoded_quality = track.quality
+
+        view = face_detector.gallery_view(subject=self.subject, student_ids=self.roster)
+        if len(encodings) == 0 or len(view) == 0:
+            return
+
+        similarities = view.similarity_matrix(encodings)
+        # Sharded views only know their column order after similarity_matrix
+        student_ids = view.student_ids
+
+        missing = getattr(view, "last_missing", [])
+        if missing:
+            for track in tracks:
+                track.encoded_quality = 0.0
+            self.stats["partial_matches"] += 1
+            logger.warning(f"Stream: gallery shards {missing} did not answer, retrying {len(tracks)} tracks")
+            return
+
+        for track, row in zip(tracks, similarities):
+            best = int(np.argmax(row))
+            confidence = row[best] * 100
+            if confidence >= face_detector.min_confidence * 100 and confidence >= track.confidence:
+                track.student_id = student_ids[best]
+                track.confidence = confidence
+
+    def confirm_tracks(self, tracks):
+        """Mark attendance for recognized tracks that have been seen long enough"""
+        for track in tracks:
+            if track.marked or track.student_id is None or track.hits < self.confirm_hits:
+                continue
+
+            track.marked = True
+            if track.student_id in self.marked_students:
+                continue
+
+            attendance_db.mark_attendance(
+                track.student_id, status="Present", method="Live Stream", subject=self.subject, confidence=track.confidence
+            )
+            self.marked_students[track.student_id] = track.confidence
+            self.stats["students_marked"] += 1
+            logger.info(f"Stream: marked {track.student_id} present (track {track.track_id}, confidence {track.confidence:.2f}%)")
+
+    def process_frame(self, frame, frame_index):
+        """Detect, track and (only when needed) recognize faces in one frame"""
+        start = time.perf_counter()
+        detections, rgb_image = face_detector.detect_faces_detailed(frame)
+        self.stats["detect_time"] += time.perf_counter() - start
+        self.stats["frames_detected"] += 1
+        self.stats["faces_detected"] += len(detections)
+
+        previous_next_id = self.tracker.next_track_id
+        seen = self.tracker.update(detections, frame_index)
+        self.stats["tracks_created"] += self.tracker.next_track_id - previous_next_id
+
+        pending = [t for t in seen if t.needs_recognition()]
+        if pending:
+            self.recognize_tracks(pending, rgb_image)
+
+        self.confirm_tracks(seen)
+        return seen
+
+    def run(self, max_frames=None, display=False):
+        """Consume the stream until it ends, max_frames is reached or 'q' is pressed"""
+        cap = cv2.VideoCapture(self.source)
+        if not cap.isOpened():
+            return {"success": False, "message": f"Could not open video source {self.source}"}
+
+        logger.info(f"Starting stream attendance on {self.source} (subject={self.subject})")
+        start_time = time.time()
+        frame_index = 0
+
+        try:
+            while max_frames is None or frame_index < max_frames:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+
+                self.stats["frames_read"] += 1
+
+                if frame_index % self.detect_every == 0:
+                    seen = self.process_frame(frame, frame_index)
+
+                    if display:
+                        for track in seen:
+                            x, y, w, h = track.box
+                            color = (0, 255, 0) if track.marked else (0, 165, 255)
+                            label = track.student_id or f"Track {track.track_id}"
+                            cv2.rectangle(frame, (x, y), (x+w, y+h), color, 2)
+                            cv2.putText(frame, label, (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+
+                if display:
+                    cv2.imshow("Stream Attendance", frame)
+                    if cv2.waitKey(1) & 0xFF == ord('q'):
+                        break
+
+                frame_index += 1
+        finally:
+            cap.release()
+            if display:
+                cv2.destroyAllWindows()
+
+        elapsed = time.time() - start_time
+        return {
+            "success": True,
+            "subject": self.subject,
+            "marked_students": self.marked_students,
+            "elapsed_seconds": elapsed,
+            "fps": self.stats["frames_read"] / elapsed if elapsed > 0 else 0,
+            "stats": self.stats
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Live camera/RTSP/video-file attendance")
+    parser.add_argument("--source", default="0", help="Camera index, video file or RTSP URL")
+    parser.add_argument("--subject", default=None, help="Subject to record attendance for")
+    parser.add_argument("--detect-every", type=int, default=1, help="Run detection on every Nth frame")
+    parser.add_argument("--max-frames", type=int, default=None, help="Stop after this many frames")
+    parser.add_argument("--display", action="store_true", help="Show the annotated stream")
+    args = parser.parse_args()
+
+    if not str(args.source).isdigit() and "://" not in args.source and not os.path.exists(args.source):
+        print(f"Video source not found: {args.source}")
+        raise SystemExit(1)
+
+    service = StreamAttendanceService(args.source, subject=args.subject, detect_every=args.detect_every)
+    result = service.run(max_frames=args.max_frames, display=args.display)
+
+    print("\nStream Attendance Result:")
+    for key, value in result.items():
+        print(f"{key}: {value}")
@@ -0,0 +1,147 @@
+import os
+import numpy as np
+
+# Define constants directly in the module (no config import)
+MAX_TEMPLATES_PER_STUDENT = 8   # Templates kept per student after pruning
+LEGACY_MODEL_VERSION = "dlib-resnet-v1-small-j1"   # Templates saved before versions were recorded (library defaults)
+
+
+def database_path(data_dir, model_version=None):
+    """face_db.pickle, or the copy kept for one model version after a re-encode switched away from it"""
+    if model_version is None:
+        return os.path.join(data_dir, "face_db.pickle")
+    return os.path.join(data_dir, f"face_db.{model_version}.pickle")
+
+
+def template_versions(face_db):
+    """Model versions of the templates in face_db"""
+    versions = set()
+    for student_data in face_db.values():
+        if isinstance(student_data, dict) and student_data.get("encodings"):
+            versions.update(student_data.get("model_versions") or [LEGACY_MODEL_VERSION])
+    return versions
+
+
+def templates_of_version(face_db, model_version):
+    """face_db restricted to the templates encoded by model_version (face_db itself if that is all of them)"""
+    if template_versions(face_db) <= {model_version}:
+        return face_db
+    filtered = {}
+    for student_id, student_data in face_db.items():
+        if not isinstance(student_data, dict) or not student_data.get("encodings"):
+            continue
+        keep = [i for i, v in enumerate(student_data.get("model_versions", [])) if v == model_version]
+        if keep:
+            filtered[student_id] = {"encodings": [student_data["encodings"][i] for i in keep]}
+    return filtered
+
+
+def pairwise_distances(encodings):
+    """Euclidean distance between every pair of encodings, shape (N, N)"""
+    encodings = np.asarray(encodings, dtype=np.float64)
+    squared = np.sum(encodings * encodings, axis=1)
+    distances = squared[:, None] + squared[None, :] - 2.0 * encodings @ encodings.T
+    return np.sqrt(np.maximum(distances, 0.0))
+
+
+def medoid_index(distances):
+    """Index of the template closest on average to all the others"""
+    return int(np.argmin(distances.sum(axis=1)))
+
+
+def select_diverse_templates(encodings, max_templates=MAX_TEMPLATES_PER_STUDENT):
+    """Pick a diverse subset of templates (medoid + greedy farthest-point)
+
+    Returns:
+        sorted list of indices to keep
+    """
+    count = len(encodings)
+    if count <= max_templates:
+        return list(range(count))
+
+    distances = pairwise_distances(encodings)
+    keep = [medoid_index(distances)]
+    nearest = distances[keep[0]].copy()
+
+    # Repeatedly add the template farthest from everything kept so far
+    while len(keep) < max_templates:
+        candidate = int(np.argmax(nearest))
+        keep.append(candidate)
+        nearest = np.minimum(nearest, distances[candidate])
+
+    return sorted(keep)
+
+
+class TemplateManager:
+    """Keeps each student's template set bounded, diverse and summarized by a centroid
+
+    Works incrementally: adding a sample to a full set drops the single most
+    redundant template (the one closest to another), never the medoid.
+    """
+
+    def __init__(self, max_templates=MAX_TEMPLATES_PER_STUDENT):
+        self.max_templates = max_templates
+
+    def update_centroid(self, entry):
+        encodings = entry["encodings"]
+        entry["centroid"] = np.mean(np.asarray(encodings), axis=0) if encodings else None
+
+    def _drop(self, entry, index):
+        entry["encodings"].pop(index)
+        removed = entry["image_paths"].pop(index) if index < len(entry.get("image_paths", [])) else None
+        if index < len(entry.get("model_versions", [])):
+            entry["model_versions"].pop(index)
+        return removed
+
+    def add_template(self, entry, encoding, image_path, model_version=None):
+        """Add one sample to a face_db entry and prune it back to the cap
+
+        model_version is recorded per template in entry["model_versions"],
+        parallel to "encodings" and "image_paths".
+
+        Returns:
+            list of image paths whose templates were dropped
+        """
+        entry["encodings"].append(encoding)
+        entry.setdefault("image_paths", []).append(image_path)
+        entry.setdefault("model_versions", []).append(model_version)
+
+        removed = []
+        if len(entry["encodings"]) > self.max_templates:
+            distances = pairwise_distances(entry["encodings"])
+            np.fill_diagonal(distances, np.inf)
+            protected = medoid_index(np.where(np.isinf(distances), 0.0, distances))
+
+            # The most redundant template is the one with the closest neighbour
+            nearest = distances.min(axis=1)
+            nearest[protected] = np.inf
+            removed.append(self._drop(entry, int(np.argmin(nearest))))
+
+        self.update_centroid(entry)
+        return [path for path in removed if path]
+
+    def prune(self, entry):
+        """Prune an existing (possibly oversized) entry in one pass
+
+        Returns:
+            list of image paths whose templates were dropped
+        """
+        encodings = entry.get("encodings", [])
+        removed = []
+
+        if len(encodings) > self.max_templates:
+            keep = set(select_diverse_templates(encodings, self.max_templates))
+            image_paths = entry.get("image_paths", [])
+
+            removed = [path for i, path in enumerate(image_paths) if i not in keep]
+            entry["encodings"] = [e for i, e in enumerate(encodings) if i in keep]
+            entry["image_paths"] = [p for i, p in enumerate(image_paths) if i in keep]
+            if "model_versions" in entry:
+                entry["model_versions"] = [v for i, v in enumerate(entry["model_versions"]) if i in keep]
+
+        self.update_centroid(entry)
+        return removed
+
+
+# Create singleton instance
+template_manager = TemplateManager()
@@ -0,0 +1,168 @@
+import cv2
+import numpy as np
+
+# Define constants directly in the module (no config import)
+TEXTURE_CROP_SIZE = 64          # Face crops are downscaled to this square size
+TEXTURE_SCALES = 3              # Number of pyramid levels for Laplacian energy
+LBP_BINS = 59                   # 58 uniform patterns + 1 bin for all non-uniform ones
+MOIRE_BAND = (0.25, 0.5)        # Normalised radial frequency band checked for moire peaks
+MOIRE_PEAK_REF = 40.0           # Peak/median ratio at which the moire score saturates
+DETAIL_RATIO_REF = 0.35         # Fine/coarse Laplacian energy ratio of a typical live face
+REPLAY_WEIGHTS = (0.5, 0.5)     # (moire, loss of fine detail) weights in the replay score
+
+
+def _build_uniform_lbp_lut():
+    """Map the 256 raw LBP codes onto the 59 uniform-pattern bins"""
+    codes = np.arange(256, dtype=np.uint16)
+    rotated = ((codes << 1) | (codes >> 7)) & 0xFF
+    transitions = np.unpackbits((codes ^ rotated).astype(np.uint8)[:, None], axis=1).sum(axis=1)
+
+    lut = np.full(256, LBP_BINS - 1, dtype=np.uint8)
+    uniform = np.flatnonzero(transitions <= 2)
+    lut[uniform] = np.arange(len(uniform), dtype=np.uint8)
+    return lut
+
+
+def _build_radial_band_mask(size, band):
+    """Boolean mask over an rfft2 spectrum selecting a normalised radial band"""
+    fy = np.fft.fftfreq(size).astype(np.float32)[:, None]
+    fx = np.fft.rfftfreq(size).astype(np.float32)[None, :]
+    radius = np.sqrt(fx * fx + fy * fy) / 0.5  # 1.0 == Nyquist
+    return (radius >= band[0]) & (radius < band[1])
+
+
+class TextureAnalyzer:
+    def __init__(self, crop_size=TEXTURE_CROP_SIZE, scales=TEXTURE_SCALES):
+        print("Initializing texture analyzer...")
+        self.crop_size = crop_size
+        self.scales = scales
+
+        # Everything that only depends on the crop size is computed once here
+        self.lbp_lut = _build_uniform_lbp_lut()
+        self.moire_mask = _build_radial_band_mask(crop_size, MOIRE_BAND)
+        window = np.hanning(crop_size).astype(np.float32)
+        self.window = np.outer(window, window)
+
+    def prepare_batch(self, face_crops):
+        """Convert face crops (BGR or grayscale) into an (N, S, S) float32 stack"""
+        size = (self.crop_size, self.crop_size)
+        batch = np.empty((len(face_crops), self.crop_size, self.crop_size), dtype=np.float32)
+
+        for i, crop in enumerate(face_crops):
+            if crop.ndim == 3:
+                crop = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+            # INTER_AREA averages pixels when shrinking, which keeps aliasing low
+            batch[i] = cv2.resize(crop, size, interpolation=cv2.INTER_AREA)
+
+        return batch / 255.0
+
+    def lbp_histograms(self, batch):
+        """Uniform 8-neighbour LBP histograms, one row per crop"""
+        center = batch[:, 1:-1, 1:-1]
+        h, w = center.shape[1:]
+
+        # Neighbours in clockwise order, each compared against the centre pixel
+        offsets = [(0, 0), (0, 1), (0, 2), (1, 2), (2, 2), (2, 1), (2, 0), (1, 0)]
+        codes = np.zeros(center.shape, dtype=np.uint8)
+        for bit, (dy, dx) in enumerate(offsets):
+            neighbour = batch[:, dy:dy + h, dx:dx + w]
+            codes |= (neighbour >= center).astype(np.uint8) << bit
+
+        # Offset every crop into its own block of bins so one bincount covers the batch
+        bins = self.lbp_lut[codes].reshape(len(batch), -1).astype(np.int64)
+        bins += np.arange(len(batch))[:, None] * LBP_BINS
+        hist = np.bincount(bins.ravel(), minlength=len(batch) * LBP_BINS)
+        hist = hist.reshape(len(batch), LBP_BINS).astype(np.float32)
+        return hist / hist.sum(axis=1, keepdims=True)
+
+    def laplacian_energy(self, batch):
+        """Mean squared 4-neighbour Laplacian at each pyramid level, shape (N, scales)"""
+        energies = np.empty((len(batch), self.scales), dtype=np.float32)
+        level = batch
+
+        for scale in range(self.scales):
+            lap = (level[:, :-2, 1:-1] + level[:, 2:, 1:-1] +
+                   level[:, 1:-1, :-2] + level[:, 1:-1, 2:] -
+                   4.0 * level[:, 1:-1, 1:-1])
+            energies[:, scale] = np.mean(lap * lap, axis=(1, 2))
+
+            # 2x2 average pooling for the next (coarser) level
+            h, w = level.shape[1] // 2 * 2, level.shape[2] // 2 * 2
+            level = level[:, :h, :w].reshape(len(batch), h // 2, 2, w // 2, 2).mean(axis=(2, 4))
+
+        return energies
+
+    def moire_energy(self, batch):
+        """Band energy and peak/median ratio of the spectrum, shape (N, 2)"""
+        centered = batch - batch.mean(axis=(1, 2), keepdims=True)
+        spectrum = np.abs(np.fft.rfft2(centered * self.window)).astype(np.float32)
+        band = spectrum[:, self.moire_mask]
+
+        total = np.sum(spectrum * spectrum, axis=(1, 2)) + 1e-12
+        band_energy = np.sum(band * band, axis=1) / total
+        # Screens and halftone prints show up as isolated sharp peaks in this band
+        peak_ratio = band.max(axis=1) / (np.median(band, axis=1) + 1e-6)
+
+        return np.stack([band_energy, peak_ratio], axis=1)
+
+    def extract_batch(self, face_crops):
+        """Extract texture features for many face crops at once
+
+        Args:
+            face_crops: List of face images (BGR or grayscale), any size
+
+        Returns:
+            dict of float32 arrays with one row per crop
+        """
+        if len(face_crops) == 0:
+            return {
+                "lbp_hist": np.zeros((0, LBP_BINS), dtype=np.float32),
+                "laplacian_energy": np.zeros((0, self.scales), dtype=np.float32),
+                "moire": np.zeros((0, 2), dtype=np.float32)
+            }
+
+        batch = self.prepare_batch(face_crops)
+        return {
+            "lbp_hist": self.lbp_histograms(batch),
+            "laplacian_energy": self.laplacian_energy(batch),
+            "moire": self.moire_energy(batch)
+        }
+
+    def feature_vectors(self, face_crops):
+        """Flatten all texture features into one (N, D) matrix for a classifier"""
+        features = self.extract_batch(face_crops)
+        return np.hstack([
+            features["lbp_hist"],
+            np.log1p(features["laplacian_energy"] * 1e3),
+            features["moire"][:, :1],
+            np.log1p(features["moire"][:, 1:])
+        ]).astype(np.float32)
+
+    def score_batch(self, face_crops):
+        """Score many face crops for print/screen replay
+
+        Returns:
+            float32 array of replay scores in 0-1 (higher means more likely a spoof)
+        """
+        features = self.extract_batch(face_crops)
+        if len(face_crops) == 0:
+            return np.zeros(0, dtype=np.float32)
+
+        # Moire: strong isolated peaks in the mid/high frequency band
+        peak_ratio = features["moire"][:, 1]
+        moire_score = np.clip(np.log(np.maximum(peak_ratio, 1.0)) / np.log(MOIRE_PEAK_REF), 0.0, 1.0)
+
+        # Recaptured faces lose fine detail relative to the coarser levels
+        energy = features["laplacian_energy"]
+        detail_ratio = energy[:, 0] / (energy[:, -1] + 1e-9)
+        detail_score = np.clip(1.0 - detail_ratio / DETAIL_RATIO_REF, 0.0, 1.0)
+
+        return (REPLAY_WEIGHTS[0] * moire_score + REPLAY_WEIGHTS[1] * detail_score).astype(np.float32)
+
+    def score(self, face_crop):
+        """Replay score for a single face crop"""
+        return float(self.score_batch([face_crop])[0])
+
+
+# Create singleton instance
+texture_analyzer = TextureAnalyzer()
@@ -168,7 +168,11 @@ document.addEventListener("DOMContentLoaded", function () {
                 },
                 body: JSON.stringify({
                     image: imageData,
-                    filename: filename
+                    filename: filename,
+                    // Upload grant the scanned QR code was exchanged for, verified by the
+                    // backend, which also checks it was issued for this subject
+                    upload_grant: DEBUG_MODE ? undefined : sessionStorage.getItem("verifiedAuthKey"),
+                    subject: sessionStorage.getItem("verifiedSubject")
                 })
             });
 
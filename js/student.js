@@ -1,3 +1,6 @@
+// Backend that issues upload grants (same server as the selfie upload)
+const API_BASE_URL = 'http://192.168.1.7:5000/';
+
 document.addEventListener('DOMContentLoaded', function() {
     // Clear authorization on page load/reload
     if (performance.navigation.type === 1) { // Check if it's a page reload
@@ -16,6 +19,7 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 
     let qrScanner;
+    let requestingGrant = false;  // The scanner keeps firing while a grant is requested
 
     document.getElementById("startScanner").addEventListener("click", function () {
         // Initialize UI
@@ -88,41 +92,58 @@ document.addEventListener('DOMContentLoaded', function() {
                             throw new Error("QR code has expired. Please scan the current QR code.");
                         }
 
-                        // Store in both session and local storage for backup
-                        sessionStorage.setItem("isAuthorized", "true");
-                        sessionStorage.setItem("verifiedSubject", qrData.subject);
-                        sessionStorage.setItem("verifiedAuthKey", qrData.authKey);
-                        sessionStorage.setItem("verifiedTimestamp", qrData.timestamp);
-                        
-                        // Backup to localStorage
-                        localStorage.setItem("lastSuccessfulScan", JSON.stringify({
-                            subject: qrData.subject,
-                            authKey: qrData.authKey,
-                            timestamp: qrData.timestamp,
-                            scannedAt: scanTime
-                        }));
-
-                        console.log("Storage set:", {
-                            session: {
-                                isAuthorized: sessionStorage.getItem("isAuthorized"),
-                                subject: sessionStorage.getItem("verifiedSubject"),
-                                authKey: sessionStorage.getItem("verifiedAuthKey")
-                            },
-                            local: localStorage.getItem("lastSuccessfulScan")
-                        });
-
-                        // Success case
-                        document.getElementById("reader").style.border = "3px solid green";
-                        console.log("Valid QR code detected!");
-                        
-                        // Set a specific flag for valid QR scan
-                        sessionStorage.setItem("qrScanned", "true");
-                        alert("Access granted for subject: " + qrData.subject);
-                        
-                        stopQRScanner();
-                        setTimeout(() => {
-                            window.location.href = "selfie.html";
-                        }, 1000);
+                        // The QR token is only valid for a few seconds: exchange it now for an
+                        // upload grant that lasts as long as the selfie session
+                        if (requestingGrant) {
+                            return;
+                        }
+                        requestingGrant = true;
+                        fetch(`${API_BASE_URL}qr_grant`, {
+                            method: "POST",
+                            headers: { "Content-Type": "application/json" },
+                            body: JSON.stringify({ token: qrData.authKey, subject: qrData.subject })
+                        })
+                            .then(response => response.json().then(grant => ({ ok: response.ok, grant })))
+                            .then(({ ok, grant }) => {
+                                if (!ok) {
+                                    throw new Error(grant.error || "QR code was not accepted. Please scan the current QR code.");
+                                }
+
+                                // Store in both session and local storage for backup
+                                sessionStorage.setItem("isAuthorized", "true");
+                                sessionStorage.setItem("verifiedSubject", grant.subject);
+                                sessionStorage.setItem("verifiedAuthKey", grant.grant);
+                                sessionStorage.setItem("verifiedTimestamp", Date.now().toString());
+
+                                // Backup to localStorage
+                                localStorage.setItem("lastSuccessfulScan", JSON.stringify({
+                                    subject: grant.subject,
+                                    authKey: grant.grant,
+                                    timestamp: qrData.timestamp,
+                                    scannedAt: scanTime
+                                }));
+
+                                // Success case
+                                document.getElementById("reader").style.border = "3px solid green";
+                                console.log("Valid QR code detected!");
+
+                                // Set a specific flag for valid QR scan
+                                sessionStorage.setItem("qrScanned", "true");
+                                alert("Access granted for subject: " + grant.subject);
+
+                                stopQRScanner();
+                                setTimeout(() => {
+                                    window.location.href = "selfie.html";
+                                }, 1000);
+                            })
+                            .catch(error => {
+                                console.error("QR Grant Error:", error);
+                                document.getElementById("reader").style.border = "3px solid red";
+                                alert(error.message);
+                            })
+                            .finally(() => {
+                                requestingGrant = false;
+                            });
                         
                     } catch (error) {
                         console.error("QR Processing Error:", error);
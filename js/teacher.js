@@ -1,3 +1,6 @@
+// Flask upload backend that issues the signed QR tokens
+const API_BASE_URL = 'http://192.168.1.7:5000/';
+
 let qrInterval;
 let countdownInterval;
 let countdownElement;
@@ -50,16 +53,28 @@ document.getElementById("generateQR").addEventListener("click", function () {
     }
 });
 
-function generateAndDisplayQR(subject) {
-    const authKey = generateAuthKey();
+async function generateAndDisplayQR(subject) {
+    // Tokens are signed by the backend so uploads can be verified server-side
+    let tokenData;
+    try {
+        const response = await fetch(`${API_BASE_URL}qr_token?subject=${encodeURIComponent(subject)}`);
+        tokenData = await response.json();
+        if (!response.ok) {
+            throw new Error(tokenData.error || "Could not get QR token");
+        }
+    } catch (error) {
+        console.error("QR token error:", error);
+        return;
+    }
+
     const timestamp = Date.now();
     
     // Create QR data with longer validity (6 seconds to account for delay)
     const qrData = JSON.stringify({ 
         subject,
-        authKey,
+        authKey: tokenData.token,
         timestamp,
-        validUntil: timestamp + 2000 // 6 second validity for overlap
+        validUntil: Math.round(tokenData.expires_at * 1000)
     });
 
     // Generate QR code
@@ -76,15 +91,11 @@ function generateAndDisplayQR(subject) {
 
     console.log("Generated new QR code:", {
         subject,
-        authKey,
+        token: tokenData.token,
         timestamp: new Date(timestamp).toISOString()
     });
 }
 
-function generateAuthKey() {
-    return Math.random().toString(36).substr(2, 8);
-}
-
 // Clean up intervals when leaving the page
 window.addEventListener('beforeunload', () => {
     if (qrInterval) clearInterval(qrInterval);